@@ -0,0 +1,229 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+
+from histogram import LatencyHistogram
+
+# 最后这段时间内用忙等代替sleep，保证亚毫秒级的发送精度
+SPIN_THRESHOLD = 0.002
+
+
+class ConstantProfile:
+    """固定速率"""
+
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("rate必须大于0")
+        self.rate = rate
+
+    def times(self):
+        k = 0
+        while True:
+            yield k / self.rate
+            k += 1
+
+    def describe(self):
+        return f"constant {self.rate}/s"
+
+
+class RampProfile:
+    """在duration秒内从start_rate线性增加(或减少)到end_rate，之后保持end_rate"""
+
+    def __init__(self, start_rate, end_rate, duration):
+        if duration <= 0 or start_rate < 0 or end_rate < 0 or start_rate == end_rate == 0:
+            raise ValueError("ramp参数无效")
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self.duration = duration
+
+    def times(self):
+        r0, r1, d = self.start_rate, self.end_rate, self.duration
+        a = (r1 - r0) / d
+        ramp_count = (r0 + r1) * d / 2
+        k = 0
+        # 累计到达数 N(t) = r0*t + a*t^2/2，第k个请求在 N(t) = k 时发出
+        while k <= ramp_count:
+            yield 2 * k / (r0 + math.sqrt(max(0.0, r0 * r0 + 2 * a * k))) if k else 0.0
+            k += 1
+        if r1 <= 0:
+            return
+        while True:
+            yield d + (k - ramp_count) / r1
+            k += 1
+
+    def describe(self):
+        return f"ramp {self.start_rate}->{self.end_rate}/s over {self.duration}s"
+
+
+class StepProfile:
+    """阶梯速率: steps 为 [(rate, 持续秒数)]，最后一级之后保持最后的速率"""
+
+    def __init__(self, steps):
+        if not steps or steps[-1][0] <= 0:
+            raise ValueError("step至少需要一级，且最后一级速率大于0")
+        self.steps = steps
+
+    def times(self):
+        offset = 0.0
+        carry = 0.0
+        for rate, duration in self.steps:
+            if rate > 0:
+                # carry 为上一级剩余的不足一个请求的时间份额，保证级间衔接平滑
+                t = carry / rate
+                while t < duration:
+                    yield offset + t
+                    t += 1 / rate
+                carry = (t - duration) * rate
+            offset += duration
+        rate = self.steps[-1][0]
+        t = carry / rate
+        while True:
+            yield offset + t
+            t += 1 / rate
+
+    def describe(self):
+        return "step " + ",".join(f"{rate}/s x {duration}s" for rate, duration in self.steps)
+
+
+class PoissonProfile:
+    """泊松到达，burst>1 时每次到达连续发出burst个请求(平均速率不变)"""
+
+    def __init__(self, rate, burst=1, seed=None):
+        if rate <= 0 or burst < 1:
+            raise ValueError("poisson参数无效")
+        self.rate = rate
+        self.burst = int(burst)
+        self.seed = seed
+
+    def times(self):
+        rng = random.Random(self.seed)
+        t = 0.0
+        while True:
+            for _ in range(self.burst):
+                yield t
+            t += rng.expovariate(self.rate / self.burst)
+
+    def describe(self):
+        return f"poisson {self.rate}/s" + (f" burst {self.burst}" if self.burst > 1 else "")
+
+
+def parse_profile(spec):
+    """解析命令行的到达模型
+
+    constant:RATE | ramp:START:END:SECONDS | step:RATExSECONDS,RATExSECONDS,... | poisson:RATE[:BURST]
+    """
+    kind, _, rest = spec.partition(":")
+    args = rest.split(":") if rest else []
+    try:
+        if kind == "constant":
+            return ConstantProfile(float(args[0]))
+        if kind == "ramp":
+            return RampProfile(float(args[0]), float(args[1]), float(args[2]))
+        if kind == "step":
+            steps = []
+            for item in rest.split(","):
+                rate, duration = item.split("x")
+                steps.append((float(rate), float(duration)))
+            return StepProfile(steps)
+        if kind == "poisson":
+            return PoissonProfile(float(args[0]), int(args[1]) if len(args) > 1 else 1)
+    except (IndexError, ValueError) as e:
+        raise ValueError(f"无效的到达模型 {spec}: {e}")
+    raise ValueError(f"未知的到达模型 {spec}，可选 constant/ramp/step/poisson")
+
+
+class ArrivalScheduler:
+    """基于单调时钟的令牌桶，令牌按到达模型的时间点放入
+
+    wait()/wait_async() 取出下一个令牌，返回 (序号, 计划发送时间)；计划时间只由到达模型决定，
+    不受发送方阻塞的影响(开环)。实际取出时间与计划时间之差记入 lag 直方图(秒)。
+    max_burst 不为空时，落后超过 max_burst 个令牌的部分直接丢弃并计入 skipped。
+    """
+
+    def __init__(self, profile, max_burst=None):
+        self.profile = profile
+        self.max_burst = max_burst
+        self.lag = LatencyHistogram(resolution=1e-6)
+        self.skipped = 0
+        self.start = None
+        self._times = None
+        self._pending = deque()
+        self._index = 0
+
+    def begin(self, start=None):
+        self.start = time.monotonic() if start is None else start
+        self._times = self.profile.times()
+        self._pending = deque()
+        self._index = 0
+        return self
+
+    def _next(self):
+        """取出下一个令牌的计划时间，到达模型结束时返回None"""
+        if self._times is None:
+            self.begin()
+        if self.max_burst is not None:
+            now = time.monotonic()
+            # 取出所有已到期的令牌(再多取一个未到期的)，桶里最多保留max_burst个
+            try:
+                while not self._pending or self._pending[-1] <= now:
+                    self._pending.append(self.start + next(self._times))
+            except StopIteration:
+                pass
+            overdue = sum(1 for t in self._pending if t <= now)
+            while overdue > max(self.max_burst, 1):
+                self._pending.popleft()
+                self.skipped += 1
+                overdue -= 1
+            if not self._pending:
+                return None
+            intended = self._pending.popleft()
+        else:
+            intended = next(self._times, None)
+            if intended is None:
+                return None
+            intended += self.start
+        index = self._index
+        self._index += 1
+        return index, intended
+
+    def _record(self, intended):
+        self.lag.record(max(0.0, time.monotonic() - intended))
+
+    def wait(self):
+        """阻塞到下一个计划发送时间，返回 (序号, 计划时间)，到达模型结束时返回None"""
+        item = self._next()
+        if item is None:
+            return None
+        index, intended = item
+        remaining = intended - time.monotonic()
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(remaining - SPIN_THRESHOLD)
+        while time.monotonic() < intended:
+            pass
+        self._record(intended)
+        return index, intended
+
+    async def wait_async(self):
+        """asyncio版本: 先sleep到接近计划时间，最后一小段让出事件循环轮询"""
+        item = self._next()
+        if item is None:
+            return None
+        index, intended = item
+        remaining = intended - time.monotonic()
+        if remaining > SPIN_THRESHOLD:
+            await asyncio.sleep(remaining - SPIN_THRESHOLD)
+        while time.monotonic() < intended:
+            await asyncio.sleep(0)
+        self._record(intended)
+        return index, intended
+
+    def print_lag(self):
+        """打印调度滞后统计(ms)"""
+        if not self.lag.count:
+            return
+        p50, p99 = self.lag.percentiles(50, 99)
+        print(f"调度滞后 ({self.profile.describe()}): 平均 {self.lag.mean * 1000:.3f}ms, "
+              f"P50 {p50 * 1000:.3f}ms, P99 {p99 * 1000:.3f}ms, 最大 {self.lag.max * 1000:.3f}ms"
+              + (f", 丢弃 {self.skipped}" if self.skipped else ""))
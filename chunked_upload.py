@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import io
+import math
+import mmap
+import os
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import cleanup
+from dataplane import create_sandboxes, format_size, parse_size
+from histogram import LatencyHistogram
+
+# 加载环境变量
+load_dotenv()
+
+# 大文件分块并行上传
+#
+# 本地文件用mmap映射，每个分块包装成只读的文件对象交给 files.write 流式发送，
+# 任何时候内存中只有SDK正在发送的一小段数据，不会把整个文件读进内存。
+# 文件切成 chunk_size 大小的分块写到 {远程路径}.part.NNNNN，同一个sandbox的多个分块并行上传，
+# 全部完成后在sandbox中拼接并用 sha256sum 与本地的校验值比对。
+# 所有上传共享一个全局带宽上限(字节/秒)，多个sandbox同时上传时总流量也不会超过它。
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 4
+# 令牌桶每次最多取这么多字节，限速时不会一次放行整个分块
+READ_BLOCK = 256 * 1024
+
+
+class BandwidthLimiter:
+    """全局令牌桶(字节/秒)，rate为0表示不限速；可被多个线程同时使用"""
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst or max(READ_BLOCK, rate / 10)
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def acquire(self, size):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 先扣除再按欠下的额度等待，多个线程排队时总速率仍然不超过rate
+            self.tokens -= size
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class MappedChunk(io.RawIOBase):
+    """mmap中 [offset, offset+length) 的只读文件对象，每次读取前向限速器申请额度"""
+
+    def __init__(self, mapped, offset, length, limiter=None):
+        super().__init__()
+        self.mapped = mapped
+        self.offset = offset
+        self.length = length
+        self.limiter = limiter
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = max(0, min(offset, self.length))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.length - self.position, READ_BLOCK)
+        if size <= 0:
+            return 0
+        if self.limiter:
+            self.limiter.acquire(size)
+        start = self.offset + self.position
+        buffer[:size] = self.mapped[start:start + size]
+        self.position += size
+        return size
+
+
+class MappedFile:
+    """映射到内存的本地文件及其sha256，文件变化(mtime/大小)后重新映射
+
+    users 为正在使用它的上传数，由 ChunkedUploader 在锁内维护；用完后调用 close() 释放映射。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.version = (st.st_mtime_ns, st.st_size)
+        self.size = st.st_size
+        self.users = 0
+        # 已被新映射替换，最后一个使用者结束时关闭
+        self.retired = False
+        self.mapped = None
+        if self.size:
+            with open(path, "rb") as f:
+                self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 直接对映射的内存计算校验值，不复制
+        digest = hashlib.sha256()
+        if self.mapped is not None:
+            digest.update(memoryview(self.mapped))
+        self.sha256 = digest.hexdigest()
+
+    def chunks(self, chunk_size, limiter=None):
+        """返回 [(序号, MappedChunk)]，空文件返回一个空分块"""
+        if not self.size:
+            return [(0, io.BytesIO(b""))]
+        return [(index, MappedChunk(self.mapped, offset, min(chunk_size, self.size - offset), limiter))
+                for index, offset in enumerate(range(0, self.size, chunk_size))]
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+
+class ChunkedUploader:
+    """把本地文件分块并行上传到sandbox并校验，统计每个sandbox和全部上传的MB/s
+
+    workers 为单个sandbox同时上传的分块数；跨sandbox的并行来自调用方(每个sandbox一个线程)，
+    bandwidth 为所有上传共享的带宽上限(字节/秒)，0表示不限速。
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS, bandwidth=0, verify=True):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.limiter = BandwidthLimiter(bandwidth)
+        self.verify = verify
+
+        self.lock = threading.Lock()
+        self._files = {}
+        # MB/s 分布(精度0.01MB/s)
+        self.throughput = LatencyHistogram(resolution=0.01, max_value=100000)
+        self.per_sandbox = {}
+        self.total_bytes = 0
+        self.failures = 0
+        self.first_start = None
+        self.last_end = None
+
+    def acquire(self, path):
+        """返回文件的映射并登记一个使用者，用完后调用 release()；文件变化后重新映射，
+        旧映射在最后一个仍在使用它的上传 release() 时关闭"""
+        st = os.stat(path)
+        with self.lock:
+            cached = self._files.get(path)
+            if cached and cached.version == (st.st_mtime_ns, st.st_size):
+                cached.users += 1
+                return cached
+        mapped = MappedFile(path)
+        with self.lock:
+            cached = self._files.get(path)
+            if cached and cached.version == mapped.version:
+                # 其他线程已经映射了同一版本
+                mapped.close()
+                mapped = cached
+            else:
+                if cached:
+                    self._retire(cached)
+                self._files[path] = mapped
+            mapped.users += 1
+        return mapped
+
+    def release(self, mapped):
+        with self.lock:
+            mapped.users -= 1
+            if mapped.retired and mapped.users <= 0:
+                mapped.close()
+
+    def _retire(self, mapped):
+        """调用方持有 self.lock"""
+        mapped.retired = True
+        if mapped.users <= 0:
+            mapped.close()
+
+    def close(self):
+        """关闭所有映射，之后不能再上传；仍在进行的上传结束时才关闭它们使用的映射"""
+        with self.lock:
+            for mapped in self._files.values():
+                self._retire(mapped)
+            self._files.clear()
+
+    def _write_chunk(self, sbx, remote, chunk):
+        sbx.files.write(remote, chunk)
+
+    def upload(self, sbx, paths, remote_dir="/home/user", sandbox_id=None):
+        """上传 paths 到 remote_dir 下的同名文件，校验失败抛出异常；返回 (字节数, 耗时秒)"""
+        start = time.monotonic()
+        with self.lock:
+            if self.first_start is None:
+                self.first_start = start
+
+        files = []
+        try:
+            for path in paths:
+                files.append((self.acquire(path), f"{remote_dir}/{os.path.basename(path)}"))
+            jobs = []
+            for mapped, remote in files:
+                chunks = mapped.chunks(self.chunk_size, self.limiter)
+                if len(chunks) == 1:
+                    jobs.append((remote, chunks[0][1]))
+                else:
+                    jobs.extend((f"{remote}.part.{index:05d}", chunk) for index, chunk in chunks)
+
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(jobs)))) as executor:
+                for future in [executor.submit(self._write_chunk, sbx, remote, chunk) for remote, chunk in jobs]:
+                    future.result()
+            self._finish(sbx, files)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        finally:
+            for mapped, _ in files:
+                self.release(mapped)
+
+        elapsed = time.monotonic() - start
+        size = sum(mapped.size for mapped, _ in files)
+        key = sandbox_id or getattr(sbx, "sandbox_id", None) or id(sbx)
+        with self.lock:
+            self.total_bytes += size
+            self.last_end = time.monotonic()
+            stats = self.per_sandbox.setdefault(key, [0, 0.0])
+            stats[0] += size
+            stats[1] += elapsed
+            if elapsed > 0 and size:
+                self.throughput.record(size / elapsed / 1e6)
+        return size, elapsed
+
+    def _finish(self, sbx, files):
+        """拼接分块并在一次命令中校验所有文件的sha256"""
+        commands = []
+        for mapped, remote in files:
+            if mapped.size > self.chunk_size:
+                # 只拼接本次写入的分块，之前中断的上传留下的多余分块不会混进来
+                parts = " ".join(shlex.quote(f"{remote}.part.{index:05d}")
+                                 for index in range(math.ceil(mapped.size / self.chunk_size)))
+                commands.append(f"cat {parts} > {shlex.quote(remote)} && rm -f {parts}")
+        if self.verify:
+            commands.append("sha256sum " + " ".join(shlex.quote(remote) for _, remote in files))
+        if not commands:
+            return
+        execution = sbx.commands.run(" && ".join(commands))
+        if not self.verify:
+            return
+        remote_digests = {}
+        for line in execution.stdout.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                remote_digests[parts[1].strip()] = parts[0]
+        for mapped, remote in files:
+            if remote_digests.get(remote) != mapped.sha256:
+                raise RuntimeError(f"{remote} 校验失败: 本地 {mapped.sha256[:12]}, "
+                                   f"远程 {(remote_digests.get(remote) or '无')[:12]}")
+
+    def aggregate_mb_s(self):
+        """从第一次上传开始到最后一次完成的整体吞吐"""
+        with self.lock:
+            if not self.first_start or not self.last_end or self.last_end <= self.first_start:
+                return 0.0
+            return self.total_bytes / (self.last_end - self.first_start) / 1e6
+
+    def print_stats(self, per_sandbox=False):
+        with self.lock:
+            items = list(self.per_sandbox.items())
+            count = self.throughput.count
+        if not count and not self.failures:
+            return
+        limit = f", 带宽上限 {format_size(int(self.limiter.rate))}/s" if self.limiter.rate > 0 else ""
+        print(f"=== 分块上传 (分块 {format_size(self.chunk_size)}, 每个sandbox并行 {self.workers}{limit}) ===")
+        print(f"  上传 {count} 次, 失败 {self.failures} 次, 共 {self.total_bytes / 1e6:.1f}MB, "
+              f"聚合 {self.aggregate_mb_s():.1f}MB/s")
+        if count:
+            p50, p90, p99 = self.throughput.percentiles(50, 90, 99)
+            print(f"  单次上传 MB/s: P50 {p50:.1f}, P90 {p90:.1f}, P99 {p99:.1f}")
+        if per_sandbox:
+            for key, (size, elapsed) in items:
+                print(f"  {key}: {size / 1e6:.1f}MB, {size / elapsed / 1e6 if elapsed else 0:.1f}MB/s")
+
+
+def add_arguments(parser):
+    """给上传文件的脚本加上分块上传相关参数"""
+    parser.add_argument('--chunk-size', type=parse_size, default=DEFAULT_CHUNK_SIZE,
+                      help='Files larger than this are memory-mapped and uploaded in chunks of this size (default: 8MB)')
+    parser.add_argument('--upload-workers', type=int, default=DEFAULT_WORKERS,
+                      help=f'Chunks uploaded in parallel per sandbox (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--upload-bandwidth', type=parse_size, default=0,
+                      help='Global upload bandwidth cap in bytes per second, e.g. 200MB (default: 0, unlimited)')
+
+
+def from_args(args, share=1):
+    """按命令行参数创建上传器，share 为分摊带宽上限的进程数"""
+    return ChunkedUploader(chunk_size=args.chunk_size, workers=args.upload_workers,
+                           bandwidth=args.upload_bandwidth / max(1, share))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload large files to sandboxes in parallel chunks and verify them')
+    parser.add_argument('files', nargs='+', help='Local files to upload')
+    parser.add_argument('--sandboxes', type=int, default=4,
+                      help='Sandboxes uploaded to in parallel (default: 4)')
+    parser.add_argument('--repeat', type=int, default=1,
+                      help='Uploads per sandbox (default: 1)')
+    parser.add_argument('--remote-dir', default="/home/user",
+                      help='Destination directory in the sandbox (default: /home/user)')
+    parser.add_argument('--timeout', type=int, default=600,
+                      help='Sandbox timeout in seconds (default: 600)')
+    add_arguments(parser)
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+
+    uploader = from_args(args)
+    total = sum(os.path.getsize(path) for path in args.files)
+    with cleanup.from_args(args):
+        sandboxes = create_sandboxes(args.sandboxes, args.timeout, purpose="chunked-upload")
+        print(f"创建 {len(sandboxes)}/{args.sandboxes} 个sandbox，每个上传 {len(args.files)} 个文件 "
+              f"({total / 1e6:.1f}MB) x {args.repeat} 次")
+
+        def upload_all(sbx):
+            for _ in range(args.repeat):
+                try:
+                    uploader.upload(sbx, args.files, args.remote_dir)
+                except Exception as e:
+                    print(f"{sbx.sandbox_id} 上传失败: {e}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(sandboxes))) as executor:
+                list(executor.map(upload_all, sandboxes))
+            uploader.print_stats(per_sandbox=True)
+        finally:
+            uploader.close()
+            for sbx in sandboxes:
+                try:
+                    sbx.kill()
+                except Exception as e:
+                    print(f"删除sandbox失败: {e}")
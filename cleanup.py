@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+from dotenv import load_dotenv
+
+import request_policy
+from arrival import ArrivalScheduler, ConstantProfile
+from e2b_client import AsyncE2BClient, E2BClient, ENDPOINT_TIMEOUTS
+from histogram import ms_histogram
+from load_engine import run_open_loop
+
+# 加载环境变量
+load_dotenv()
+
+# 压测脚本创建sandbox时写入的metadata
+PURPOSE_KEY = "purpose"
+DEFAULT_PREFIX = "performance-test-gj"
+RUN_KEY = "run"
+# 本次运行的标识，同一台机器上同时跑的其他压测不会被 --cleanup 误删；fork出的子进程沿用父进程的值
+RUN_ID = os.getenv("E2B_RUN_ID") or f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+
+STATES = ("running", "paused")
+PAGE_SIZE = 100
+KILL_RATE = 2000
+KILL_CONCURRENCY = 100
+
+
+def run_metadata(purpose=DEFAULT_PREFIX):
+    """创建sandbox时使用的metadata，带上本次运行的标识"""
+    return {PURPOSE_KEY: purpose, RUN_KEY: RUN_ID}
+
+
+def list_sandboxes(client, key=PURPOSE_KEY, prefix=DEFAULT_PREFIX, exact=False, states=STATES, page_size=PAGE_SIZE):
+    """按metadata逐页列出sandbox，返回 metadata[key] 以 prefix 开头(exact=True 时完全相等)的sandbox
+
+    完全匹配时交给服务端过滤；前缀匹配只能取回全部sandbox后在本地过滤。
+    """
+    token = None
+    while True:
+        params = {"state": ",".join(states), "limit": page_size}
+        if exact:
+            params["metadata"] = f"{key}={prefix}"
+        if token:
+            params["nextToken"] = token
+        response = client.list_sandboxes(params)
+        if not response.succeeded:
+            raise RuntimeError(f"列出sandbox失败，状态码: {response.status_code}, 错误: {response.text[:100]}")
+        for sandbox in response.json():
+            value = (sandbox.get("metadata") or {}).get(key, "")
+            if value == prefix if exact else value.startswith(prefix):
+                yield sandbox
+        token = response.headers.get("x-next-token")
+        if not token:
+            return
+
+
+async def kill_all(sandbox_ids, rate=KILL_RATE, concurrency=KILL_CONCURRENCY):
+    """以不超过 rate 个/秒、concurrency 个并发删除sandbox，返回 (删除耗时直方图ms, 已不存在数, 失败列表)
+
+    用asyncio开环发送，数千个sandbox几秒内即可删完(线程池版本受GIL限制只有几百个/秒)。
+    """
+    latencies = ms_histogram()
+    gone = [0]
+    failed = []
+
+    def on_done(record):
+        status = record["result"]
+        sandbox_id = sandbox_ids[record["index"]]
+        if isinstance(status, Exception):
+            failed.append((sandbox_id, str(status)))
+        elif status == 404:
+            # 已经被删除或超时销毁
+            gone[0] += 1
+        elif status in request_policy.SUCCESS_CODES:
+            latencies.record(record["service_time_ms"])
+        else:
+            failed.append((sandbox_id, f"状态码: {status}"))
+
+    policies = request_policy.build_policies(ENDPOINT_TIMEOUTS)
+    async with AsyncE2BClient(pool_size=concurrency, policies=policies) as client:
+        async def kill(index):
+            status, _, _, _ = await client.kill_sandbox(sandbox_ids[index])
+            return status
+
+        await run_open_loop(
+            kill,
+            total=len(sandbox_ids),
+            scheduler=ArrivalScheduler(ConstantProfile(rate)),
+            max_in_flight=concurrency,
+            on_done=on_done,
+            collect=False
+        )
+    return latencies, gone[0], failed
+
+
+def cleanup(key=PURPOSE_KEY, prefix=DEFAULT_PREFIX, exact=False, rate=KILL_RATE,
+            concurrency=KILL_CONCURRENCY, verify_rounds=2, dry_run=False, hedge=None):
+    """列出并删除匹配的sandbox，然后重新列出确认已删除(仍存在的再删，最多 verify_rounds 轮)
+
+    hedge 为列表请求的对冲设置(见 request_policy)，返回统计数据，同时打印删除吞吐和延迟。
+    """
+    client = E2BClient(pool_size=2 if hedge else 1,
+                       policies=request_policy.build_policies(ENDPOINT_TIMEOUTS, hedge=hedge))
+    match = f"{key}={prefix}" if exact else f"{key}={prefix}*"
+    start = time.monotonic()
+    stats = {"listed": 0, "killed": 0, "gone": 0, "failed": 0, "remaining": 0, "rounds": 0}
+    latencies = ms_histogram()
+    kill_elapsed = 0.0
+    failed = []
+    try:
+        for round_index in range(verify_rounds + 1):
+            sandbox_ids = [s["sandboxID"] for s in list_sandboxes(client, key, prefix, exact)]
+            if round_index == 0:
+                stats["listed"] = len(sandbox_ids)
+                print(f"清理 {match}: 找到 {len(sandbox_ids)} 个sandbox (列表耗时 {time.monotonic() - start:.2f}s)")
+            stats["remaining"] = len(sandbox_ids)
+            if not sandbox_ids or dry_run:
+                break
+            if round_index == verify_rounds:
+                break
+            if round_index > 0:
+                print(f"第 {round_index} 轮确认: 仍有 {len(sandbox_ids)} 个sandbox，重新删除")
+            stats["rounds"] += 1
+            kill_start = time.monotonic()
+            hist, gone, failed = asyncio.run(kill_all(sandbox_ids, rate, concurrency))
+            kill_elapsed += time.monotonic() - kill_start
+            latencies.merge(hist)
+            stats["killed"] += hist.count
+            stats["gone"] += gone
+    finally:
+        if hedge:
+            client.policies["list"].print_summary()
+        client.close()
+
+    stats["failed"] = len(failed)
+    stats["elapsed_s"] = time.monotonic() - start
+    stats["kills_per_s"] = stats["killed"] / kill_elapsed if kill_elapsed > 0 else 0
+    if dry_run:
+        print("dry run: 没有删除任何sandbox")
+        return stats
+    if stats["listed"]:
+        print(f"已删除 {stats['killed']} 个, 已不存在 {stats['gone']} 个, 失败 {stats['failed']} 个, "
+              f"剩余 {stats['remaining']} 个; 总耗时 {stats['elapsed_s']:.2f}s, 删除吞吐 {stats['kills_per_s']:.1f}/s")
+    if latencies.count:
+        p50, p90, p99 = latencies.percentiles(50, 90, 99)
+        print(f"删除耗时 (ms): P50 {p50:.2f}, P90 {p90:.2f}, P99 {p99:.2f}, 最大 {latencies.max:.2f}")
+    for sandbox_id, error in failed[:10]:
+        print(f"  删除 {sandbox_id} 失败: {error}")
+    return stats
+
+
+def _on_sigterm(signum, frame):
+    # 转成SystemExit，让 auto_cleanup 的finally得以执行
+    sys.exit(128 + signum)
+
+
+@contextmanager
+def auto_cleanup(**kwargs):
+    """with块结束时(包括ctrl+c和SIGTERM)删除本次运行创建的sandbox
+
+    ctrl+c 会变成 KeyboardInterrupt 穿过with块，SIGTERM 也被转成异常，因此都会执行清理；
+    不使用atexit，因为解释器退出阶段已经不能再使用线程池和asyncio的DNS解析。
+    fork出的worker进程不会回到with块，清理只在主进程中进行一次。
+    """
+    print(f"退出时将清理本次运行(run={RUN_ID})创建的sandbox")
+    previous = signal.signal(signal.SIGTERM, _on_sigterm)
+    try:
+        yield
+    finally:
+        # 清理期间忽略重复的ctrl+c
+        interrupt = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            cleanup(key=RUN_KEY, prefix=RUN_ID, exact=True, **kwargs)
+        except Exception as e:
+            print(f"自动清理失败: {e}，可稍后运行 python cleanup.py --run {RUN_ID}")
+        finally:
+            signal.signal(signal.SIGINT, interrupt)
+            signal.signal(signal.SIGTERM, previous)
+
+
+def add_arguments(parser):
+    """给创建sandbox的脚本加上 --cleanup 参数"""
+    parser.add_argument('--cleanup', action='store_true',
+                      help='Kill the sandboxes created by this run when the script exits or is interrupted')
+
+
+def from_args(args):
+    """指定了 --cleanup 时返回 auto_cleanup()，否则返回什么都不做的上下文"""
+    if not getattr(args, "cleanup", False):
+        return nullcontext()
+    # 脚本的 --hedge (request_policy) 同样作用于清理时的列表请求
+    return auto_cleanup(hedge=getattr(args, "hedge", None))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Kill test sandboxes selected by metadata')
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX,
+                      help=f'Kill sandboxes whose metadata value starts with this (default: {DEFAULT_PREFIX})')
+    parser.add_argument('--key', default=PURPOSE_KEY,
+                      help=f'Metadata key to match (default: {PURPOSE_KEY})')
+    parser.add_argument('--run', default=None,
+                      help='Only kill sandboxes from this run id (metadata run=ID), as printed by --cleanup')
+    parser.add_argument('--rate', type=float, default=KILL_RATE,
+                      help=f'Max kill requests per second (default: {KILL_RATE})')
+    parser.add_argument('--concurrency', type=int, default=KILL_CONCURRENCY,
+                      help=f'Max concurrent kill requests (default: {KILL_CONCURRENCY})')
+    parser.add_argument('--verify-rounds', type=int, default=2,
+                      help='Times to re-list and kill sandboxes that are still present (default: 2)')
+    parser.add_argument('--dry-run', action='store_true', help='Only list matching sandboxes')
+    parser.add_argument('--hedge', default=None, metavar='MS|pNN',
+                      help='Send a duplicate of list page requests still pending after MS ms, or after the '
+                           'observed first-attempt percentile, e.g. p95 (default: disabled)')
+    args = parser.parse_args()
+
+    if args.run:
+        result = cleanup(key=RUN_KEY, prefix=args.run, exact=True, rate=args.rate, concurrency=args.concurrency,
+                         verify_rounds=args.verify_rounds, dry_run=args.dry_run, hedge=args.hedge)
+    else:
+        result = cleanup(key=args.key, prefix=args.prefix, rate=args.rate, concurrency=args.concurrency,
+                         verify_rounds=args.verify_rounds, dry_run=args.dry_run, hedge=args.hedge)
+    sys.exit(1 if result["remaining"] and not args.dry_run else 0)
@@ -0,0 +1,290 @@
+import argparse
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+
+from histogram import load_histograms
+
+# 原始样本先按0.1%的相对精度分桶，千万级样本也只剩几千个桶，bootstrap在桶上做多项式重采样
+BUCKET_PRECISION = 1e-3
+DEFAULT_PERCENTILES = [50, 90, 99]
+# 各分位数允许的最大变慢比例(%)
+DEFAULT_THRESHOLDS = {50: 10.0, 90: 15.0, 99: 20.0}
+
+# 批处理脚本的原始结果: 文件名 -> (操作名, 耗时列, 成功判断)
+RESULT_FILES = {
+    "create_results.csv": ("create", ["latency_ms", "create_time_ms"], "success"),
+    "pause_results.csv": ("pause", ["pause_time_ms"], None),
+    "resume_results.csv": ("resume", ["resume_time_ms"], None),
+}
+
+
+class Distribution:
+    """按值排序的 (桶值, 样本数) 以及失败次数，单位ms"""
+
+    def __init__(self, values, counts, errors=0):
+        order = np.argsort(values)
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.counts = np.asarray(counts, dtype=np.int64)[order]
+        self.errors = int(errors)
+
+    @classmethod
+    def from_samples(cls, samples, errors=0):
+        samples = np.asarray(samples, dtype=np.float64)
+        samples = samples[samples > 0]
+        if not len(samples):
+            return cls([], [], errors)
+        step = math.log1p(BUCKET_PRECISION)
+        keys, counts = np.unique(np.round(np.log(samples) / step).astype(np.int64), return_counts=True)
+        return cls(np.exp(keys * step), counts, errors)
+
+    @classmethod
+    def from_histogram(cls, hist, scale=1.0):
+        buckets = list(hist.iter_buckets())
+        if not buckets:
+            return cls([], [])
+        values, counts = zip(*buckets)
+        return cls(np.array(values) * scale, counts)
+
+    def merge(self, other):
+        values = np.concatenate([self.values, other.values])
+        counts = np.concatenate([self.counts, other.counts])
+        keys, inverse = np.unique(values, return_inverse=True)
+        return Distribution(keys, np.bincount(inverse, weights=counts).astype(np.int64), self.errors + other.errors)
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    @property
+    def error_rate(self):
+        total = self.n + self.errors
+        return self.errors / total if total else 0.0
+
+    def percentiles(self, ps):
+        return _percentiles(self.values, np.cumsum(self.counts)[None, :], ps)[0]
+
+
+def _percentiles(values, cum, ps):
+    """cum 为 (重采样次数, 桶数) 的累计样本数，返回 (重采样次数, len(ps)) 的分位数"""
+    total = cum[:, -1:]
+    out = np.empty((cum.shape[0], len(ps)))
+    for j, p in enumerate(ps):
+        rank = np.maximum(np.ceil(total * p / 100.0), 1)
+        index = (cum < rank).sum(axis=1)
+        out[:, j] = values[np.minimum(index, len(values) - 1)]
+    return out
+
+
+def bootstrap(dist, ps, iterations, rng):
+    """多项式重采样各桶的样本数，返回 (iterations, len(ps)) 的分位数"""
+    resampled = rng.multinomial(dist.n, dist.counts / dist.n, size=iterations)
+    return _percentiles(dist.values, np.cumsum(resampled, axis=1), ps)
+
+
+def mann_whitney(a, b):
+    """基于桶计数的Mann-Whitney U检验(正态近似，含并列修正)
+
+    返回 (b大于a的概率估计, 双侧p值)；两组样本都来自分好的桶，相同桶视为并列。
+    """
+    values = np.union1d(a.values, b.values)
+    ca = np.zeros(len(values))
+    cb = np.zeros(len(values))
+    ca[np.searchsorted(values, a.values)] = a.counts
+    cb[np.searchsorted(values, b.values)] = b.counts
+    n1, n2 = ca.sum(), cb.sum()
+    # b中每个样本: 比它小的a样本数 + 并列的一半
+    a_below = np.cumsum(ca) - ca
+    u = float((cb * (a_below + ca / 2)).sum())
+    ties = ca + cb
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - float((ties ** 3 - ties).sum()) / (n * (n - 1))))
+    if sigma == 0:
+        return 0.5, 1.0
+    z = (u - n1 * n2 / 2) / sigma
+    return u / (n1 * n2), math.erfc(abs(z) / math.sqrt(2))
+
+
+def _load_result_csv(path, columns, success_column):
+    """读取批处理脚本的结果CSV(只读需要的列)"""
+    import pandas as pd
+    header = pd.read_csv(path, nrows=0).columns
+    column = next((c for c in columns if c in header), None)
+    if column is None:
+        return None
+    usecols = [column] + ([success_column] if success_column in header else [])
+    df = pd.read_csv(path, usecols=usecols)
+    values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+    if success_column in df:
+        success = df[success_column]
+        ok = success.to_numpy(dtype=bool) if success.dtype == bool else success.astype(str).str.lower().eq("true").to_numpy()
+    else:
+        ok = values > 0
+    return Distribution.from_samples(values[ok & ~np.isnan(values)], errors=int((~ok).sum()))
+
+
+def _load_hist_csv(path, prefix=""):
+    """读取 save_histograms 写入的文件，每个操作取最后一个快照；秒级直方图换算为ms"""
+    latest = {}
+    for _, op, hist in load_histograms(path):
+        latest[op] = hist
+    return {prefix + op: Distribution.from_histogram(hist, 1000.0 if hist.max_value <= 3600 else 1.0)
+            for op, hist in latest.items()}
+
+
+def load_run(path):
+    """读取一次运行的结果，path 可以是结果目录或单个文件，返回 {操作: Distribution}"""
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in RESULT_FILES]
+        files += sorted(glob.glob(os.path.join(path, "report_*_hist.csv")))
+    else:
+        files = [path]
+
+    ops = {}
+    for file in files:
+        if not os.path.exists(file):
+            continue
+        name = os.path.basename(file)
+        if name in RESULT_FILES:
+            op, columns, success_column = RESULT_FILES[name]
+            dist = _load_result_csv(file, columns, success_column)
+            loaded = {op: dist} if dist is not None else {}
+        elif name.endswith("_hist.csv"):
+            # sandbox_test 多进程/多次运行的报告合并在一起
+            loaded = _load_hist_csv(file, "report:" if name.startswith("report_") else "")
+        else:
+            raise ValueError(f"无法识别的结果文件: {file}")
+        for op, dist in loaded.items():
+            ops[op] = ops[op].merge(dist) if op in ops else dist
+    if not ops:
+        raise ValueError(f"{path} 中没有找到可比较的结果")
+    return ops
+
+
+def compare(base, cand, ps, thresholds, iterations, confidence, alpha, max_error_increase, rng):
+    """比较同一操作的两次运行，返回每个分位数一行结果"""
+    rows = []
+    point_base = base.percentiles(ps)
+    point_cand = cand.percentiles(ps)
+    if min(base.n, cand.n) >= 20:
+        deltas = bootstrap(cand, ps, iterations, rng) - bootstrap(base, ps, iterations, rng)
+        tail = (100 - confidence) / 2
+        lows, highs = np.percentile(deltas, [tail, 100 - tail], axis=0)
+        _, p_value = mann_whitney(base, cand)
+    else:
+        lows = highs = [float("nan")] * len(ps)
+        p_value = float("nan")
+
+    for j, p in enumerate(ps):
+        delta = point_cand[j] - point_base[j]
+        rel = delta / point_base[j] * 100 if point_base[j] else float("nan")
+        # 变慢超过阈值，且置信区间整体在0之上才算回归
+        regression = rel > thresholds.get(p, math.inf) and lows[j] > 0
+        rows.append({
+            "metric": f"p{p:g}", "base": point_base[j], "cand": point_cand[j], "delta": delta, "rel": rel,
+            "ci_low": lows[j], "ci_high": highs[j], "p_value": p_value,
+            "regression": bool(regression and (math.isnan(p_value) or p_value < alpha)),
+        })
+
+    error_delta = (cand.error_rate - base.error_rate) * 100
+    rows.append({
+        "metric": "error_rate%", "base": base.error_rate * 100, "cand": cand.error_rate * 100,
+        "delta": error_delta, "rel": float("nan"), "ci_low": float("nan"), "ci_high": float("nan"),
+        "p_value": float("nan"), "regression": error_delta > max_error_increase,
+    })
+    return rows
+
+
+def parse_thresholds(text):
+    """解析 --threshold，如 50=10,99=25 (各分位数允许变慢的百分比)"""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for item in text.split(","):
+        p, _, pct = item.partition("=")
+        thresholds[float(p.strip().lstrip("pP"))] = float(pct)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare benchmark runs against a baseline and fail on latency regressions')
+    parser.add_argument('runs', nargs='+',
+                      help='Result directories or files; the first one is the baseline')
+    parser.add_argument('--percentiles', type=lambda s: [float(x) for x in s.split(",")], default=DEFAULT_PERCENTILES,
+                      help='Percentiles to compare (default: 50,90,99)')
+    parser.add_argument('--threshold', type=parse_thresholds, default=dict(DEFAULT_THRESHOLDS),
+                      help='Allowed slowdown in percent per percentile, e.g. 50=10,99=20 (default: 50=10,90=15,99=20)')
+    parser.add_argument('--max-error-increase', type=float, default=1.0,
+                      help='Allowed increase of the error rate in percentage points (default: 1.0)')
+    parser.add_argument('--bootstrap', type=int, default=2000,
+                      help='Bootstrap iterations (default: 2000)')
+    parser.add_argument('--confidence', type=float, default=95.0,
+                      help='Confidence level of the intervals in percent (default: 95)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                      help='Significance level of the Mann-Whitney test (default: 0.05)')
+    parser.add_argument('--ops', nargs='+', default=None,
+                      help='Only compare these operations')
+    parser.add_argument('--output', default=None,
+                      help='Also write the comparison table to this CSV file')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the bootstrap')
+    args = parser.parse_args(argv)
+
+    if len(args.runs) < 2:
+        parser.error("至少需要两次运行(第一个为基线)")
+
+    rng = np.random.default_rng(args.seed)
+    runs = [load_run(path) for path in args.runs]
+    base_name, base = args.runs[0], runs[0]
+    table = []
+    regressions = []
+
+    for cand_name, cand in zip(args.runs[1:], runs[1:]):
+        print(f"\n===== {cand_name} 对比基线 {base_name} =====")
+        ops = [op for op in base if op in cand and (not args.ops or op in args.ops)]
+        if not ops:
+            print("没有两次运行都包含的操作")
+            continue
+        for op in ops:
+            b, c = base[op], cand[op]
+            if not b.n or not c.n:
+                print(f"{op}: 没有成功的样本，跳过")
+                continue
+            print(f"{op}: 基线 {b.n} 个样本, 对比 {c.n} 个样本")
+            for row in compare(b, c, args.percentiles, args.threshold, args.bootstrap, args.confidence,
+                               args.alpha, args.max_error_increase, rng):
+                row.update({"run": cand_name, "operation": op})
+                table.append(row)
+                flag = "  <-- 回归" if row["regression"] else ""
+                rel = f"{row['rel']:+7.1f}%" if not math.isnan(row["rel"]) else " " * 8
+                if row["metric"] == "error_rate%":
+                    ci = ""
+                elif math.isnan(row["ci_low"]):
+                    ci = " 样本不足,无置信区间"
+                else:
+                    ci = f" CI{args.confidence:g}% [{row['ci_low']:+.2f}, {row['ci_high']:+.2f}]"
+                print(f"  {row['metric']:>11}: {row['base']:10.2f} -> {row['cand']:10.2f} "
+                      f"({row['delta']:+.2f} {rel}){ci}{flag}")
+                if row["regression"]:
+                    regressions.append((cand_name, op, row["metric"]))
+            p_value = table[-2]["p_value"]
+            if not math.isnan(p_value):
+                print(f"  Mann-Whitney p={p_value:.4g}" + (" (分布差异显著)" if p_value < args.alpha else ""))
+
+    if args.output and table:
+        from results_store import load_dataframe
+        load_dataframe(table).to_csv(args.output, index=False)
+        print(f"\n对比结果已保存到 {args.output}")
+
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项回归:")
+        for run, op, metric in regressions:
+            print(f"  {run}: {op} {metric}")
+        return 1
+    print("\n没有发现超过阈值的回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from histogram import LatencyHistogram
+from results_store import ResultWriter
+
+TRAJECTORY_COLUMNS = ["timestamp", "elapsed_s", "limit", "inflight_peak", "samples", "ops_per_s", "p99_ms",
+                      "error_rate", "decision", "new_limit"]
+
+
+class AIMDController:
+    """AIMD并发控制: 每个窗口结束时检查P99和错误率
+
+    满足SLO且窗口内在途数曾顶到上限时 limit += increase(加性增)，
+    违反SLO时 limit *= decrease(乘性减)。第一次回退之前按慢启动翻倍增长，尽快接近容量上限。
+    每个窗口的决策记入 trajectory，log_path 不为空时同时流式写入CSV。延迟单位为秒。
+    """
+
+    def __init__(self, name, initial=4, min_limit=1, max_limit=256, slo_p99=5.0, max_error_rate=0.05,
+                 increase=1, decrease=0.7, window=2.0, min_samples=5, log_path=None):
+        self.name = name
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slo_p99 = slo_p99
+        self.max_error_rate = max_error_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.min_samples = min_samples
+
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.slow_start = True
+        self.started = time.monotonic()
+        self.trajectory = []
+        self._log = ResultWriter(log_path, TRAJECTORY_COLUMNS) if log_path else None
+        self._reset_window(self.started)
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._hist = LatencyHistogram(resolution=1e-6)
+        self._errors = 0
+        self._peak = self.inflight
+
+    def observe(self, inflight):
+        """告知当前在途数(自己管理在途数的调用方使用，如TickScheduler)"""
+        with self.lock:
+            self._peak = max(self._peak, inflight)
+
+    def record(self, latency, ok=True):
+        """记录一个请求的结果，窗口到期时调整limit"""
+        with self.lock:
+            if ok:
+                self._hist.record(latency)
+            else:
+                self._errors += 1
+            now = time.monotonic()
+            samples = self._hist.count + self._errors
+            if now - self._window_start >= self.window and samples >= self.min_samples:
+                self._adjust(now, samples)
+
+    def _adjust(self, now, samples):
+        """结束当前窗口并给出决策，调用方需持有锁"""
+        elapsed = now - self._window_start
+        p99 = self._hist.percentile(99) if self._hist.count else 0.0
+        error_rate = self._errors / samples
+        limit = self.limit
+        if p99 > self.slo_p99 or error_rate > self.max_error_rate:
+            decision = "decrease"
+            self.slow_start = False
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+        elif self._peak >= self.limit and self.limit < self.max_limit:
+            decision = "increase"
+            step = self.limit if self.slow_start else self.increase
+            self.limit = min(self.max_limit, self.limit + step)
+        else:
+            decision = "hold"
+
+        point = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_s": round(now - self.started, 3),
+            "limit": limit,
+            "inflight_peak": self._peak,
+            "samples": samples,
+            "ops_per_s": self._hist.count / elapsed if elapsed > 0 else 0,
+            "p99_ms": p99 * 1000,
+            "error_rate": error_rate,
+            "decision": decision,
+            "new_limit": self.limit,
+        }
+        self.trajectory.append(point)
+        if self._log:
+            self._log.write(point)
+        self._reset_window(now)
+        self._on_limit_changed()
+
+    def _on_limit_changed(self):
+        pass
+
+    def sustainable(self):
+        """满足SLO的窗口中吞吐最高的一个，没有则返回None"""
+        with self.lock:
+            ok = [p for p in self.trajectory if p["decision"] != "decrease"]
+        return max(ok, key=lambda p: p["ops_per_s"]) if ok else None
+
+    def print_summary(self):
+        with self.lock:
+            points = list(self.trajectory)
+        if not points:
+            print(f"[{self.name}] 自适应并发: 样本不足，没有完成任何调整窗口 (limit={self.limit})")
+            return
+        decreases = sum(1 for p in points if p["decision"] == "decrease")
+        best = self.sustainable()
+        print(f"[{self.name}] 自适应并发: 当前limit {self.limit}, 最高 {max(p['limit'] for p in points)}, "
+              f"{len(points)} 个窗口, 回退 {decreases} 次 (SLO: P99 <= {self.slo_p99 * 1000:.0f}ms, "
+              f"错误率 <= {self.max_error_rate * 100:.1f}%)")
+        if best:
+            print(f"[{self.name}] 最大可持续吞吐: {best['ops_per_s']:.2f} ops/s (limit {best['limit']}, "
+                  f"P99 {best['p99_ms']:.0f}ms, 错误率 {best['error_rate'] * 100:.1f}%)")
+        else:
+            print(f"[{self.name}] 没有任何窗口满足SLO")
+        if self._log:
+            print(f"[{self.name}] 并发轨迹已保存到 {self._log.path}")
+
+    def close(self):
+        if self._log:
+            self._log.close()
+
+
+class AIMDLimiter(AIMDController):
+    """线程版本: acquire() 阻塞到在途数小于limit，完成后 release(耗时, 是否成功)"""
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self._cond = threading.Condition(self.lock)
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= self.limit:
+                self._cond.wait()
+            self.inflight += 1
+            self._peak = max(self._peak, self.inflight)
+
+    def release(self, latency, ok=True):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+        self.record(latency, ok)
+
+    def _on_limit_changed(self):
+        self._cond.notify_all()
+
+
+class AsyncAIMDLimiter(AIMDController):
+    """asyncio版本: await acquire() / release(耗时, 是否成功)，只能在同一个事件循环中使用"""
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self._waiters = deque()
+
+    async def acquire(self):
+        while self.inflight >= self.limit:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            await future
+        self.inflight += 1
+        self._peak = max(self._peak, self.inflight)
+
+    def release(self, latency, ok=True):
+        self.inflight -= 1
+        self.record(latency, ok)
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.inflight
+        while self._waiters and free > 0:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                free -= 1
+
+
+def add_arguments(parser, slo_p99_ms=5000):
+    """给脚本加上自适应并发相关的命令行参数"""
+    parser.add_argument('--adaptive', action='store_true',
+                      help='Adapt concurrency with AIMD instead of using a fixed limit')
+    parser.add_argument('--adaptive-initial', type=int, default=4,
+                      help='Initial concurrency limit with --adaptive (default: 4)')
+    parser.add_argument('--adaptive-max', type=int, default=256,
+                      help='Upper bound for the concurrency limit with --adaptive (default: 256)')
+    parser.add_argument('--slo-p99-ms', type=float, default=slo_p99_ms,
+                      help=f'P99 latency SLO in ms; the limit backs off above it (default: {slo_p99_ms})')
+    parser.add_argument('--slo-error-rate', type=float, default=0.05,
+                      help='Error rate (0-1) above which the limit backs off (default: 0.05)')
+    parser.add_argument('--adaptive-window', type=float, default=2.0,
+                      help='Seconds per AIMD adjustment window (default: 2.0)')
+
+
+def from_args(args, name, use_async=False):
+    """按命令行参数创建限制器，没有指定 --adaptive 时返回None"""
+    if not getattr(args, "adaptive", False):
+        return None
+    cls = AsyncAIMDLimiter if use_async else AIMDLimiter
+    return cls(
+        name,
+        initial=args.adaptive_initial,
+        max_limit=args.adaptive_max,
+        slo_p99=args.slo_p99_ms / 1000,
+        max_error_rate=args.slo_error_rate,
+        window=args.adaptive_window,
+        log_path=f"concurrency_{name}_{os.getpid()}.csv",
+    )
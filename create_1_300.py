@@ -1,34 +1,38 @@
-import statistics
+import argparse
+import asyncio
+import json
 import time
 import os
-import pandas as pd
-import requests
-import numpy as np
+import aiohttp
 from tqdm import tqdm
 from dotenv import load_dotenv
+from e2b_client import AsyncE2BClient, ENDPOINT_TIMEOUTS, TEMPLATE_ID
+from histogram import ms_histogram, save_histograms
+from load_engine import run_open_loop
+from arrival import ArrivalScheduler, ConstantProfile, parse_profile
+from results_store import ResultWriter
+import cleanup
+import concurrency_limiter
+import op_trace
+import request_policy
 
 # 加载环境变量
 load_dotenv()
 
 # 配置参数
-API_KEY = os.getenv("E2B_API_KEY")
-BASE_URL = os.getenv("E2B_BASE_URL") + "/sandboxes"
-TEMPLATE_ID = os.getenv("E2B_TEMPLATE_ID")
 TIMEOUT = int(os.getenv("E2B_TIMEOUT", 1200))
 NUM_SANDBOXES = 300  # 300个sandbox
+TARGET_RATE = 5  # 目标速率，每秒创建数 (300/分钟)
+MAX_IN_FLIGHT = 5000  # 最大在途请求数
 SANDBOX_IDS_FILE = "sandbox_ids.txt"
-REQUEST_TIMEOUT = 5  # 请求超时时间，秒，单线程模式下可以设置更短
+RESULTS_CSV_FILE = "create_results.csv"
+RESULT_COLUMNS = ["index", "sandbox_id", "combined_id", "create_time_ms", "latency_ms", "intended_send_ts",
+                  "actual_send_ts", "send_lag_ms", "error", "success"]
+REQUEST_TIMEOUT = (3.05, 5)  # 请求超时时间 (连接, 读取)，秒
 
 
-def create_sandbox(index):
-    """创建一个sandbox并返回ID和创建时间"""
-    start_time = time.time()
-
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
-
+async def create_sandbox(client, index):
+    """创建一个sandbox并返回ID和错误信息(耗时由调度引擎统计)"""
     payload = {
         "templateID": TEMPLATE_ID,
         "timeout": TIMEOUT,
@@ -37,144 +41,159 @@ def create_sandbox(index):
             "EXAMPLE_VAR": "example_value"
         },
         "metadata": {
-            "purpose": f"performance-test-gj-{index}"
+            "purpose": f"performance-test-gj-{index}",
+            cleanup.RUN_KEY: cleanup.RUN_ID
         }
     }
 
     try:
-        response = requests.post(
-            BASE_URL,
-            headers=headers,
-            json=payload,
-            timeout=REQUEST_TIMEOUT
-        )
-
-        duration_ms = (time.time() - start_time) * 1000
+        status, text, _, _ = await client.create_sandbox(payload)
 
-        if response.status_code in [200, 201]:
-            response_data = response.json()
+        if status in [200, 201]:
+            response_data = json.loads(text)
             # 从响应中提取sandboxID和clientID
             sandbox_id = response_data.get("sandboxID")
             client_id = response_data.get("clientID")
 
             if not sandbox_id or not client_id:
-                return None, None, duration_ms, f"响应中没有sandboxID或clientID: {response.text}"
+                return None, None, f"响应中没有sandboxID或clientID: {text}"
 
             # 将sandboxID和clientID用横线连接
             combined_id = f"{sandbox_id}-{client_id}"
-            return sandbox_id, combined_id, duration_ms, None
+            return sandbox_id, combined_id, None
         else:
-            return None, None, duration_ms, f"状态码: {response.status_code}, 错误: {response.text[:100]}..."
-    except requests.exceptions.Timeout:
-        duration_ms = (time.time() - start_time) * 1000
-        return None, None, duration_ms, "请求超时"
-    except requests.exceptions.RequestException as e:
-        duration_ms = (time.time() - start_time) * 1000
-        return None, None, duration_ms, f"请求异常: {str(e)}"
-
-def save_sandbox_ids(combined_ids):
-    """将sandbox ID保存到文件"""
-    with open(SANDBOX_IDS_FILE, 'w') as f:
-        for combined_id in combined_ids:
-            f.write(f"{combined_id}\n")
-    print(f"已将 {len(combined_ids)} 个combined ID (sandboxID-clientID) 保存到 {SANDBOX_IDS_FILE}")
-
-def calculate_stats(times):
-    """计算时间统计数据"""
-    valid_times = [t for t in times if t > 0]
-    if not valid_times:
-        return {"min": 0, "max": 0, "avg": 0, "median": 0, "p90": 0, "p95": 0, "p99": 0}
-
-    # 使用numpy计算百分位数，更准确
-    return {
-        "min": min(valid_times),
-        "max": max(valid_times),
-        "avg": sum(valid_times) / len(valid_times),
-        "median": statistics.median(valid_times),
-        "p90": np.percentile(valid_times, 90),
-        "p95": np.percentile(valid_times, 95),
-        "p99": np.percentile(valid_times, 99)
-    }
+            return None, None, f"状态码: {status}, 错误: {text[:100]}..."
+    except asyncio.TimeoutError:
+        return None, None, "请求超时"
+    except aiohttp.ClientError as e:
+        return None, None, f"请求异常: {str(e)}"
+
+async def create_sandboxes_async(num, scheduler, max_in_flight, pbar, split_latency=False, on_record=None,
+                                 limiter=None, policies=None):
+    """按开环到达模型并发创建sandbox，每个请求完成时把调度记录交给 on_record 处理(不在内存中保留)"""
+    stats = {"done": 0, "success": 0}
+    start_time = time.monotonic()
+
+    def on_done(record):
+        if on_record:
+            on_record(record)
+        stats["done"] += 1
+        if not isinstance(record["result"], Exception) and record["result"][0]:
+            stats["success"] += 1
+        pbar.update(1)
+
+        # 显示实时成功率、实际速率和发送滞后
+        elapsed = time.monotonic() - start_time
+        postfix = {
+            'success': f"{stats['success'] / stats['done'] * 100:.1f}%",
+            'rate': f"{stats['done'] / elapsed:.1f}/s" if elapsed > 0 else "-",
+            'lag': f"{record['send_lag_ms']:.0f}ms"
+        }
+        if limiter:
+            postfix['limit'] = limiter.limit
+        pbar.set_postfix(postfix)
+
+    async with AsyncE2BClient(pool_size=max_in_flight, timeouts={"create": REQUEST_TIMEOUT},
+                              split_latency=split_latency, policies=policies) as client:
+        await run_open_loop(
+            lambda index: create_sandbox(client, index),
+            total=num,
+            scheduler=scheduler,
+            max_in_flight=max_in_flight,
+            on_done=on_done,
+            collect=False,
+            limiter=limiter,
+            is_error=lambda result: result[2] is not None
+        )
+    client.print_connection_stats()
+
 
-def create_sandboxes():
-    """创建指定数量的sandbox并保存ID - 单线程版本"""
-    print(f"开始创建 {NUM_SANDBOXES} 个sandbox (单线程模式)...")
+def create_sandboxes(num=NUM_SANDBOXES, rate=TARGET_RATE, max_in_flight=MAX_IN_FLIGHT, split_latency=False,
+                     profile=None, limiter=None, policies=None):
+    """按固定速率(或指定的到达模型)创建指定数量的sandbox并保存ID - asyncio开环版本
 
-    # 初始化结果列表
-    results = []
-    sandbox_ids = []
-    combined_ids = []
-    create_times = []
+    limiter 为 AsyncAIMDLimiter 时在途创建数按SLO自适应调整，配合上升的到达模型可以直接得到最大可持续创建速率。
+    policies 为 {op: RequestPolicy} 时create按策略重试(只在服务端没有处理请求时重试，不会重复创建)。
+    """
+    scheduler = ArrivalScheduler(profile or ConstantProfile(rate))
+    print(f"开始创建 {num} 个sandbox (开环模式, {scheduler.profile.describe()}, 最大在途 {max_in_flight})...")
+
+    # 直方图单位为毫秒，精度1微秒
+    create_times = ms_histogram()
+    latencies = ms_histogram()
+    send_lags = ms_histogram()
     errors = []
 
+    # 每个请求完成时立即落盘，中途崩溃也只丢最后一行
+    results = ResultWriter(RESULTS_CSV_FILE, columns=RESULT_COLUMNS)
+    ids_file = open(SANDBOX_IDS_FILE, "w")
+
+    def on_record(record):
+        outcome = record["result"]
+        if isinstance(outcome, Exception):
+            sandbox_id, combined_id, error = None, None, f"请求异常: {str(outcome)}"
+        else:
+            sandbox_id, combined_id, error = outcome
+
+        # 记录结果，create_time_ms 为实际发出到返回的耗时，latency_ms 含排队延迟
+        results.write({
+            "index": record["index"],
+            "sandbox_id": sandbox_id,
+            "combined_id": combined_id,
+            "create_time_ms": record["service_time_ms"],
+            "latency_ms": record["latency_ms"],
+            "intended_send_ts": record["intended_send_ts"],
+            "actual_send_ts": record["actual_send_ts"],
+            "send_lag_ms": record["send_lag_ms"],
+            "error": error,
+            "success": sandbox_id is not None
+        })
+        send_lags.record(record["send_lag_ms"])
+
+        if sandbox_id and combined_id:
+            # 保存combined ID (sandboxID-clientID)
+            ids_file.write(f"{combined_id}\n")
+            ids_file.flush()
+            create_times.record(record["service_time_ms"])
+            latencies.record(record["latency_ms"])
+        else:
+            errors.append(error)
+
     # 记录总体开始时间
     overall_start_time = time.time()
 
-    # 计算每个请求的目标时间（为了达到每分钟300个）
-    target_time_per_request = 60 / NUM_SANDBOXES  # 秒
-
-    # 单线程循环创建sandbox
-    with tqdm(total=NUM_SANDBOXES, desc="创建sandbox") as pbar:
-        for i in range(NUM_SANDBOXES):
-            request_start_time = time.time()
-
-            # 创建sandbox
-            sandbox_id, combined_id, create_time, error = create_sandbox(i)
-
-            # 记录结果
-            result = {
-                "index": i,
-                "sandbox_id": sandbox_id,
-                "combined_id": combined_id,
-                "create_time_ms": create_time,
-                "error": error,
-                "success": sandbox_id is not None
-            }
-            results.append(result)
-
-            if sandbox_id and combined_id:
-                sandbox_ids.append(sandbox_id)
-                combined_ids.append(combined_id)
-                create_times.append(create_time)
-            else:
-                errors.append(error)
-
-            # 更新进度条
-            pbar.update(1)
-
-            # 显示实时成功率和速度
-            elapsed = time.time() - overall_start_time
-            success_rate = len(sandbox_ids) / (i + 1) * 100
-            current_rate = (i + 1) / elapsed
-            eta = (NUM_SANDBOXES - (i + 1)) / current_rate if current_rate > 0 else 0
-
-            pbar.set_postfix({
-                'success': f"{success_rate:.1f}%",
-                'rate': f"{current_rate:.1f}/s",
-                'eta': f"{eta:.1f}s"
-            })
-
-            # 计算需要等待的时间以达到目标速率
-            elapsed_this_request = time.time() - request_start_time
-            if elapsed_this_request < target_time_per_request and i < NUM_SANDBOXES - 1:
-                time.sleep(max(0, target_time_per_request - elapsed_this_request))
+    try:
+        with tqdm(total=num, desc="创建sandbox") as pbar:
+            asyncio.run(create_sandboxes_async(num, scheduler, max_in_flight, pbar, split_latency, on_record, limiter,
+                                              policies))
+    finally:
+        results.close()
+        ids_file.close()
+        if limiter:
+            limiter.close()
 
     # 计算总耗时
     overall_duration = time.time() - overall_start_time
-
-    # 保存combined IDs到文件
-    if combined_ids:
-        save_sandbox_ids(combined_ids)
-
-    # 计算统计数据
-    stats = calculate_stats(create_times)
+    created = create_times.count
+    if created:
+        print(f"已将 {created} 个combined ID (sandboxID-clientID) 保存到 {SANDBOX_IDS_FILE}")
 
     print(f"\n总耗时: {overall_duration:.2f} 秒")
-    print(f"成功创建: {len(sandbox_ids)}/{NUM_SANDBOXES} ({len(sandbox_ids)/NUM_SANDBOXES*100:.1f}%)")
-    print(f"创建速率: {len(sandbox_ids)/overall_duration:.2f} sandbox/秒")
-
-    if create_times:
-        print(f"创建时间统计 (ms):")
+    print(f"成功创建: {created}/{num} ({created/num*100:.1f}%)")
+    print(f"创建速率: {created/overall_duration:.2f} sandbox/秒 ({scheduler.profile.describe()})")
+    scheduler.print_lag()
+    if limiter:
+        limiter.print_summary()
+    request_policy.print_summaries(policies or {})
+
+    lag_stats = send_lags.summary()
+    print(f"发送滞后 (ms): 平均 {lag_stats['avg']:.2f}, P99 {lag_stats['p99']:.2f}, 最大 {lag_stats['max']:.2f}")
+
+    for title, hist in [("创建时间统计 (ms, 含排队延迟)", latencies), ("服务耗时统计 (ms, 从实际发送算起)", create_times)]:
+        if not hist.count:
+            continue
+        stats = hist.summary()
+        print(f"{title}:")
         print(f"  最小: {stats['min']:.2f}")
         print(f"  最大: {stats['max']:.2f}")
         print(f"  平均: {stats['avg']:.2f}")
@@ -183,10 +202,13 @@ def create_sandboxes():
         print(f"  95%分位 (P95): {stats['p95']:.2f}")
         print(f"  99%分位 (P99): {stats['p99']:.2f}")
 
-    # 创建详细的结果数据
-    df = pd.DataFrame(results)
-    df.to_csv("create_results.csv", index=False)
-    print("创建结果已保存到 create_results.csv")
+    print(f"创建结果已保存到 {RESULTS_CSV_FILE}")
+    save_histograms("create_results_hist.csv", {
+        "create": latencies,
+        "create_service": create_times,
+        "send_lag": send_lags,
+        **request_policy.merged_histograms(policies or {})
+    }, append=False)
 
     # 保存错误信息
     if errors:
@@ -196,4 +218,27 @@ def create_sandboxes():
         print(f"错误信息已保存到 errors.txt ({len(errors)} 个错误)")
 
 if __name__ == "__main__":
-    create_sandboxes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Open-loop sandbox create benchmark')
+    parser.add_argument('--num', type=int, default=NUM_SANDBOXES,
+                      help=f'Number of sandboxes to create (default: {NUM_SANDBOXES})')
+    parser.add_argument('--rate', type=float, default=TARGET_RATE,
+                      help=f'Target creates per second (default: {TARGET_RATE})')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                      help=f'Max concurrent create requests (default: {MAX_IN_FLIGHT})')
+    parser.add_argument('--split-connection-latency', action='store_true',
+                      help='Report latencies on reused vs newly opened connections separately')
+    parser.add_argument('--profile', type=parse_profile, default=None,
+                      help='Arrival profile, overrides --rate: constant:RATE | ramp:START:END:SECONDS | '
+                           'step:RATExSECONDS,... | poisson:RATE[:BURST]')
+    concurrency_limiter.add_arguments(parser)
+    request_policy.add_arguments(parser)
+    op_trace.add_arguments(parser)
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+    op_trace.from_args(args)
+
+    with cleanup.from_args(args):
+        create_sandboxes(num=args.num, rate=args.rate, max_in_flight=args.max_in_flight,
+                         split_latency=args.split_connection_latency, profile=args.profile,
+                         limiter=concurrency_limiter.from_args(args, "create", use_async=True),
+                         policies=request_policy.from_args(args, dict(ENDPOINT_TIMEOUTS, create=REQUEST_TIMEOUT)))
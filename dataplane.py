@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from e2b_code_interpreter import Sandbox
+
+import cleanup
+from e2b_client import TEMPLATE_ID, sdk_options
+
+# 数据面脚本(dataplane_bench.py / chunked_upload.py)共用的大小解析和SDK sandbox创建
+
+UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def parse_size(text):
+    """解析 1KB / 10MB / 512 这样的大小，返回字节数"""
+    text = text.strip().upper()
+    for unit in sorted(UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+def parse_sizes(text):
+    return [parse_size(item) for item in text.split(",") if item.strip()]
+
+
+def format_size(size):
+    """字节数写成 1KB / 10MB 的形式，用于操作名"""
+    for unit in ("GB", "MB", "KB"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def create_sandboxes(count, timeout, purpose="dataplane"):
+    """并行创建 count 个sandbox，返回创建成功的Sandbox对象；metadata 在 cleanup.DEFAULT_PREFIX 下"""
+    def create(_):
+        try:
+            return Sandbox(template=TEMPLATE_ID, timeout=timeout,
+                           metadata=cleanup.run_metadata(f"{cleanup.DEFAULT_PREFIX}-{purpose}"), **sdk_options())
+        except Exception as e:
+            print(f"创建sandbox失败: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return [sbx for sbx in executor.map(create, range(count)) if sbx is not None]
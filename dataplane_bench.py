@@ -0,0 +1,256 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import cleanup
+from dataplane import create_sandboxes, format_size, parse_size, parse_sizes
+from histogram import LatencyHistogram, save_histograms
+from sweep import ROUNDS_PER_LEVEL, parse_levels, report_sweep, sweep, total_needed
+
+# 加载环境变量
+load_dotenv()
+
+# 数据面微基准: 在N个sandbox上并行测量 commands.run / files.write / files.read
+#   cmd:echo / cmd:ls / cmd:background  简单命令的往返耗时(前台)和后台启动耗时
+#   stdout:SIZE                          大输出的流式吞吐
+#   write:SIZE / read:SIZE               文件写入/读回的吞吐(读回后校验内容)
+#   command@N                            单个sandbox上N个并发命令，找出延迟开始变差的并发数
+# 耗时直方图单位为秒，报告格式与 sandbox_test.py 的 report_{pid}.csv 相同，可直接用 compare_runs.py 对比
+
+DEFAULT_FILE_SIZES = "1KB,64KB,1MB,10MB,100MB"
+DEFAULT_STDOUT_SIZES = "64KB,1MB,10MB"
+DEFAULT_LEVELS = "1,2,4,8,16,32,64"
+REMOTE_DIR = "/home/user"
+# stdout 测试中 yes 重复输出的行
+STDOUT_LINE = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class Results:
+    """各操作的耗时直方图(秒)、失败数和传输字节数，可被多个线程同时记录"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.errors = {}
+        self.sizes = {}
+        # 按吞吐统计的操作: {op: (所有sandbox传输的总字节数, 该阶段的墙钟耗时)}
+        self.phases = {}
+
+    def record(self, op, duration, size=None):
+        with self.lock:
+            self.histograms.setdefault(op, LatencyHistogram(resolution=1e-6)).record(duration)
+            if size is not None:
+                self.sizes[op] = size
+
+    def record_error(self, op, error):
+        with self.lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+            count = self.errors[op]
+        if count <= 3:
+            print(f"{op} 失败: {error}")
+
+    def phase(self, op, total_bytes, elapsed):
+        with self.lock:
+            self.phases[op] = (total_bytes, elapsed)
+
+
+def timed(results, op, call, size=None):
+    """执行 call() 并记录耗时，失败记为错误；返回 call 的结果，失败返回None"""
+    start = time.perf_counter()
+    try:
+        value = call()
+    except Exception as e:
+        results.record_error(op, e)
+        return None
+    results.record(op, time.perf_counter() - start, size)
+    return value
+
+
+def bench_commands(sbx, results, iterations):
+    """前台简单命令和后台启动的往返耗时(与 connect_sandbox 中的调用相同)"""
+    for _ in range(iterations):
+        timed(results, "cmd:echo", lambda: sbx.commands.run("echo ok"))
+        timed(results, "cmd:ls", lambda: sbx.commands.run(f"ls -l {REMOTE_DIR}"))
+        # 后台执行只等到进程启动就返回
+        timed(results, "cmd:background", lambda: sbx.commands.run("sleep 1", background=True))
+
+
+def bench_stdout(sbx, results, size, iterations):
+    """大输出的流式吞吐，同时记录首个输出块到达的耗时"""
+    op = f"stdout:{format_size(size)}"
+    for _ in range(iterations):
+        first = []
+        start = time.perf_counter()
+
+        def on_stdout(_):
+            if not first:
+                first.append(time.perf_counter() - start)
+
+        execution = timed(results, op, lambda: sbx.commands.run(f"yes {STDOUT_LINE} | head -c {size}",
+                                                                 on_stdout=on_stdout), size)
+        if execution is None:
+            continue
+        if len(execution.stdout) != size:
+            results.record_error(op, f"输出 {len(execution.stdout)} 字节，预期 {size}")
+        if first:
+            results.record(f"stdout_first_byte:{format_size(size)}", first[0])
+
+
+def remote_file(index, size):
+    return f"{REMOTE_DIR}/bench_{index}_{format_size(size)}.bin"
+
+
+def bench_write(sbx, index, results, data, iterations):
+    for _ in range(iterations):
+        timed(results, f"write:{format_size(len(data))}", lambda: sbx.files.write(remote_file(index, len(data)), data),
+              len(data))
+
+
+def bench_read(sbx, index, results, data, iterations):
+    """读回 bench_write 写入的文件，内容必须与写入的一致"""
+    op = f"read:{format_size(len(data))}"
+    for _ in range(iterations):
+        read = timed(results, op, lambda: sbx.files.read(remote_file(index, len(data)), format="bytes"), len(data))
+        if read is not None and bytes(read) != data:
+            results.record_error(op, f"读回的内容不一致 ({len(read)} 字节)")
+
+
+def run_parallel(sandboxes, results, work, op=None, size=None):
+    """在所有sandbox上并行执行 work(sbx, index)；指定 op 时按阶段墙钟耗时记录所有sandbox的聚合吞吐"""
+    before = results.histograms[op].count if op in results.histograms else 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sandboxes)) as executor:
+        for future in [executor.submit(work, sbx, index) for index, sbx in enumerate(sandboxes)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    if op in results.histograms:
+        results.phase(op, (results.histograms[op].count - before) * size, elapsed)
+
+
+def bench_concurrency(sbx, levels, per_level, degrade):
+    """单个sandbox上逐档增加并发命令数，返回 (吞吐拐点, 延迟开始变差前的最大并发)"""
+    def op(_):
+        start = time.perf_counter()
+        try:
+            sbx.commands.run("echo ok")
+        except Exception:
+            return -1
+        return (time.perf_counter() - start) * 1000
+
+    # 每档至少 ROUNDS_PER_LEVEL x 并发 个命令，保证在途数达到档位值
+    rows, histograms = sweep("command", op, [None] * total_needed(levels, per_level), levels, per_level)
+    knee = report_sweep("command", rows, histograms)
+
+    # 延迟: P50超过单并发P50的 degrade 倍之前的最后一档
+    sustained = None
+    if rows and rows[0]["p50_ms"] > 0:
+        limit = rows[0]["p50_ms"] * degrade
+        for row in rows:
+            if row["p50_ms"] > limit or row["error_rate"] > 0:
+                break
+            sustained = row["concurrency"]
+        print(f"单个sandbox并发命令数不超过 {sustained} 时，P50 不超过单并发的 {degrade:g} 倍 ({limit:.2f}ms)")
+    return knee, sustained
+
+
+def print_report(results, path="dataplane_report.csv"):
+    """按 sandbox_test.py 的格式打印并写入报告，吞吐类操作额外打印MB/s"""
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    print("\n\n===  Data Plane Statistics ===")
+    with open(path, 'a') as csvfile:
+        if csvfile.tell() == 0:
+            csvfile.write("timestamp,operation,count,p99,p90,avg\n")
+        for op, hist in results.histograms.items():
+            p99, p90, p50 = hist.percentiles(99, 90, 50)
+            print(f"{op}:")
+            print(f"  Count: {hist.count}  Errors: {results.errors.get(op, 0)}")
+            print(f"  P99: {p99:.4f}s")
+            print(f"  P90: {p90:.4f}s")
+            print(f"  Avg: {hist.mean:.4f}s")
+            size = results.sizes.get(op)
+            if size:
+                line = f"  MB/s: 单次P50 {size / p50 / 1e6:.1f}"
+                if op in results.phases:
+                    total_bytes, elapsed = results.phases[op]
+                    line += f", 所有sandbox聚合 {total_bytes / elapsed / 1e6:.1f}"
+                print(line)
+            csvfile.write(f"{current_time},{op},{hist.count},{p99:.4f},{p90:.4f},{hist.mean:.4f}\n")
+        for op, count in results.errors.items():
+            if op not in results.histograms:
+                print(f"{op}:\n  Count: 0  Errors: {count}")
+    print("============================")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sandbox data-plane calls (commands.run, files.write/read)')
+    parser.add_argument('--sandboxes', type=int, default=4,
+                      help='Sandboxes benchmarked in parallel (default: 4)')
+    parser.add_argument('--iterations', type=int, default=20,
+                      help='Round trips per sandbox for each trivial command (default: 20)')
+    parser.add_argument('--stdout-sizes', type=parse_sizes, default=DEFAULT_STDOUT_SIZES,
+                      help=f'Command output sizes for the stdout throughput test (default: {DEFAULT_STDOUT_SIZES})')
+    parser.add_argument('--file-sizes', type=parse_sizes, default=DEFAULT_FILE_SIZES,
+                      help=f'Payload sizes for files.write/read (default: {DEFAULT_FILE_SIZES})')
+    parser.add_argument('--transfer-iterations', type=int, default=3,
+                      help='Repetitions per sandbox of each stdout size and file size (default: 3)')
+    parser.add_argument('--levels', type=parse_levels, default=DEFAULT_LEVELS,
+                      help=f'Concurrent command levels tried on one sandbox (default: {DEFAULT_LEVELS})')
+    parser.add_argument('--per-level', type=int, default=50,
+                      help=f'Minimum commands run at each concurrency level; each level runs at least '
+                           f'{ROUNDS_PER_LEVEL} x its concurrency (default: 50)')
+    parser.add_argument('--degrade', type=float, default=2.0,
+                      help='P50 growth over the single-command P50 treated as degraded (default: 2.0)')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['commands', 'stdout', 'files', 'concurrency'],
+                      help='Benchmarks to skip')
+    parser.add_argument('--timeout', type=int, default=600,
+                      help='Sandbox timeout in seconds (default: 600)')
+    parser.add_argument('--report', default="dataplane_report.csv",
+                      help='Percentile report in the report_{pid}.csv format (default: dataplane_report.csv)')
+    parser.add_argument('--hist', default="dataplane_hist.csv",
+                      help='Latency histograms for compare_runs.py (default: dataplane_hist.csv)')
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = Results()
+    with cleanup.from_args(args):
+        start = time.perf_counter()
+        sandboxes = create_sandboxes(args.sandboxes, args.timeout)
+        print(f"创建 {len(sandboxes)}/{args.sandboxes} 个sandbox, 耗时 {time.perf_counter() - start:.2f}s")
+        try:
+            if sandboxes and 'commands' not in args.skip:
+                print(f"命令往返: 每个sandbox {args.iterations} 次 echo / ls / 后台启动")
+                run_parallel(sandboxes, results, lambda sbx, _: bench_commands(sbx, results, args.iterations))
+            if sandboxes and 'stdout' not in args.skip:
+                for size in args.stdout_sizes:
+                    print(f"stdout吞吐: {format_size(size)}")
+                    run_parallel(sandboxes, results,
+                                 lambda sbx, _: bench_stdout(sbx, results, size, args.transfer_iterations),
+                                 f"stdout:{format_size(size)}", size)
+            if sandboxes and 'files' not in args.skip:
+                for size in args.file_sizes:
+                    print(f"文件读写: {format_size(size)}")
+                    # 每种大小只生成一份随机数据，所有sandbox共用
+                    data = os.urandom(size)
+                    run_parallel(sandboxes, results,
+                                 lambda sbx, index: bench_write(sbx, index, results, data, args.transfer_iterations),
+                                 f"write:{format_size(size)}", size)
+                    run_parallel(sandboxes, results,
+                                 lambda sbx, index: bench_read(sbx, index, results, data, args.transfer_iterations),
+                                 f"read:{format_size(size)}", size)
+                    del data
+            if sandboxes and 'concurrency' not in args.skip:
+                print(f"\n单个sandbox并发命令: {args.levels}, 每档 max({args.per_level}, {ROUNDS_PER_LEVEL}x并发) 个")
+                bench_concurrency(sandboxes[0], args.levels, args.per_level, args.degrade)
+        finally:
+            print_report(results, args.report)
+            save_histograms(args.hist, results.histograms, append=False)
+            print(f"报告已保存到 {args.report}，直方图保存到 {args.hist}")
+            for sbx in sandboxes:
+                try:
+                    sbx.kill()
+                except Exception as e:
+                    print(f"删除sandbox失败: {e}")
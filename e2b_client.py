@@ -0,0 +1,329 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import aiohttp
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import op_trace
+import request_policy
+import tracing
+from histogram import LatencyHistogram
+from request_policy import SUCCESS_CODES
+
+# 加载环境变量
+load_dotenv()
+
+# 所有脚本共用的E2B配置
+API_KEY = os.getenv("E2B_API_KEY")
+BASE_URL = os.getenv("E2B_BASE_URL")
+DOMAIN = os.getenv("E2B_DOMAIN")
+TEMPLATE_ID = os.getenv("E2B_TEMPLATE_ID")
+
+# 各接口默认超时 (连接超时, 读超时)，秒
+ENDPOINT_TIMEOUTS = {
+    "create": (3.05, 5),
+    "pause": (3.05, 60),
+    "resume": (3.05, 60),
+    "list": (3.05, 30),
+    "kill": (3.05, 30),
+}
+
+# 记录当前线程的请求是否新建了连接(TCP+TLS握手)
+_local = threading.local()
+
+
+def api_headers():
+    """REST API公共请求头"""
+    return {
+        "X-API-Key": API_KEY,
+        "Content-Type": "application/json"
+    }
+
+
+def sdk_options():
+    """e2b SDK (Sandbox / Sandbox.connect) 公共认证参数"""
+    options = {"api_key": API_KEY}
+    if DOMAIN:
+        options["domain"] = DOMAIN
+    return options
+
+
+def split_combined_id(combined_id):
+    """从combined_id中提取sandbox_id (格式是sandboxID-clientID)"""
+    return combined_id.split('-')[0] if '-' in combined_id else combined_id
+
+
+def _print_latency_split(items):
+    print("=== 连接耗时对比 (warm=复用连接, cold=新建连接) ===")
+    for (op, kind), histogram in sorted(items):
+        print(f"  {op} {kind}: count={histogram.count}, avg={histogram.mean * 1000:.2f}ms")
+
+
+class _TrackingHTTPConnection(HTTPConnection):
+    def connect(self):
+        _local.cold = True
+        super().connect()
+
+
+class _TrackingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _local.cold = True
+        super().connect()
+
+
+class _TrackingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackingHTTPConnection
+
+
+class _TrackingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackingHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """使用可追踪新建连接的连接池"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackingHTTPConnectionPool,
+            "https": _TrackingHTTPSConnectionPool,
+        }
+
+
+class E2BClient:
+    """共享的E2B REST客户端，keep-alive连接池大小与worker数一致
+
+    split_latency=True 时按操作分别统计复用连接(warm)和新建连接(cold)的耗时，
+    便于区分控制面耗时和本机TCP/TLS握手耗时。
+    policies 为 {op: request_policy.RequestPolicy} 时，对应操作按策略超时、重试和对冲。
+    """
+
+    def __init__(self, pool_size=10, timeouts=None, base_url=None, api_key=None, split_latency=False,
+                 policies=None):
+        self.base_url = (base_url or BASE_URL).rstrip('/')
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.split_latency = split_latency
+        self.policies = policies or {}
+
+        self.session = requests.Session()
+        self.session.headers.update(api_headers())
+        if api_key:
+            self.session.headers["X-API-Key"] = api_key
+        adapter = _PooledAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._latencies = defaultdict(lambda: LatencyHistogram(resolution=1e-6))
+
+    def request(self, op, method, path, **kwargs):
+        """发送请求，响应对象上附带 elapsed_s、cold_connection、attempts(发送次数) 和 succeeded 属性
+
+        有策略时 elapsed_s 为最后一次发送的耗时，重试得到的409(前一次请求超时但实际已经生效)也算 succeeded；
+        重试用尽后仍然失败的异常会原样抛出。
+        """
+        policy = self.policies.get(op)
+        if policy is None or "timeout" in kwargs:
+            response = self._send(op, method, path, **kwargs)
+            response.attempts = 1
+            response.succeeded = response.status_code in SUCCESS_CODES
+            return response
+        response, error, attempts = policy.call(
+            lambda timeout: self._send(op, method, path, timeout=timeout, **kwargs))
+        if error is not None:
+            raise error
+        response.attempts = attempts
+        response.succeeded = policy.classify(response, None, attempts) == request_policy.OK
+        return response
+
+    def _send(self, op, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeouts.get(op))
+        _local.cold = False
+        start_time = time.time()
+        with tracing.span(f"rest.{op}") as sp:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            sp.set(status=response.status_code)
+        response.elapsed_s = time.time() - start_time
+        response.cold_connection = _local.cold
+
+        if self.split_latency:
+            kind = "cold" if response.cold_connection else "warm"
+            with self._stats_lock:
+                self._latencies[(op, kind)].record(response.elapsed_s)
+        return response
+
+    def _lifecycle(self, op, sandbox_id, payload, method, path, **kwargs):
+        """生命周期操作，启用 op_trace 录制时记录发出时间、sandbox和结果"""
+        if not op_trace.enabled():
+            return self.request(op, method, path, **kwargs)
+        started = time.time()
+        try:
+            response = self.request(op, method, path, **kwargs)
+        except Exception as e:
+            op_trace.record(op, sandbox_id, payload, ts=started, ok=False, error=type(e).__name__)
+            raise
+        if op == "create" and response.succeeded:
+            sandbox_id = response.json().get("sandboxID")
+        op_trace.record(op, sandbox_id, payload, ts=started, ok=response.succeeded, status=response.status_code)
+        return response
+
+    def create_sandbox(self, payload):
+        return self._lifecycle("create", None, op_trace.create_payload(payload), "POST", "/sandboxes", json=payload)
+
+    def pause_sandbox(self, combined_id):
+        return self._lifecycle("pause", combined_id, None, "POST", f"/sandboxes/{combined_id}/pause")
+
+    def resume_sandbox(self, combined_id, timeout):
+        return self._lifecycle("resume", combined_id, {"timeout": timeout}, "POST",
+                               f"/sandboxes/{combined_id}/resume", json={"timeout": timeout})
+
+    def kill_sandbox(self, sandbox_id):
+        return self._lifecycle("kill", sandbox_id, None, "DELETE", f"/sandboxes/{sandbox_id}")
+
+    def list_sandboxes(self, params):
+        """v2分页列表接口，下一页的游标在响应头 x-next-token 中"""
+        return self.request("list", "GET", "/v2/sandboxes", params=params)
+
+    def print_connection_stats(self):
+        """打印复用连接 / 新建连接的耗时对比"""
+        if not self.split_latency:
+            return
+        with self._stats_lock:
+            items = list(self._latencies.items())
+        _print_latency_split(items)
+
+    def print_policy_stats(self):
+        """打印各操作首次请求 / 端到端耗时和发送次数"""
+        request_policy.print_summaries(self.policies)
+
+    def policy_histograms(self):
+        return request_policy.merged_histograms(self.policies)
+
+    def close(self):
+        for policy in self.policies.values():
+            policy.close()
+        self.session.close()
+
+
+class AsyncE2BClient:
+    """asyncio版本的共享客户端，供开环压测引擎使用"""
+
+    def __init__(self, pool_size=100, timeouts=None, base_url=None, api_key=None, split_latency=False,
+                 policies=None):
+        self.base_url = (base_url or BASE_URL).rstrip('/')
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.split_latency = split_latency
+        self.policies = policies or {}
+        self.pool_size = pool_size
+        self.headers = api_headers()
+        if api_key:
+            self.headers["X-API-Key"] = api_key
+        self.session = None
+        self._latencies = defaultdict(lambda: LatencyHistogram(resolution=1e-6))
+
+    async def __aenter__(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_connection_create_end(session, ctx, params):
+            ctx.trace_request_ctx["cold"] = True
+
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            trace_configs=[trace_config]
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        for policy in self.policies.values():
+            await policy.drain()
+        await self.session.close()
+
+    async def request(self, op, method, path, **kwargs):
+        """发送请求，返回 (状态码, 响应文本, 耗时秒, 是否新建连接)
+
+        有策略时按策略重试/对冲，耗时为最后一次发送的耗时；重试用尽后仍然失败的异常会原样抛出。
+        """
+        policy = self.policies.get(op)
+        if policy is None:
+            return await self._send(op, method, path, self.timeouts.get(op, (None, None)), **kwargs)
+        result, error, _ = await policy.call_async(
+            lambda timeout: self._send(op, method, path, timeout, **kwargs))
+        if error is not None:
+            raise error
+        return result
+
+    async def _send(self, op, method, path, timeouts, **kwargs):
+        connect_timeout, read_timeout = timeouts
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        ctx = {"cold": False}
+        start_time = time.time()
+        start_ns = time.monotonic_ns()
+        async with self.session.request(method, f"{self.base_url}{path}", timeout=timeout,
+                                        trace_request_ctx=ctx, **kwargs) as response:
+            text = await response.text()
+        elapsed = time.time() - start_time
+        # 协程交错执行，不能用基于线程栈的span，直接记录一段耗时
+        tracing.record(f"rest.{op}", start_ns, time.monotonic_ns(), status=response.status)
+
+        if self.split_latency:
+            self._latencies[(op, "cold" if ctx["cold"] else "warm")].record(elapsed)
+        return response.status, text, elapsed, ctx["cold"]
+
+    async def _lifecycle(self, op, sandbox_id, payload, method, path, **kwargs):
+        """生命周期操作，启用 op_trace 录制时记录发出时间、sandbox和结果"""
+        if not op_trace.enabled():
+            return await self.request(op, method, path, **kwargs)
+        started = time.time()
+        try:
+            result = await self.request(op, method, path, **kwargs)
+        except Exception as e:
+            op_trace.record(op, sandbox_id, payload, ts=started, ok=False, error=type(e).__name__)
+            raise
+        status, text = result[0], result[1]
+        ok = status in SUCCESS_CODES
+        if op == "create" and ok:
+            try:
+                sandbox_id = json.loads(text).get("sandboxID")
+            except ValueError:
+                pass
+        op_trace.record(op, sandbox_id, payload, ts=started, ok=ok, status=status)
+        return result
+
+    async def create_sandbox(self, payload):
+        return await self._lifecycle("create", None, op_trace.create_payload(payload), "POST", "/sandboxes",
+                                     json=payload)
+
+    async def pause_sandbox(self, combined_id):
+        return await self._lifecycle("pause", combined_id, None, "POST", f"/sandboxes/{combined_id}/pause")
+
+    async def resume_sandbox(self, combined_id, timeout):
+        return await self._lifecycle("resume", combined_id, {"timeout": timeout}, "POST",
+                                     f"/sandboxes/{combined_id}/resume", json={"timeout": timeout})
+
+    async def kill_sandbox(self, sandbox_id):
+        return await self._lifecycle("kill", sandbox_id, None, "DELETE", f"/sandboxes/{sandbox_id}")
+
+    def print_connection_stats(self):
+        """打印复用连接 / 新建连接的耗时对比"""
+        if self.split_latency:
+            _print_latency_split(self._latencies.items())
+
+    def print_policy_stats(self):
+        """打印各操作首次请求 / 端到端耗时和发送次数"""
+        request_policy.print_summaries(self.policies)
+
+    def policy_histograms(self):
+        return request_policy.merged_histograms(self.policies)
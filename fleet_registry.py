@@ -0,0 +1,123 @@
+import random
+import threading
+
+RUNNING = 'running'
+PAUSING = 'pausing'
+PAUSED = 'paused'
+RESUMING = 'resuming'
+FAILED = 'failed'
+STATES = (RUNNING, PAUSING, PAUSED, RESUMING, FAILED)
+
+# 稳定状态 -> 开始切换后进入的中间状态
+CLAIM_TRANSITIONS = {RUNNING: PAUSING, PAUSED: RESUMING}
+
+
+class FleetRegistry:
+    """线程安全的sandbox注册表，按生命周期状态建立索引
+
+    每个状态维护一个列表和 id -> 下标 的字典，增删都用"与末尾交换后弹出"，
+    因此状态切换和按状态随机抽样都是O(1)/O(k)，与fleet规模无关。
+    中间状态(pausing/resuming)的sandbox不会被再次抽中，避免重复调度。
+    fail() 把失败的sandbox移出注册表，只保留累计失败数，长时间运行时注册表不会随失败增长。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._members = {state: [] for state in STATES}
+        self._positions = {state: {} for state in STATES}
+        self._failed = 0
+
+    def _insert(self, sandbox_id, state):
+        self._positions[state][sandbox_id] = len(self._members[state])
+        self._members[state].append(sandbox_id)
+        self._states[sandbox_id] = state
+
+    def _detach(self, sandbox_id, state):
+        members = self._members[state]
+        positions = self._positions[state]
+        index = positions.pop(sandbox_id)
+        last = members.pop()
+        if last != sandbox_id:
+            members[index] = last
+            positions[last] = index
+
+    def add(self, sandbox_id, state=RUNNING):
+        with self._lock:
+            if sandbox_id in self._states:
+                self._detach(sandbox_id, self._states[sandbox_id])
+            self._insert(sandbox_id, state)
+
+    def remove(self, sandbox_id):
+        with self._lock:
+            state = self._states.pop(sandbox_id, None)
+            if state is not None:
+                self._detach(sandbox_id, state)
+            return state
+
+    def state(self, sandbox_id):
+        with self._lock:
+            return self._states.get(sandbox_id)
+
+    def transition(self, sandbox_id, from_state, to_state):
+        """原子地把sandbox从from_state切到to_state，当前状态不符时返回False"""
+        with self._lock:
+            if self._states.get(sandbox_id) != from_state:
+                return False
+            self._detach(sandbox_id, from_state)
+            self._insert(sandbox_id, to_state)
+            return True
+
+    def fail(self, sandbox_id, from_state):
+        """原子地把处于from_state的sandbox移出注册表并计入失败数，当前状态不符时返回False"""
+        with self._lock:
+            if self._states.get(sandbox_id) != from_state:
+                return False
+            del self._states[sandbox_id]
+            self._detach(sandbox_id, from_state)
+            self._failed += 1
+            return True
+
+    def sample(self, state, k):
+        """随机返回某个状态下的k个sandbox ID(不改变状态)"""
+        with self._lock:
+            members = self._members[state]
+            return random.sample(members, min(k, len(members)))
+
+    def claim(self, k, states=(RUNNING, PAUSED)):
+        """从给定的稳定状态中均匀随机认领k个sandbox，并原子地切到对应的中间状态
+
+        返回 [(sandbox_id, 原状态)]。
+        """
+        with self._lock:
+            sizes = [len(self._members[state]) for state in states]
+            total = sum(sizes)
+            picked = []
+            for offset in random.sample(range(total), min(k, total)):
+                for state, size in zip(states, sizes):
+                    if offset < size:
+                        picked.append((self._members[state][offset], state))
+                        break
+                    offset -= size
+
+            # 先全部选定再切换状态，避免交换删除影响上面的下标
+            for sandbox_id, state in picked:
+                self._detach(sandbox_id, state)
+                self._insert(sandbox_id, CLAIM_TRANSITIONS[state])
+            return picked
+
+    def counts(self):
+        """各状态当前的sandbox数量，failed 为累计失败数(含已通过 fail() 移出的)"""
+        with self._lock:
+            counts = {state: len(self._members[state]) for state in STATES}
+            counts[FAILED] += self._failed
+            return counts
+
+    def active_count(self):
+        """除failed以外的sandbox数量"""
+        with self._lock:
+            return len(self._states) - len(self._members[FAILED])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._states)
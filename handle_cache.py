@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+import tracing
+
+
+def close_handle(sbx):
+    """释放Sandbox对象持有的HTTP客户端
+
+    v1 SDK每个实例有自己的连接池(_transport)，关闭它才能释放连接；
+    v2 SDK的连接池是进程内全局共享的，实例只持有 _envd_api 这个httpx客户端包装，
+    关闭它不会关闭共享的连接池，连接数也不随缓存的对象数增长。
+    """
+    for name in ("_transport", "_envd_api"):
+        resource = getattr(sbx, name, None)
+        if resource is not None:
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+
+class SandboxHandleCache:
+    """按sandbox ID缓存已连接的Sandbox对象(LRU)
+
+    超过 max_size 或空闲超过 idle_ttl 秒的对象会被淘汰并关闭其HTTP客户端(见 close_handle)。
+    resume 后取出的对象先用 is_running() 校验一次，失败再 Sandbox.connect 重连。
+    """
+
+    def __init__(self, connect, max_size=1000, idle_ttl=300):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()
+
+        self.hits = 0
+        self.reconnects = 0
+        self.revalidate_failures = 0
+        self.evictions = 0
+
+    def _evict(self, now):
+        """淘汰超出容量或空闲超时的对象，调用方需持有锁"""
+        evicted = []
+        while self._handles:
+            sandbox_id, (sbx, last_used) = next(iter(self._handles.items()))
+            if len(self._handles) <= self.max_size and now - last_used <= self.idle_ttl:
+                break
+            del self._handles[sandbox_id]
+            evicted.append(sbx)
+        self.evictions += len(evicted)
+        return evicted
+
+    def put(self, sandbox_id, sbx):
+        if self.max_size <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._handles[sandbox_id] = (sbx, now)
+            self._handles.move_to_end(sandbox_id)
+            evicted = self._evict(now)
+        for old in evicted:
+            close_handle(old)
+
+    def discard(self, sandbox_id):
+        with self._lock:
+            entry = self._handles.pop(sandbox_id, None)
+        if entry:
+            close_handle(entry[0])
+
+    def get(self, sandbox_id, revalidate=True):
+        """返回可用的Sandbox对象，缓存未命中或校验失败时重新连接"""
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            entry = self._handles.pop(sandbox_id, None)
+        for old in evicted:
+            close_handle(old)
+
+        if entry:
+            sbx = entry[0]
+            try:
+                with tracing.span("handle.revalidate"):
+                    valid = not revalidate or sbx.is_running()
+                if valid:
+                    with self._lock:
+                        self.hits += 1
+                    self.put(sandbox_id, sbx)
+                    return sbx
+            except Exception:
+                pass
+            with self._lock:
+                self.revalidate_failures += 1
+            close_handle(sbx)
+
+        with tracing.span("handle.connect"):
+            sbx = self.connect(sandbox_id)
+        with self._lock:
+            self.reconnects += 1
+        self.put(sandbox_id, sbx)
+        return sbx
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._handles),
+                "hits": self.hits,
+                "reconnects": self.reconnects,
+                "revalidate_failures": self.revalidate_failures,
+                "evictions": self.evictions,
+            }
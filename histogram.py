@@ -0,0 +1,212 @@
+import base64
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from array import array
+
+
+class LatencyHistogram:
+    """HDR风格的对数分桶延迟直方图
+
+    内存只取决于 max_value / resolution 和精度(有效数字位数)，与样本数无关；
+    record 为 O(1)，百分位查询只扫描有数据的桶，相同配置的直方图可以无损合并。
+    resolution 为可区分的最小值(与调用方单位一致，如秒则1e-6表示微秒精度)。
+    """
+
+    def __init__(self, resolution=1e-6, max_value=3600.0, precision=3):
+        self.resolution = resolution
+        self.max_value = max_value
+        self.precision = precision
+
+        # 每个桶内的子桶数为2的幂，保证相对误差不超过 10^-precision
+        self._sub_bits = math.ceil(math.log2(2 * 10 ** precision))
+        self._half_bits = self._sub_bits - 1
+        self._max_units = max(1, int(max_value / resolution))
+        self._size = self._index(self._max_units) + 1
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = array('q', bytes(8 * self._size))
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+            self._lo = len(self._counts)
+            self._hi = -1
+
+    def _index(self, units):
+        bucket = max(0, units.bit_length() - self._sub_bits)
+        sub = units >> bucket
+        return ((bucket + 1) << self._half_bits) + sub - (1 << self._half_bits)
+
+    def _upper_value(self, index):
+        """返回桶的上界(与调用方单位一致)"""
+        half = 1 << self._half_bits
+        if index < 2 * half:
+            bucket, sub = 0, index
+        else:
+            bucket = (index >> self._half_bits) - 1
+            sub = (index & (half - 1)) + half
+        return (((sub + 1) << bucket) - 1) * self.resolution
+
+    def record(self, value, count=1):
+        units = min(max(0, int(value / self.resolution)), self._max_units)
+        index = self._index(units)
+        with self._lock:
+            self._counts[index] += count
+            self.count += count
+            self.total += value * count
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+            if index < self._lo:
+                self._lo = index
+            if index > self._hi:
+                self._hi = index
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentiles(self, *ps):
+        """一次扫描计算多个百分位(0-100)，结果不超过实际记录的最大值"""
+        with self._lock:
+            if not self.count:
+                return [0 for _ in ps]
+            targets = sorted((max(1, math.ceil(p / 100 * self.count)), i) for i, p in enumerate(ps))
+            results = [0] * len(ps)
+            cumulative = 0
+            t = 0
+            for index in range(self._lo, self._hi + 1):
+                cumulative += self._counts[index]
+                while t < len(targets) and cumulative >= targets[t][0]:
+                    results[targets[t][1]] = min(self._upper_value(index), self.max)
+                    t += 1
+                if t == len(targets):
+                    break
+            return results
+
+    def percentile(self, p):
+        return self.percentiles(p)[0]
+
+    def summary(self):
+        """返回与原 calculate_stats 相同字段的统计数据"""
+        median, p90, p95, p99 = self.percentiles(50, 90, 95, 99)
+        return {
+            "min": self.min or 0,
+            "max": self.max or 0,
+            "avg": self.mean,
+            "median": median,
+            "p90": p90,
+            "p95": p95,
+            "p99": p99
+        }
+
+    def _check_compatible(self, other):
+        if (self.resolution, self.max_value, self.precision) != (other.resolution, other.max_value, other.precision):
+            raise ValueError("只能合并相同配置(resolution/max_value/precision)的直方图")
+
+    def merge(self, other):
+        """把另一个直方图的数据无损合并进来"""
+        self._check_compatible(other)
+        with other._lock:
+            lo, hi = other._lo, other._hi
+            counts = other._counts[lo:hi + 1] if hi >= lo else array('q')
+            count, total, vmin, vmax = other.count, other.total, other.min, other.max
+        if not count:
+            return self
+        with self._lock:
+            for offset, c in enumerate(counts):
+                if c:
+                    self._counts[lo + offset] += c
+            self.count += count
+            self.total += total
+            self.min = vmin if self.min is None else min(self.min, vmin)
+            self.max = vmax if self.max is None else max(self.max, vmax)
+            self._lo = min(self._lo, lo)
+            self._hi = max(self._hi, hi)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def copy(self):
+        return LatencyHistogram(self.resolution, self.max_value, self.precision).merge(self)
+
+    def iter_buckets(self):
+        """按从小到大的顺序返回 (桶上界, 样本数)"""
+        with self._lock:
+            items = [(i, self._counts[i]) for i in range(self._lo, self._hi + 1) if self._counts[i]]
+        for index, c in items:
+            yield min(self._upper_value(index), self.max), c
+
+    def encode(self):
+        """序列化为一行紧凑字符串(zlib + base64)，便于写入CSV"""
+        with self._lock:
+            data = {
+                "r": self.resolution,
+                "m": self.max_value,
+                "p": self.precision,
+                "n": self.count,
+                "s": self.total,
+                "lo": self.min,
+                "hi": self.max,
+                "c": [[i, self._counts[i]] for i in range(self._lo, self._hi + 1) if self._counts[i]]
+            }
+        raw = json.dumps(data, separators=(',', ':')).encode()
+        return base64.b64encode(zlib.compress(raw)).decode()
+
+    @classmethod
+    def decode(cls, text):
+        data = json.loads(zlib.decompress(base64.b64decode(text)))
+        hist = cls(resolution=data["r"], max_value=data["m"], precision=data["p"])
+        for index, c in data["c"]:
+            hist._counts[index] = c
+        if data["c"]:
+            hist._lo = data["c"][0][0]
+            hist._hi = data["c"][-1][0]
+        hist.count = data["n"]
+        hist.total = data["s"]
+        hist.min = data["lo"]
+        hist.max = data["hi"]
+        return hist
+
+
+def ms_histogram():
+    """单位为毫秒的延迟直方图(精度1微秒，上限1小时)，各脚本的毫秒结果统一用它"""
+    return LatencyHistogram(resolution=1e-3, max_value=3600e3)
+
+
+def save_histograms(path, histograms, timestamp=None, append=True):
+    """以 timestamp,operation,histogram 的格式把直方图写入CSV
+
+    append=False 时覆盖写入，适合只需保留最新累计快照的场景。
+    """
+    timestamp = timestamp or time.strftime("%Y-%m-%d %H:%M:%S")
+    write_header = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a' if append else 'w') as f:
+        if write_header:
+            f.write("timestamp,operation,histogram\n")
+        for op, hist in histograms.items():
+            if hist.count:
+                f.write(f"{timestamp},{op},{hist.encode()}\n")
+
+
+def load_histograms(path):
+    """读取 save_histograms 写入的文件，返回 [(timestamp, operation, LatencyHistogram)]"""
+    rows = []
+    with open(path) as f:
+        next(f, None)
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            timestamp, op, encoded = line.split(',', 2)
+            rows.append((timestamp, op, LatencyHistogram.decode(encoded)))
+    return rows
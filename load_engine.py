@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from arrival import ArrivalScheduler, ConstantProfile
+
+
+def _make_record(index, intended, actual, finished, wall_start, mono_start, result):
+    return {
+        "index": index,
+        "intended_send_ts": wall_start + (intended - mono_start),
+        "actual_send_ts": wall_start + (actual - mono_start),
+        "send_lag_ms": (actual - intended) * 1000,
+        "service_time_ms": (finished - actual) * 1000,
+        "latency_ms": (finished - intended) * 1000,
+        "result": result,
+    }
+
+
+def _failed(result, is_error):
+    return isinstance(result, Exception) or bool(is_error and is_error(result))
+
+
+async def run_open_loop(send, total, rate=None, max_in_flight=5000, on_done=None, scheduler=None, collect=True,
+                        limiter=None, is_error=None):
+    """按开环到达模型调度 send(index)，记录计划发送时间与实际发送时间
+
+    请求的计划发送时间只由到达模型决定(默认固定速率 start + i / rate)，不受前面请求耗时的影响，
+    因此服务端变慢导致的排队延迟会体现在 latency_ms 中(避免 coordinated omission)。
+    send 为协程函数，返回值会原样放进结果的 "result" 字段。
+    scheduler 为 arrival.ArrivalScheduler，可使用ramp/step/poisson等到达模型。
+    collect=False 时不在内存中保留记录(由 on_done 流式处理)，返回空列表。
+    limiter 为 concurrency_limiter.AsyncAIMDLimiter 时，在途上限由它按SLO自适应调整(仍不超过 max_in_flight)，
+    is_error(result) 用于判断一次请求是否失败。
+    """
+    scheduler = scheduler or ArrivalScheduler(ConstantProfile(rate))
+    semaphore = asyncio.Semaphore(max_in_flight)
+    results = [None] * total if collect else None
+    tasks = set()
+
+    # 墙钟时间只用于落盘展示，所有耗时都用单调时钟计算
+    wall_start = time.time()
+    mono_start = time.monotonic()
+    scheduler.begin(mono_start)
+
+    async def fire(index, intended):
+        try:
+            actual = time.monotonic()
+            try:
+                result = await send(index)
+            except Exception as e:
+                result = e
+            finished = time.monotonic()
+            if limiter:
+                limiter.release(finished - actual, not _failed(result, is_error))
+        finally:
+            semaphore.release()
+
+        record = _make_record(index, intended, actual, finished, wall_start, mono_start, result)
+        if collect:
+            results[index] = record
+        if on_done:
+            on_done(record)
+
+    for _ in range(total):
+        item = await scheduler.wait_async()
+        if item is None:
+            break
+        i, intended = item
+        # 在途请求达到上限时在这里等待，等待时间计入该请求的排队延迟
+        await semaphore.acquire()
+        if limiter:
+            await limiter.acquire()
+        task = asyncio.ensure_future(fire(i, intended))
+        # 完成的任务及时丢弃，内存只随在途请求数增长
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    return [record for record in results if record is not None] if collect else []
+
+
+def run_open_loop_threads(send, total, scheduler, max_in_flight=100, on_done=None, collect=True,
+                          limiter=None, is_error=None):
+    """run_open_loop 的线程池版本，供使用同步 E2BClient 的脚本调用
+
+    send(index) 在线程池中执行，返回的记录格式与 run_open_loop 相同；limiter 为 AIMDLimiter。
+    """
+    semaphore = threading.BoundedSemaphore(max_in_flight)
+    results = [None] * total if collect else None
+    lock = threading.Lock()
+
+    wall_start = time.time()
+    mono_start = time.monotonic()
+    scheduler.begin(mono_start)
+
+    def fire(index, intended):
+        try:
+            actual = time.monotonic()
+            try:
+                result = send(index)
+            except Exception as e:
+                result = e
+            finished = time.monotonic()
+            if limiter:
+                limiter.release(finished - actual, not _failed(result, is_error))
+        finally:
+            semaphore.release()
+
+        record = _make_record(index, intended, actual, finished, wall_start, mono_start, result)
+        if collect:
+            results[index] = record
+        if on_done:
+            with lock:
+                on_done(record)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for _ in range(total):
+            item = scheduler.wait()
+            if item is None:
+                break
+            i, intended = item
+            semaphore.acquire()
+            if limiter:
+                limiter.acquire()
+            executor.submit(fire, i, intended)
+
+    return [record for record in results if record is not None] if collect else []
@@ -0,0 +1,245 @@
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from histogram import LatencyHistogram
+
+WINDOWS = (1, 10, 60)
+QUANTILES = (50, 90, 99)
+
+
+class _Slot:
+    """一秒内某个操作的成功延迟直方图和失败次数"""
+
+    def __init__(self):
+        # 窗口指标只需2位有效数字，内存比累计直方图小一个数量级
+        self.hist = LatencyHistogram(resolution=1e-6, precision=2)
+        self.errors = 0
+
+    def reset(self):
+        self.hist.reset()
+        self.errors = 0
+
+
+class WindowedMetrics:
+    """按秒分片的滑动窗口指标(ops/s、错误率、百分位)
+
+    压测线程只往当前秒的分片里记录；roll() 每秒由后台线程调用一次，封存当前分片，
+    计算各窗口的聚合结果并预先渲染好Prometheus文本，/metrics 直接返回该文本，
+    抓取不会触碰压测线程使用的数据。
+    path 不为空时，每个窗口结束时往该CSV追加一行(1s每秒一行，10s每10秒一行...)。
+    lag 秒: 聚合时跳过最新的 lag 个分片，协调进程用它等待worker迟到(每个tick才发送一次)的分片。
+    """
+
+    def __init__(self, operations, windows=WINDOWS, path=None, export=False, lag=0):
+        self.operations = list(operations)
+        self.windows = tuple(sorted(windows))
+        self.path = path
+        # export=True 时保留封存的分片，供多进程模式发给协调进程
+        self.export = export
+        self.lag = lag
+
+        self._lock = threading.Lock()
+        self._current = {op: _Slot() for op in self.operations}
+        self._history = {op: deque() for op in self.operations}
+        # 与 _history 中分片一一对应的封存时间(整秒)，协调进程按它把worker的分片对齐到同一秒
+        self._seconds = deque()
+        self._totals = {op: [0, 0] for op in self.operations}
+        self._closed = []
+        self._rolls = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+        self.latest = {}
+        self._exposition = self.render().encode()
+
+    def record(self, op, value):
+        """记录一次成功操作的耗时(秒)"""
+        self._current[op].hist.record(value)
+
+    def record_error(self, op):
+        with self._lock:
+            self._current[op].errors += 1
+
+    def absorb(self, closed):
+        """合并其他进程封存的分片(多进程模式下由协调进程调用)
+
+        每个分片按封存时间合并到同一秒的历史分片中；比最新历史分片还新的进入当前秒，
+        早于保留范围的只计入累计总数；lag 不小于worker的发送间隔时，聚合时各秒的数据已经到齐。
+        """
+        decoded = [(second, {op: (LatencyHistogram.decode(encoded), errors)
+                             for op, (encoded, errors) in slots.items()})
+                   for second, slots in closed]
+        with self._lock:
+            for second, slots in decoded:
+                index = None
+                for i in range(len(self._seconds) - 1, -1, -1):
+                    if self._seconds[i] == second:
+                        index = i
+                        break
+                current = index is None and (not self._seconds or second > self._seconds[-1])
+                for op, (hist, errors) in slots.items():
+                    if current:
+                        slot = self._current[op]
+                    else:
+                        # 已封存的分片在roll时已计入总数，这里补上
+                        self._totals[op][0] += hist.count
+                        self._totals[op][1] += errors
+                        if index is None:
+                            continue
+                        slot = self._history[op][index]
+                    slot.hist.merge(hist)
+                    slot.errors += errors
+
+    def take_closed(self):
+        """取出上次调用以来封存的分片，[(封存时间整秒, {op: (编码后的直方图, 失败次数)})]"""
+        with self._lock:
+            closed, self._closed = self._closed, []
+        return closed
+
+    def roll(self):
+        """封存当前秒，计算各窗口的聚合结果"""
+        keep = self.windows[-1] + self.lag
+        closed = {}
+        second = int(time.time())
+        with self._lock:
+            for op in self.operations:
+                history = self._history[op]
+                # 复用最老的分片，避免每秒重新分配直方图
+                fresh = history.popleft() if len(history) >= keep else _Slot()
+                fresh.reset()
+                slot, self._current[op] = self._current[op], fresh
+                history.append(slot)
+                self._totals[op][0] += slot.hist.count
+                self._totals[op][1] += slot.errors
+                if self.export:
+                    closed[op] = (slot.hist.encode(), slot.errors)
+            if len(self._seconds) >= keep:
+                self._seconds.popleft()
+            self._seconds.append(second)
+            if self.export:
+                self._closed.append((second, closed))
+            self._rolls += 1
+            rolls = self._rolls
+
+            # 历史分片可能被 absorb 修改，聚合也在锁内进行(只涉及已封存的分片，不影响压测线程)
+            # 各窗口截止到最新的 lag 个分片之前，时间戳为该分片的封存时间
+            usable = len(self._seconds) - self.lag
+            if usable <= 0:
+                return
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._seconds[usable - 1]))
+            latest = {}
+            rows = []
+            for op in self.operations:
+                slots = list(self._history[op])[:usable]
+                for window in self.windows:
+                    recent = slots[-window:]
+                    merged = LatencyHistogram(resolution=1e-6, precision=2)
+                    errors = 0
+                    for slot in recent:
+                        merged.merge(slot.hist)
+                        errors += slot.errors
+                    total = merged.count + errors
+                    stats = {
+                        "count": merged.count,
+                        "errors": errors,
+                        "ops_per_s": total / len(recent),
+                        "error_rate": errors / total if total else 0,
+                        "max": merged.max or 0,
+                    }
+                    for q, value in zip(QUANTILES, merged.percentiles(*QUANTILES)):
+                        stats[f"p{q}"] = value
+                    latest[(op, window)] = stats
+                    if rolls % window == 0:
+                        rows.append((timestamp, f"{window}s", op, stats))
+
+        self.latest = latest
+        self._exposition = self.render().encode()
+        if self.path and rows:
+            self._write_rows(rows)
+
+    def _write_rows(self, rows):
+        with open(self.path, 'a') as csvfile:
+            if csvfile.tell() == 0:
+                csvfile.write("timestamp,window,operation,count,errors,ops_per_s,error_rate,p50,p90,p99,max\n")
+            for timestamp, window, op, s in rows:
+                csvfile.write(f"{timestamp},{window},{op},{s['count']},{s['errors']},{s['ops_per_s']:.2f},"
+                              f"{s['error_rate']:.4f},{s['p50']:.4f},{s['p90']:.4f},{s['p99']:.4f},{s['max']:.4f}\n")
+
+    def render(self):
+        """生成Prometheus文本格式"""
+        lines = [
+            "# HELP sandbox_ops_per_second Completed operations per second over the window",
+            "# TYPE sandbox_ops_per_second gauge",
+        ]
+        for (op, window), s in self.latest.items():
+            lines.append(f'sandbox_ops_per_second{{operation="{op}",window="{window}s"}} {s["ops_per_s"]:.4f}')
+        lines += [
+            "# HELP sandbox_error_ratio Failed / completed operations over the window",
+            "# TYPE sandbox_error_ratio gauge",
+        ]
+        for (op, window), s in self.latest.items():
+            lines.append(f'sandbox_error_ratio{{operation="{op}",window="{window}s"}} {s["error_rate"]:.6f}')
+        lines += [
+            "# HELP sandbox_latency_seconds Latency quantiles of successful operations over the window",
+            "# TYPE sandbox_latency_seconds gauge",
+        ]
+        for (op, window), s in self.latest.items():
+            for q in QUANTILES:
+                lines.append(f'sandbox_latency_seconds{{operation="{op}",window="{window}s",quantile="{q / 100}"}} '
+                             f'{s[f"p{q}"]:.6f}')
+        lines += [
+            "# HELP sandbox_operations_total Operations completed since start",
+            "# TYPE sandbox_operations_total counter",
+        ]
+        for op, (ok, errors) in self._totals.items():
+            lines.append(f'sandbox_operations_total{{operation="{op}",result="ok"}} {ok}')
+            lines.append(f'sandbox_operations_total{{operation="{op}",result="error"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+    def start(self, interval=1.0):
+        """启动后台线程，每interval秒roll一次"""
+        def loop():
+            next_roll = time.monotonic() + interval
+            while not self._stop.wait(max(0, next_roll - time.monotonic())):
+                try:
+                    self.roll()
+                except Exception as e:
+                    print(f"Error in metrics roll: {str(e)}")
+                next_roll += interval
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve(self, port, host="127.0.0.1"):
+        """在后台线程中提供 /metrics"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics._exposition
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"metrics: http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
@@ -0,0 +1,520 @@
+import argparse
+import asyncio
+import base64
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import random
+import shlex
+import struct
+import tarfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+# 本地模拟的E2B控制面 + envd，用于离线压测脚本本身的开销
+#
+# 启动后按提示导出环境变量即可让脚本和SDK指向本服务:
+#   E2B_BASE_URL / E2B_API_URL / E2B_SANDBOX_URL = http://host:port
+#   E2B_HTTP_VERSION=1.1 (本服务只支持HTTP/1.1)
+
+ENVD_VERSION = "0.4.0"
+STDOUT_CHUNK = 64 * 1024
+OPERATIONS = ['create', 'pause', 'resume', 'connect', 'info', 'list', 'kill', 'timeout', 'exec', 'write', 'read']
+
+
+class LatencyModel:
+    """单个操作的延迟分布，spec格式:
+
+    fixed:MS | uniform:LO:HI | normal:MEAN:STD | lognormal:MEDIAN:SIGMA | exp:MEAN
+    (单位均为毫秒)
+    """
+
+    def __init__(self, spec="fixed:0"):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal', 'exp'):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self):
+        """返回一次采样的延迟(秒)"""
+        p = self.params
+        if self.kind == 'fixed':
+            ms = p[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(p[0], p[1])
+        elif self.kind == 'normal':
+            ms = random.gauss(p[0], p[1])
+        elif self.kind == 'lognormal':
+            ms = p[0] * random.lognormvariate(0, p[1])
+        else:
+            ms = random.expovariate(1 / p[0]) if p[0] > 0 else 0
+        return max(0.0, ms) / 1000
+
+
+class MockError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SandboxStore:
+    """sandbox状态机: running <-> paused, kill后删除；支持容量限制"""
+
+    def __init__(self, max_sandboxes=0, max_running=0):
+        self.max_sandboxes = max_sandboxes
+        self.max_running = max_running
+        self.sandboxes = {}
+        self.lock = threading.Lock()
+        self.op_counts = defaultdict(int)
+        self.op_errors = defaultdict(int)
+        self.started = time.time()
+
+    def _running_count(self):
+        return sum(1 for s in self.sandboxes.values() if s["state"] == "running")
+
+    def _check_running_capacity(self):
+        if self.max_running and self._running_count() >= self.max_running:
+            raise MockError(429, f"running sandbox limit ({self.max_running}) reached")
+
+    def get(self, sandbox_id):
+        sandbox = self.sandboxes.get(sandbox_id)
+        if sandbox is None:
+            raise MockError(404, f"sandbox {sandbox_id} not found")
+        return sandbox
+
+    def create(self, body):
+        with self.lock:
+            if self.max_sandboxes and len(self.sandboxes) >= self.max_sandboxes:
+                raise MockError(429, f"sandbox limit ({self.max_sandboxes}) reached")
+            self._check_running_capacity()
+            sandbox_id = uuid.uuid4().hex[:20]
+            now = datetime.now(timezone.utc)
+            sandbox = {
+                "sandboxID": sandbox_id,
+                "clientID": uuid.uuid4().hex[:8],
+                "templateID": body.get("templateID") or "base",
+                "metadata": body.get("metadata") or {},
+                "timeout": body.get("timeout") or 300,
+                "startedAt": now,
+                "endAt": now + timedelta(seconds=body.get("timeout") or 300),
+                "state": "running",
+                "files": {},
+                "next_pid": 100,
+            }
+            self.sandboxes[sandbox_id] = sandbox
+            return sandbox
+
+    def pause(self, sandbox_id):
+        with self.lock:
+            sandbox = self.get(sandbox_id)
+            if sandbox["state"] != "running":
+                raise MockError(409, f"sandbox {sandbox_id} is already paused")
+            sandbox["state"] = "paused"
+
+    def resume(self, sandbox_id, timeout=None, allow_running=False):
+        with self.lock:
+            sandbox = self.get(sandbox_id)
+            if sandbox["state"] == "running":
+                if not allow_running:
+                    raise MockError(409, f"sandbox {sandbox_id} is already running")
+            else:
+                self._check_running_capacity()
+                sandbox["state"] = "running"
+            if timeout:
+                sandbox["endAt"] = datetime.now(timezone.utc) + timedelta(seconds=timeout)
+            return sandbox
+
+    def kill(self, sandbox_id):
+        with self.lock:
+            self.get(sandbox_id)
+            del self.sandboxes[sandbox_id]
+
+    def running(self, sandbox_id):
+        with self.lock:
+            sandbox = self.get(sandbox_id)
+            if sandbox["state"] != "running":
+                raise MockError(502, f"sandbox {sandbox_id} is not running")
+            return sandbox
+
+    def list(self, states=None, metadata=None):
+        with self.lock:
+            items = list(self.sandboxes.values())
+        if states:
+            items = [s for s in items if s["state"] in states]
+        if metadata:
+            items = [s for s in items if all(s["metadata"].get(k) == v for k, v in metadata.items())]
+        return items
+
+    def stats(self):
+        with self.lock:
+            states = defaultdict(int)
+            for s in self.sandboxes.values():
+                states[s["state"]] += 1
+        elapsed = time.time() - self.started
+        return {
+            "uptime_s": elapsed,
+            "states": dict(states),
+            "ops": dict(self.op_counts),
+            "errors": dict(self.op_errors),
+            "ops_per_s": sum(self.op_counts.values()) / elapsed if elapsed > 0 else 0,
+        }
+
+
+def sandbox_json(sandbox, detail=False):
+    data = {
+        "templateID": sandbox["templateID"],
+        "sandboxID": sandbox["sandboxID"],
+        "clientID": sandbox["clientID"],
+        "envdVersion": ENVD_VERSION,
+    }
+    if detail:
+        data.update({
+            "startedAt": sandbox["startedAt"].isoformat(),
+            "endAt": sandbox["endAt"].isoformat(),
+            "cpuCount": 2,
+            "memoryMB": 512,
+            "diskSizeMB": 1024,
+            "state": sandbox["state"],
+            "metadata": sandbox["metadata"],
+        })
+    return data
+
+
+def connect_frame(message, flags=0):
+    """Connect协议的流式消息封包: 1字节flags + 4字节长度 + JSON"""
+    payload = json.dumps(message).encode()
+    return struct.pack(">BI", flags, len(payload)) + payload
+
+
+def extract_bundle(sandbox, data, target):
+    """把tar.gz包解到sandbox的模拟文件系统中"""
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                sandbox["files"][f"{target}/{member.name}"] = tar.extractfile(member).read()
+
+
+def simulate_command(sandbox, cmd):
+    """模拟命令输出，只覆盖压测脚本会执行的命令"""
+    if " && " in cmd:
+        return "".join(simulate_command(sandbox, part) for part in cmd.split(" && "))
+    if cmd.startswith("echo '") and "| base64 -d | tar -xzf - -C " in cmd:
+        encoded = cmd.split("'")[1]
+        extract_bundle(sandbox, base64.b64decode(encoded), cmd.rsplit("-C ", 1)[1].strip())
+        return ""
+    if cmd.startswith("echo '") and "| base64 -d > " in cmd:
+        sandbox["files"][cmd.rsplit("> ", 1)[1].strip()] = base64.b64decode(cmd.split("'")[1])
+        return ""
+    if cmd.startswith("python3 press_workload.py "):
+        # 压力负载启动脚本: 假装所有进程都已启动，返回健康摘要
+        manifest = json.loads(shlex.split(cmd)[2])
+        expected = {kind: int((manifest.get(kind) or {}).get("procs", 0)) for kind in ("cpu", "memory", "disk")}
+        summary = {"ok": True, "expected": expected, "running": expected, "exited": [],
+                   "pids": list(range(100, 100 + sum(expected.values()))), "cpus": 2,
+                   "loadavg": [float(sum(expected.values())), 0.0, 0.0],
+                   "mem_total_mb": 4096, "mem_available_mb": 3072, "disk_free_mb": 10240}
+        return "WORKLOAD_SUMMARY " + json.dumps(summary) + "\n"
+    if cmd.startswith("tar -xzf "):
+        parts = cmd.split()
+        data = sandbox["files"].get(parts[2])
+        if data:
+            extract_bundle(sandbox, data, parts[-1])
+        return ""
+    if cmd.startswith("cat ") and " > " in cmd:
+        # 分块上传后的拼接: cat P.part.00000 P.part.00001 ... > P，按参数顺序(通配符按文件名顺序展开)
+        sources, target = (part.strip() for part in cmd[4:].split(" > ", 1))
+        names = [name for pattern in sources.split()
+                 for name in sorted(name for name in sandbox["files"] if fnmatch.fnmatch(name, pattern))]
+        sandbox["files"][target] = b"".join(sandbox["files"][name] for name in names)
+        return ""
+    if cmd.startswith("rm -f "):
+        for pattern in cmd[6:].split():
+            for name in [name for name in sandbox["files"] if fnmatch.fnmatch(name, pattern)]:
+                del sandbox["files"][name]
+        return ""
+    if cmd.startswith("sha256sum "):
+        return "".join(f"{hashlib.sha256(sandbox['files'][name]).hexdigest()}  {name}\n"
+                       for name in cmd.split()[1:] if name in sandbox["files"])
+    if cmd.startswith("ls"):
+        lines = [f"-rw-r--r-- 1 user user {len(data)} {name}" for name, data in sorted(sandbox["files"].items())]
+        return f"total {len(lines)}\n" + "".join(line + "\n" for line in lines)
+    if cmd.startswith("echo "):
+        return cmd[5:] + "\n"
+    if cmd.startswith("yes ") and " | head -c " in cmd:
+        # 大量输出: 重复 yes 的参数直到指定字节数
+        text, size = cmd[4:].split(" | head -c ", 1)
+        line = (text.strip("'") or "y") + "\n"
+        size = int(size)
+        return (line * (size // len(line) + 1))[:size]
+    if cmd.startswith("python"):
+        return f"mock sandbox {sandbox['sandboxID']}: {cmd}\n"
+    return ""
+
+
+def parse_multipart(body, content_type):
+    """解析 multipart/form-data，返回 [(filename, data)]"""
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    files = []
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        head, data = part.split(b"\r\n\r\n", 1)
+        if data.endswith(b"\r\n"):
+            data = data[:-2]
+        filename = None
+        for line in head.decode(errors="replace").split("\r\n"):
+            if "filename=" in line:
+                filename = line.split("filename=", 1)[1].strip('"')
+        files.append((filename, data))
+    return files
+
+
+class MockApp:
+    """aiohttp版本的请求处理，延迟用asyncio.sleep模拟，可同时挂起上千个请求"""
+
+    def __init__(self, store, latencies, error_rates):
+        self.store = store
+        self.latencies = latencies
+        self.error_rates = error_rates
+
+    def build(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route("*", "/{tail:.*}", self.dispatch)
+        return app
+
+    async def _simulate(self, op):
+        self.store.op_counts[op] += 1
+        delay = self.latencies[op].sample()
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.error_rates.get(op, 0):
+            raise MockError(500, f"injected {op} error")
+
+    @staticmethod
+    def _sandbox_id(raw):
+        # 脚本使用 sandboxID-clientID 形式的combined_id
+        return raw.split('-')[0]
+
+    @staticmethod
+    async def _json_body(request):
+        body = await request.read()
+        return json.loads(body) if body else {}
+
+    async def dispatch(self, request):
+        path = request.path
+        parts = [p for p in path.split('/') if p]
+        if parts and parts[0] == "v2":
+            parts = parts[1:]
+        try:
+            if path == "/health":
+                return web.Response(status=204)
+            if path == "/mock/stats":
+                return web.json_response(self.store.stats())
+            if parts and parts[0] == "sandboxes":
+                if not request.headers.get("X-API-Key"):
+                    raise MockError(401, "missing X-API-Key")
+                return await self._handle_api(request, parts[1:])
+            if path == "/files":
+                return await self._handle_files(request)
+            if path.startswith("/process.Process/"):
+                return await self._handle_process(request, path.rsplit('/', 1)[1])
+            raise MockError(404, f"{request.method} {path} not implemented in mock")
+        except MockError as e:
+            self.store.op_errors[e.status] += 1
+            return web.json_response({"code": e.status, "message": e.message}, status=e.status)
+
+    # ---- 控制面 ----
+    async def _handle_api(self, request, parts):
+        store = self.store
+        method = request.method
+        if not parts:
+            if method == "POST":
+                body = await self._json_body(request)
+                await self._simulate("create")
+                return web.json_response(sandbox_json(store.create(body)), status=201)
+            await self._simulate("list")
+            return self._handle_list(request.query)
+
+        sandbox_id = self._sandbox_id(parts[0])
+        action = parts[1] if len(parts) > 1 else None
+
+        if action is None and method == "GET":
+            await self._simulate("info")
+            with store.lock:
+                data = sandbox_json(store.get(sandbox_id), detail=True)
+            return web.json_response(data)
+        if action is None and method == "DELETE":
+            await self._simulate("kill")
+            store.kill(sandbox_id)
+            return web.Response(status=204)
+        if action == "pause":
+            await self._simulate("pause")
+            store.pause(sandbox_id)
+            return web.Response(status=204)
+        if action == "resume":
+            body = await self._json_body(request)
+            await self._simulate("resume")
+            return web.json_response(sandbox_json(store.resume(sandbox_id, body.get("timeout"))), status=201)
+        if action == "connect":
+            body = await self._json_body(request)
+            await self._simulate("connect")
+            with store.lock:
+                was_running = store.get(sandbox_id)["state"] == "running"
+            sandbox = store.resume(sandbox_id, body.get("timeout"), allow_running=True)
+            return web.json_response(sandbox_json(sandbox), status=200 if was_running else 201)
+        if action == "timeout":
+            body = await self._json_body(request)
+            await self._simulate("timeout")
+            store.resume(sandbox_id, body.get("timeout"), allow_running=True)
+            return web.Response(status=204)
+        raise MockError(404, f"unknown sandbox action {action}")
+
+    def _handle_list(self, query):
+        metadata = {}
+        for item in query.getall("metadata", []):
+            for pair in item.split('&'):
+                if '=' in pair:
+                    k, v = pair.split('=', 1)
+                    metadata[k] = v
+        states = []
+        for item in query.getall("state", []):
+            states.extend(item.split(','))
+        items = self.store.list(states or ["running", "paused"], metadata)
+        items.sort(key=lambda s: s["sandboxID"])
+
+        # 基于sandboxID的游标分页
+        limit = int(query.get("limit", "100"))
+        token = query.get("nextToken")
+        if token:
+            items = [s for s in items if s["sandboxID"] > token]
+        page, rest = items[:limit], items[limit:]
+        headers = {"x-next-token": page[-1]["sandboxID"]} if rest else None
+        return web.json_response([sandbox_json(s, detail=True) for s in page], headers=headers)
+
+    # ---- envd ----
+    def _envd_sandbox(self, request):
+        sandbox_id = request.headers.get("E2b-Sandbox-Id")
+        if not sandbox_id:
+            raise MockError(400, "missing E2b-Sandbox-Id header")
+        return self.store.running(sandbox_id)
+
+    async def _handle_files(self, request):
+        sandbox = self._envd_sandbox(request)
+        path = request.query.get("path", "")
+        if request.method == "GET":
+            await self._simulate("read")
+            data = sandbox["files"].get(path)
+            if data is None:
+                raise MockError(404, f"file {path} not found")
+            return web.Response(body=data, content_type="application/octet-stream")
+
+        body = await request.read()
+        await self._simulate("write")
+        content_type = request.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            entries = []
+            for filename, data in parse_multipart(body, content_type):
+                file_path = path or filename
+                sandbox["files"][file_path] = data
+                entries.append(file_path)
+        else:
+            sandbox["files"][path] = body
+            entries = [path]
+        return web.json_response([{"name": p.rsplit('/', 1)[-1], "type": "file", "path": p} for p in entries])
+
+    async def _handle_process(self, request, method_name):
+        sandbox = self._envd_sandbox(request)
+        body = await request.read()
+        if method_name != "Start":
+            raise MockError(501, f"process.{method_name} not implemented in mock")
+
+        # 流式请求同样带5字节封包头
+        message = json.loads(body[5:]) if body else {}
+        args = message.get("process", {}).get("args", [])
+        cmd = args[-1] if args else ""
+        await self._simulate("exec")
+
+        with self.store.lock:
+            pid = sandbox["next_pid"]
+            sandbox["next_pid"] += 1
+        stdout = simulate_command(sandbox, cmd)
+
+        frames = [connect_frame({"event": {"start": {"pid": pid}}})]
+        # 大输出按64KB分成多个data事件，与真实envd的流式输出类似
+        data = stdout.encode()
+        for offset in range(0, len(data), STDOUT_CHUNK):
+            chunk = data[offset:offset + STDOUT_CHUNK]
+            frames.append(connect_frame({"event": {"data": {"stdout": base64.b64encode(chunk).decode()}}}))
+        frames.append(connect_frame({"event": {"end": {"exitCode": 0, "exited": True, "status": "exit status 0"}}}))
+        frames.append(connect_frame({}, flags=0x02))
+        return web.Response(body=b"".join(frames), content_type="application/connect+json")
+
+
+def parse_op_values(items, parse):
+    """解析 op=value 形式的参数列表"""
+    result = {}
+    for item in items or []:
+        op, value = item.split('=', 1)
+        if op not in OPERATIONS:
+            raise ValueError(f"未知的操作 {op}，可选: {', '.join(OPERATIONS)}")
+        result[op] = parse(value)
+    return result
+
+
+def create_app(latencies=None, error_rates=None, max_sandboxes=0, max_running=0):
+    """创建mock服务的aiohttp应用，latencies为 {op: spec}"""
+    store = SandboxStore(max_sandboxes=max_sandboxes, max_running=max_running)
+    models = defaultdict(LatencyModel)
+    for op, spec in (latencies or {}).items():
+        models[op] = LatencyModel(spec)
+    app = MockApp(store, models, error_rates or {}).build()
+    app["store"] = store
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local mock of the E2B control plane and envd')
+    parser.add_argument('--host', default='127.0.0.1', help='Listen address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=3000, help='Listen port (default: 3000)')
+    parser.add_argument('--latency', action='append', metavar='OP=SPEC',
+                      help='Latency distribution per operation, e.g. create=lognormal:300:0.4 '
+                           '(fixed:MS, uniform:LO:HI, normal:MEAN:STD, lognormal:MEDIAN:SIGMA, exp:MEAN)')
+    parser.add_argument('--error-rate', action='append', metavar='OP=RATE',
+                      help='Injected 500 error probability per operation, e.g. pause=0.01')
+    parser.add_argument('--max-sandboxes', type=int, default=0,
+                      help='Max sandboxes (running + paused), 0 = unlimited')
+    parser.add_argument('--max-running', type=int, default=0,
+                      help='Max running sandboxes, 0 = unlimited')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    app = create_app(
+        latencies=parse_op_values(args.latency, lambda v: v),
+        error_rates=parse_op_values(args.error_rate, float),
+        max_sandboxes=args.max_sandboxes,
+        max_running=args.max_running
+    )
+
+    url = f"http://{args.host}:{args.port}"
+    print(f"mock E2B 服务已启动: {url}")
+    print("使用以下环境变量让脚本和SDK指向本服务:")
+    print(f"  export E2B_BASE_URL={url}")
+    print(f"  export E2B_API_URL={url}")
+    print(f"  export E2B_SANDBOX_URL={url}")
+    print("  export E2B_HTTP_VERSION=1.1")
+    print("  export E2B_API_KEY=mock E2B_TEMPLATE_ID=mock")
+    print(f"运行统计: curl {url}/mock/stats")
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    web.run_app(app, host=args.host, port=args.port, print=None, backlog=4096,
+                access_log=logging.getLogger("aiohttp.access") if args.verbose else None)
@@ -0,0 +1,103 @@
+import atexit
+import os
+import threading
+import time
+
+from results_store import ResultWriter
+
+# 生命周期操作录制，供 trace_replay.py 按同样的顺序和节奏回放
+#
+# 启用后 E2BClient / AsyncE2BClient 的 create/pause/resume/kill 以及 sandbox_test.py 的
+# SDK创建和代码执行(exec)，每完成一次就向JSONL文件追加一行:
+#   {"ts": 发出时间, "op": "pause", "sandbox": "s12", "payload": null, "ok": true, "status": 200, "latency_ms": 85.2}
+# sandbox 是按首次出现顺序编号的逻辑ID，与真实ID无关，回放时映射到新创建的sandbox。
+# 未启用时 record() 只有一次全局变量判断。
+
+OPS = ("create", "pause", "resume", "kill", "exec")
+
+_writer = None
+_lock = threading.Lock()
+_logical_ids = {}
+_next_id = 0
+
+
+def enable(path):
+    """开始把操作录制到 path (JSONL)，path为空时不录制"""
+    global _writer, _next_id
+    if not path:
+        return
+    close()
+    with _lock:
+        _logical_ids.clear()
+        _next_id = 0
+        _writer = ResultWriter(path)
+    atexit.register(close)
+    print(f"录制生命周期操作到 {path}")
+
+
+def enabled():
+    return _writer is not None
+
+
+def close():
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer:
+        writer.close()
+
+
+def _logical_id(sandbox_id):
+    """真实ID对应的逻辑ID(combined_id和sandbox_id视为同一个)，创建失败没有ID时分配新的，调用方需持有锁"""
+    global _next_id
+    key = sandbox_id.split('-')[0] if sandbox_id else None
+    if key in _logical_ids:
+        return _logical_ids[key]
+    _next_id += 1
+    logical = f"s{_next_id}"
+    if key:
+        _logical_ids[key] = logical
+    return logical
+
+
+def record(op, sandbox_id=None, payload=None, ts=None, ok=True, status=None, error=None):
+    """记录一次已完成的操作，ts 为发出时间(time.time())；未启用录制时什么都不做
+
+    失败的创建(sandbox_id为None)也占用一个逻辑ID，回放时同样会发出。
+    """
+    if _writer is None:
+        return
+    now = time.time()
+    ts = ts or now
+    with _lock:
+        if _writer is None:
+            return
+        entry = {
+            "ts": round(ts, 6),
+            "op": op,
+            "sandbox": _logical_id(sandbox_id),
+            "payload": payload,
+            "ok": ok,
+            "status": status,
+            "latency_ms": round((now - ts) * 1000, 3),
+        }
+        if error:
+            entry["error"] = error
+        _writer.write(entry)
+
+
+def create_payload(payload):
+    """录制的创建参数，去掉每次运行都不同的metadata"""
+    return {key: value for key, value in payload.items() if key != "metadata"}
+
+
+def add_arguments(parser):
+    """给压测脚本加上 --record 参数"""
+    parser.add_argument('--record', default=os.getenv("E2B_RECORD"),
+                      help='Record every lifecycle operation to this JSONL trace for trace_replay.py '
+                           '(default: $E2B_RECORD, disabled)')
+
+
+def from_args(args):
+    """指定了 --record 时开始录制"""
+    enable(getattr(args, "record", None))
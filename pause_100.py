@@ -1,41 +1,40 @@
-import concurrent.futures
+import argparse
 import os
-import statistics
 import time
-import numpy as np
-import pandas as pd
-import requests
 from tqdm import tqdm
 from dotenv import load_dotenv
+from e2b_client import E2BClient, ENDPOINT_TIMEOUTS, split_combined_id
+from histogram import ms_histogram, save_histograms
+from arrival import ArrivalScheduler, parse_profile
+from load_engine import run_open_loop_threads
+import concurrency_limiter
+import op_trace
+import request_policy
+from results_store import ResultWriter, read_records
+from sweep import DEFAULT_LEVELS, ROUNDS_PER_LEVEL, parse_levels, report_sweep, sweep, total_needed
 
 # 加载环境变量
 load_dotenv()
 
 # 配置参数
-API_KEY = os.getenv("E2B_API_KEY")
-BASE_URL = os.getenv("E2B_BASE_URL") + "/sandboxes"
 RESULTS_CSV_FILE = "create_results.csv"
+PAUSE_RESULTS_FILE = "pause_results.csv"
+PAUSE_COLUMNS = ["combined_id", "sandbox_id", "pause_time_ms"]
 MAX_SANDBOXES_TO_PAUSE = 100  # 只暂停前100个sandbox
 
-def pause_sandbox(combined_id):
+def pause_sandbox(client, combined_id):
     """暂停指定的sandbox并返回操作时间"""
     start_time = time.time()
 
     # 从combined_id中提取sandbox_id (格式是sandboxID-clientID)
-    sandbox_id = combined_id.split('-')[0] if '-' in combined_id else combined_id
-
-    url = f"{BASE_URL}/{combined_id}/pause"
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
+    sandbox_id = split_combined_id(combined_id)
 
     try:
-        response = requests.post(url, headers=headers)
+        response = client.pause_sandbox(combined_id)
         duration_ms = (time.time() - start_time) * 1000
 
-        # 修改为接受更广泛的成功状态码
-        if response.status_code in [200, 201, 202, 204]:
+        # 接受更广泛的成功状态码，重试得到的409说明上一次请求已经生效
+        if response.succeeded:
             return combined_id, sandbox_id, duration_ms, None
         else:
             error_msg = f"暂停失败，状态码: {response.status_code}, 错误: {response.text[:100]}..."
@@ -51,17 +50,18 @@ def load_combined_ids_from_csv():
         return []
 
     try:
-        # 读取CSV文件
-        df = pd.read_csv(RESULTS_CSV_FILE)
+        # 逐行读取CSV文件(上次运行中断时会跳过写了一半的最后一行)
+        records = list(read_records(RESULTS_CSV_FILE))
+        columns = records[0].keys() if records else []
 
         # 首先检查是否存在combined_id列
-        if 'combined_id' in df.columns:
-            combined_ids = df['combined_id'].dropna().tolist()
+        if 'combined_id' in columns:
+            combined_ids = [r['combined_id'] for r in records if r['combined_id']]
             print(f"从 {RESULTS_CSV_FILE} 加载了 {len(combined_ids)} 个combined ID")
             return combined_ids
         # 如果没有combined_id列，则检查是否存在sandbox_id列
-        elif 'sandbox_id' in df.columns:
-            sandbox_ids = df['sandbox_id'].dropna().tolist()
+        elif 'sandbox_id' in columns:
+            sandbox_ids = [r['sandbox_id'] for r in records if r['sandbox_id']]
             print(f"从 {RESULTS_CSV_FILE} 加载了 {len(sandbox_ids)} 个sandbox ID")
             return sandbox_ids
         else:
@@ -71,23 +71,12 @@ def load_combined_ids_from_csv():
         print(f"读取CSV文件时出错: {e}")
         return []
 
-def calculate_stats(times):
-    """计算时间统计数据，包括p99和p90"""
-    valid_times = [t for t in times if t > 0]
-    if not valid_times:
-        return {"min": 0, "max": 0, "avg": 0, "median": 0, "p90": 0, "p99": 0}
-
-    return {
-        "min": min(valid_times),
-        "max": max(valid_times),
-        "avg": sum(valid_times) / len(valid_times),
-        "median": statistics.median(valid_times),
-        "p90": np.percentile(valid_times, 90),
-        "p99": np.percentile(valid_times, 99)
-    }
-
-def pause_sandboxes():
-    """暂停前100个从CSV文件加载的sandbox"""
+def pause_sandboxes(split_latency=False, profile=None, max_in_flight=100, limiter=None, policies=None):
+    """暂停前100个从CSV文件加载的sandbox
+
+    profile 为空时单线程逐个暂停；否则按到达模型开环发送，耗时从计划发送时间算起(含排队)。
+    limiter 为 AIMDLimiter 时开环发送的在途数按SLO自适应调整(不超过 max_in_flight)。
+    """
     combined_ids = load_combined_ids_from_csv()
     if not combined_ids:
         return
@@ -96,34 +85,71 @@ def pause_sandboxes():
     combined_ids = combined_ids[:MAX_SANDBOXES_TO_PAUSE]
 
     print(f"开始暂停 {len(combined_ids)} 个sandbox...")
-    pause_results = []
+    # 每个结果立即落盘，中途崩溃时 resume.py 仍可使用已暂停的部分
+    pause_results = ResultWriter(PAUSE_RESULTS_FILE, columns=PAUSE_COLUMNS)
+    # 直方图单位为毫秒，精度1微秒
+    pause_times = ms_histogram()
     errors = []
-
-    # 使用单线程暂停sandbox
-    with tqdm(total=len(combined_ids), desc="暂停sandbox") as pbar:
-        for i, combined_id in enumerate(combined_ids):
-            # 暂停当前sandbox
-            combined_id, sandbox_id, pause_time, error = pause_sandbox(combined_id)
-
+    client = E2BClient(pool_size=1 if profile is None else max_in_flight, split_latency=split_latency,
+                       policies=policies)
+
+    if profile is None:
+        # 使用单线程暂停sandbox
+        with tqdm(total=len(combined_ids), desc="暂停sandbox") as pbar:
+            for i, combined_id in enumerate(combined_ids):
+                # 暂停当前sandbox
+                combined_id, sandbox_id, pause_time, error = pause_sandbox(client, combined_id)
+
+                if error:
+                    errors.append((combined_id, error))
+                    print(f"暂停 {combined_id} 失败: {error}")
+
+                pause_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "pause_time_ms": pause_time})
+                pbar.update(1)
+
+                if pause_time > 0:
+                    pause_times.record(pause_time)
+
+                # 显示实时成功率
+                success_rate = pause_times.count / (i + 1) * 100
+                pbar.set_postfix({'success': f"{success_rate:.1f}%"})
+    else:
+        # 按到达模型开环发送
+        scheduler = ArrivalScheduler(profile)
+        print(f"开环模式: {profile.describe()}, 最大在途 {max_in_flight}")
+
+        def on_done(record):
+            combined_id, sandbox_id, pause_time, error = record["result"]
             if error:
                 errors.append((combined_id, error))
                 print(f"暂停 {combined_id} 失败: {error}")
-
-            pause_results.append((combined_id, sandbox_id, pause_time))
+            else:
+                # 用含排队延迟的耗时统计，避免 coordinated omission
+                pause_times.record(record["latency_ms"])
+            pause_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "pause_time_ms": pause_time})
             pbar.update(1)
 
-            # 显示实时成功率
-            success_count = len([t for _, _, t in pause_results if t > 0])
-            success_rate = success_count / (i + 1) * 100
-            pbar.set_postfix({'success': f"{success_rate:.1f}%"})
-
-    # 提取暂停时间
-    pause_times = [time for _, _, time in pause_results if time > 0]
+        with tqdm(total=len(combined_ids), desc="暂停sandbox") as pbar:
+            run_open_loop_threads(
+                lambda index: pause_sandbox(client, combined_ids[index]),
+                total=len(combined_ids),
+                scheduler=scheduler,
+                max_in_flight=max_in_flight,
+                on_done=on_done,
+                collect=False,
+                limiter=limiter,
+                is_error=lambda result: result[3] is not None
+            )
+        scheduler.print_lag()
+        if limiter:
+            limiter.print_summary()
+            limiter.close()
+    pause_results.close()
 
     # 计算统计数据
-    stats = calculate_stats(pause_times)
+    stats = pause_times.summary()
 
-    print(f"\n成功暂停 {len(pause_times)}/{len(combined_ids)} 个sandbox ({len(pause_times)/len(combined_ids)*100:.1f}%)")
+    print(f"\n成功暂停 {pause_times.count}/{len(combined_ids)} 个sandbox ({pause_times.count/len(combined_ids)*100:.1f}%)")
     print(f"暂停时间统计 (ms):")
     print(f"  最小: {stats['min']:.2f}")
     print(f"  最大: {stats['max']:.2f}")
@@ -131,15 +157,11 @@ def pause_sandboxes():
     print(f"  中位数: {stats['median']:.2f}")
     print(f"  90%分位 (P90): {stats['p90']:.2f}")
     print(f"  99%分位 (P99): {stats['p99']:.2f}")
+    client.print_connection_stats()
+    client.print_policy_stats()
 
-    # 创建详细的结果数据
-    results = pd.DataFrame({
-        "combined_id": [cid for cid, _, _ in pause_results],
-        "sandbox_id": [sid for _, sid, _ in pause_results],
-        "pause_time_ms": [time for _, _, time in pause_results]
-    })
-    results.to_csv("pause_results.csv", index=False)
-    print("暂停结果已保存到 pause_results.csv")
+    print(f"暂停结果已保存到 {PAUSE_RESULTS_FILE}")
+    save_histograms("pause_results_hist.csv", {"pause": pause_times, **client.policy_histograms()}, append=False)
 
     # 保存错误信息
     if errors:
@@ -148,5 +170,72 @@ def pause_sandboxes():
                 f.write(f"{combined_id}: {error}\n")
         print(f"错误信息已保存到 pause_errors.txt ({len(errors)} 个错误)")
 
+def pause_sweep(levels, per_level, split_latency=False, policies=None):
+    """按并发档位扫描暂停的吞吐和延迟，每档使用 per_level 个新的sandbox"""
+    combined_ids = load_combined_ids_from_csv()
+    if not combined_ids:
+        return
+
+    needed = total_needed(levels, per_level)
+    if len(combined_ids) < needed:
+        print(f"警告: 扫描共需 {needed} 个sandbox，只有 {len(combined_ids)} 个，高并发档位可能被跳过")
+    combined_ids = combined_ids[:needed]
+    print(f"并发扫描: 档位 {levels}, 每档 max({per_level}, {ROUNDS_PER_LEVEL}x并发) 个sandbox, 共 {len(combined_ids)} 个")
+    client = E2BClient(pool_size=max(levels), split_latency=split_latency, policies=policies)
+    errors = []
+    # 与普通模式相同格式，resume.py 可以直接接着恢复
+    pause_results = ResultWriter(PAUSE_RESULTS_FILE, columns=PAUSE_COLUMNS)
+
+    def op(combined_id):
+        _, sandbox_id, pause_time, error = pause_sandbox(client, combined_id)
+        if error:
+            errors.append((combined_id, error))
+        pause_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "pause_time_ms": pause_time})
+        return pause_time
+
+    try:
+        rows, histograms = sweep("pause", op, combined_ids, levels, per_level)
+    finally:
+        pause_results.close()
+    report_sweep("pause", rows, histograms)
+    client.print_connection_stats()
+    client.print_policy_stats()
+    print(f"暂停结果已保存到 {PAUSE_RESULTS_FILE}")
+
+    if errors:
+        with open("pause_errors.txt", "w") as f:
+            for combined_id, error in errors:
+                f.write(f"{combined_id}: {error}\n")
+        print(f"错误信息已保存到 pause_errors.txt ({len(errors)} 个错误)")
+
 if __name__ == "__main__":
-    pause_sandboxes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Pause sandboxes listed in create_results.csv')
+    parser.add_argument('--split-connection-latency', action='store_true',
+                      help='Report latencies on reused vs newly opened connections separately')
+    parser.add_argument('--profile', type=parse_profile, default=None,
+                      help='Send pauses open-loop with this arrival profile instead of one at a time: '
+                           'constant:RATE | ramp:START:END:SECONDS | step:RATExSECONDS,... | poisson:RATE[:BURST]')
+    parser.add_argument('--max-in-flight', type=int, default=100,
+                      help='Max concurrent pause requests with --profile (default: 100)')
+    parser.add_argument('--sweep', type=parse_levels, nargs='?', const=DEFAULT_LEVELS, default=None,
+                      help='Sweep pause concurrency over these levels, e.g. 1,2,4,8 (default: 1,2,4,...,128)')
+    parser.add_argument('--per-level', type=int, default=50,
+                      help=f'Minimum fresh sandboxes paused at each sweep level; each level uses at least '
+                           f'{ROUNDS_PER_LEVEL} x its concurrency (default: 50)')
+    concurrency_limiter.add_arguments(parser)
+    request_policy.add_arguments(parser)
+    op_trace.add_arguments(parser)
+    args = parser.parse_args()
+    if args.adaptive and args.profile is None:
+        parser.error("--adaptive 需要配合 --profile 使用")
+    op_trace.from_args(args)
+
+    policies = request_policy.from_args(args, ENDPOINT_TIMEOUTS)
+
+    if args.sweep:
+        pause_sweep(args.sweep, args.per_level, split_latency=args.split_connection_latency,
+                    policies=policies)
+    else:
+        pause_sandboxes(split_latency=args.split_connection_latency, profile=args.profile,
+                        max_in_flight=args.max_in_flight, limiter=concurrency_limiter.from_args(args, "pause"),
+                        policies=policies)
\ No newline at end of file
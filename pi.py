@@ -1,49 +1,147 @@
+import argparse
 import math
-from decimal import Decimal, getcontext
+import sys
 import time
 
-# 使用Chudnovsky算法计算π
+# Chudnovsky算法的常数 640320^3 / 24
+C3_OVER_24 = 640320 ** 3 // 24
+# 每一项约贡献14.18位
+DIGITS_PER_TERM = 14.181647462725477
+# 校准模式下单次计算位数的上限，限制每个进程的内存占用(100万位约几十MB)
+MAX_DIGITS = 1000000
+MIN_DIGITS = 1000
+# 耗时约与位数的1.8次方成正比(CPython的大整数乘除法分别是Karatsuba和平方复杂度)，校准时按此估算
+COST_EXPONENT = 1.8
+
+
+def _split(a, b):
+    """二分计算第 [a, b) 项，返回整数 P, Q, T"""
+    if b - a == 1:
+        if a == 0:
+            p = q = 1
+        else:
+            p = (6 * a - 5) * (2 * a - 1) * (6 * a - 1)
+            q = a * a * a * C3_OVER_24
+        t = p * (13591409 + 545140134 * a)
+        return p, q, -t if a & 1 else t
+    m = (a + b) // 2
+    p1, q1, t1 = _split(a, m)
+    p2, q2, t2 = _split(m, b)
+    return p1 * p2, q1 * q2, q2 * t1 + p1 * t2
+
+
+# 使用Chudnovsky算法计算π: 整数二分(binary splitting)，不使用Decimal
 def calculate_pi(digits):
-    getcontext().prec = digits + 10
-
-    C = 426880 * Decimal(10005).sqrt()
-    M = Decimal(1)
-    L = Decimal(13591409)
-    X = Decimal(1)
-    K = Decimal(6)
-    S = L
-
-    for i in range(1, digits // 14 + 10):
-        M = M * (K**3 - 16*K) // (i**3)
-        L += 545140134
-        X *= -262537412640768000
-        S += (M * L) / X
-        K += 12
-
-    pi = C / S
-    return str(pi)[:digits+1]
-
-# 持续计算π，不断增加位数
-start_digits = 1000
-max_digits = 1000000000  # 设置一个非常大的上限，实际上不会达到
-current_digits = start_digits
-
-print("开始持续计算π值...")
-while current_digits <= max_digits:
-    start_time = time.time()
-    print(f"\\n计算π到{current_digits}位...")
+    """返回 floor(π * 10^digits)，即去掉小数点的前 digits+1 位"""
+    terms = int(digits / DIGITS_PER_TERM) + 2
+    _, q, t = _split(0, terms)
+    # 多算10位防止截断误差
+    one = 10 ** (digits + 10)
+    sqrt_c = math.isqrt(10005 * one * one)
+    return q * 426880 * sqrt_c // t // 10 ** 10
+
+
+def pi_prefix(value, digits, n=50):
+    """calculate_pi 结果的前 n 位小数，写成 "3.14..." 形式(不把整个大整数转成字符串)"""
+    n = min(n, digits)
+    head = str(value // 10 ** (digits - n))
+    return head[0] + "." + head[1:]
+
+
+def cpu_time(digits):
+    """计算一次 digits 位消耗的CPU秒数"""
+    start = time.process_time()
+    calculate_pi(digits)
+    return time.process_time() - start
 
-    try:
-        pi_value = calculate_pi(current_digits)
-        end_time = time.time()
 
-        print(f"π计算结果 (前50位): {pi_value[:50]}...")
-        print(f"总计算位数: {len(pi_value)-1}")
-        print(f"计算耗时: {end_time - start_time:.2f} 秒")
+def calibrate(cpu_seconds, max_digits=MAX_DIGITS):
+    """找到单次计算约消耗 cpu_seconds 秒CPU的位数，不超过 max_digits
 
-        # 每次计算完后增加位数
-        current_digits = int(current_digits * 1.5)  # 每次增加50%的位数
+    用进程CPU时间而不是墙钟时间，和其他进程争抢CPU(或被nice降低优先级)时结果不变。
+    """
+    digits = MIN_DIGITS
+    used = cpu_time(digits)
+    # 先翻倍到足够大，避免小位数时计时误差过大
+    while used < cpu_seconds / 8 and digits < max_digits:
+        digits = min(max_digits, digits * 2)
+        used = cpu_time(digits)
+    # 再按耗时与位数的关系估算两次
+    for _ in range(2):
+        if digits >= max_digits and used <= cpu_seconds:
+            break
+        scale = (cpu_seconds / max(used, 1e-6)) ** (1 / COST_EXPONENT)
+        digits = max(MIN_DIGITS, min(max_digits, int(digits * scale)))
+        used = cpu_time(digits)
+    return digits, used
 
-    except Exception as e:
-        print(f"计算出错: {str(e)}")
-        break
\ No newline at end of file
+
+def burn(digits=None, cpu_seconds=1.0, max_digits=MAX_DIGITS, duration=0, iterations=0,
+         report_every=10.0, running=None, label="π"):
+    """以固定位数反复计算π，每 report_every 秒报告一次迭代速度，返回汇总
+
+    digits 为空时先校准，使每次迭代约消耗 cpu_seconds 秒CPU；内存占用由位数决定，不会随时间增长。
+    duration / iterations 为0表示不限制，running 为返回False时停止的回调。
+    """
+    if digits:
+        print(f"{label}: 固定计算π到{digits}位", flush=True)
+    else:
+        digits, used = calibrate(cpu_seconds, max_digits)
+        print(f"{label}: 校准完成，每次计算π到{digits}位 (约 {used:.3f} CPU秒/次, 目标 {cpu_seconds} 秒)",
+              flush=True)
+
+    start = time.monotonic()
+    cpu_start = time.process_time()
+    deadline = start + duration if duration > 0 else None
+    count = 0
+    value = None
+    window_start, window_cpu, window_count = start, cpu_start, 0
+    while running is None or running():
+        value = calculate_pi(digits)
+        count += 1
+        now = time.monotonic()
+        if now - window_start >= report_every:
+            done = count - window_count
+            cpu = time.process_time()
+            print(f"{label}: {done / (now - window_start):.3f} 次/秒, {(cpu - window_cpu) / done:.3f} CPU秒/次, "
+                  f"累计 {count} 次", flush=True)
+            window_start, window_cpu, window_count = now, cpu, count
+        if (deadline and now >= deadline) or (iterations and count >= iterations):
+            break
+
+    elapsed = time.monotonic() - start
+    summary = {
+        "digits": digits,
+        "iterations": count,
+        "elapsed_s": elapsed,
+        "iterations_per_s": count / elapsed if elapsed > 0 else 0,
+        "cpu_s_per_iteration": (time.process_time() - cpu_start) / count if count else 0,
+    }
+    if value is not None:
+        print(f"{label}: π前50位: {pi_prefix(value, digits)}...", flush=True)
+    print(f"{label}: 共 {count} 次, {summary['iterations_per_s']:.3f} 次/秒, "
+          f"{summary['cpu_s_per_iteration']:.3f} CPU秒/次", flush=True)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Burn CPU by repeatedly computing pi (Chudnovsky, binary splitting)')
+    parser.add_argument('--digits', type=int, default=None,
+                      help='Compute this many digits per iteration instead of calibrating')
+    parser.add_argument('--cpu-seconds', type=float, default=1.0,
+                      help='Calibrate digits so one iteration takes about this many CPU seconds (default: 1.0)')
+    parser.add_argument('--max-digits', type=int, default=MAX_DIGITS,
+                      help=f'Upper bound for calibrated digits, bounds memory use (default: {MAX_DIGITS})')
+    parser.add_argument('--duration', type=float, default=0,
+                      help='Stop after this many seconds (default: run forever)')
+    parser.add_argument('--iterations', type=int, default=0,
+                      help='Stop after this many iterations (default: run forever)')
+    parser.add_argument('--report-every', type=float, default=10.0,
+                      help='Seconds between iterations/s reports (default: 10)')
+    args = parser.parse_args()
+
+    print("开始持续计算π值...", flush=True)
+    try:
+        burn(args.digits, args.cpu_seconds, args.max_digits, args.duration, args.iterations, args.report_every)
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from arrival import ArrivalScheduler, parse_profile
+from create_1_300 import create_sandbox, REQUEST_TIMEOUT, SANDBOX_IDS_FILE
+from e2b_client import AsyncE2BClient, ENDPOINT_TIMEOUTS, SUCCESS_CODES
+from histogram import ms_histogram, save_histograms
+import cleanup
+import op_trace
+import request_policy
+from results_store import ResultWriter
+
+# 加载环境变量
+load_dotenv()
+
+# 单个sandbox的生命周期流水线: create -> 停留 -> pause -> 停留 -> resume
+#
+# 每个sandbox完成上一步后立即进入下一步，不再等整批完成；各阶段有独立的并发上限，
+# 阶段之间用有界队列连接，下游跟不上时上游自动阻塞(背压)。
+# 原来三个脚本的CSV输出作为可选sink保留，格式与 create_1_300.py / pause_100.py / resume.py 兼容。
+
+TIMEOUT = int(os.getenv("E2B_TIMEOUT", 300))
+STAGES = ['create', 'pause', 'resume']
+
+_DONE = object()
+
+
+class CsvSinks:
+    """流式写出与原批处理脚本相同格式的结果文件"""
+
+    def __init__(self):
+        self.create = ResultWriter("create_results.csv", ["index", "sandbox_id", "combined_id", "create_time_ms", "error", "success"])
+        self.pause = ResultWriter("pause_results.csv", ["combined_id", "sandbox_id", "pause_time_ms"])
+        self.resume = ResultWriter("resume_results.csv", ["combined_id", "sandbox_id", "resume_time_ms"])
+        self.ids = open(SANDBOX_IDS_FILE, "w")
+
+    def write(self, stage, item, duration_ms):
+        ok = item.get("error") is None
+        if stage == "create":
+            self.create.write({"index": item["index"], "sandbox_id": item.get("sandbox_id"),
+                               "combined_id": item.get("combined_id"), "create_time_ms": duration_ms,
+                               "error": item.get("error"), "success": ok})
+            if ok:
+                self.ids.write(f"{item['combined_id']}\n")
+                self.ids.flush()
+        else:
+            writer = self.pause if stage == "pause" else self.resume
+            writer.write({"combined_id": item["combined_id"], "sandbox_id": item["sandbox_id"],
+                          f"{stage}_time_ms": duration_ms if ok else -1})
+
+    def close(self):
+        for writer in (self.create, self.pause, self.resume):
+            writer.close()
+        self.ids.close()
+        print("结果已保存到 create_results.csv / pause_results.csv / resume_results.csv")
+
+
+class Pipeline:
+    def __init__(self, client, num, concurrency, dwell, queue_size=100, max_dwelling=1000, scheduler=None,
+                 sinks=None, pbar=None):
+        self.client = client
+        self.num = num
+        self.concurrency = concurrency
+        self.dwell = dwell
+        self.queue_size = queue_size
+        self.max_dwelling = max_dwelling
+        self.scheduler = scheduler
+        self.sinks = sinks
+        self.pbar = pbar
+
+        self.latency = {stage: ms_histogram() for stage in STAGES}
+        # 进入阶段队列到被worker取出的等待时间，反映该阶段是否是瓶颈
+        self.queue_wait = {stage: ms_histogram() for stage in STAGES}
+        self.end_to_end = ms_histogram()
+        self.errors = {stage: [] for stage in STAGES}
+        self.inflight = {stage: 0 for stage in STAGES}
+        self.completed = 0
+
+    async def _create(self, item):
+        sandbox_id, combined_id, error = await create_sandbox(self.client, item["index"])
+        item.update(sandbox_id=sandbox_id, combined_id=combined_id)
+        return error
+
+    async def _pause(self, item):
+        status, text, _, _ = await self.client.pause_sandbox(item["combined_id"])
+        if status not in SUCCESS_CODES:
+            return f"暂停失败，状态码: {status}, 错误: {text[:100]}..."
+
+    async def _resume(self, item):
+        status, text, _, _ = await self.client.resume_sandbox(item["combined_id"], TIMEOUT)
+        if status not in SUCCESS_CODES:
+            return f"恢复失败，状态码: {status}, 错误: {text[:100]}..."
+
+    async def _worker(self, stage, inbox, outbox, action):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # 把结束标记留给同阶段的其他worker
+                await inbox.put(_DONE)
+                return
+            self.queue_wait[stage].record((time.monotonic() - item["ready_at"]) * 1000)
+
+            self.inflight[stage] += 1
+            start = time.monotonic()
+            try:
+                error = await action(item)
+            except asyncio.TimeoutError:
+                error = "请求超时"
+            except aiohttp.ClientError as e:
+                error = f"请求异常: {str(e)}"
+            except Exception as e:
+                error = str(e)
+            duration_ms = (time.monotonic() - start) * 1000
+            self.inflight[stage] -= 1
+
+            item["error"] = error
+            if self.sinks:
+                self.sinks.write(stage, item, duration_ms)
+            if error:
+                self.errors[stage].append((item.get("combined_id") or item["index"], error))
+                self._finish(item)
+                continue
+            self.latency[stage].record(duration_ms)
+
+            if outbox is None:
+                self.end_to_end.record((time.monotonic() - item["created_at"]) * 1000)
+                self._finish(item)
+            else:
+                # 在下一阶段之前停留dwell秒，由gate负责放行
+                item["ready_at"] = time.monotonic() + self.dwell[stage]
+                await outbox.put(item)
+
+    async def _gate(self, inbox, outbox):
+        """按ready_at放行；停留时间相同，所以队首总是最先到期的"""
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                await outbox.put(_DONE)
+                return
+            delay = item["ready_at"] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await outbox.put(item)
+
+    async def _source(self, outbox):
+        for index in range(self.num):
+            if self.scheduler:
+                if await self.scheduler.wait_async() is None:
+                    break
+            now = time.monotonic()
+            await outbox.put({"index": index, "created_at": now, "ready_at": now})
+        await outbox.put(_DONE)
+
+    def _finish(self, item):
+        self.completed += 1
+        if self.pbar:
+            self.pbar.update(1)
+            self.pbar.set_postfix({stage: self.inflight[stage] for stage in STAGES})
+
+    async def run(self):
+        # 队列: source -> create -> dwell -> pause -> dwell -> resume
+        create_q = asyncio.Queue(self.queue_size)
+        # 停留中的sandbox数量也有上限，下游积压时背压一直传到create
+        dwell_running = asyncio.Queue(self.max_dwelling)
+        pause_q = asyncio.Queue(self.queue_size)
+        dwell_paused = asyncio.Queue(self.max_dwelling)
+        resume_q = asyncio.Queue(self.queue_size)
+
+        if self.scheduler:
+            self.scheduler.begin()
+        stage_done = [
+            self._spawn("create", create_q, dwell_running, self._create),
+            self._spawn("pause", pause_q, dwell_paused, self._pause),
+            self._spawn("resume", resume_q, None, self._resume),
+        ]
+        gates = [
+            asyncio.ensure_future(self._gate(dwell_running, pause_q)),
+            asyncio.ensure_future(self._gate(dwell_paused, resume_q)),
+        ]
+
+        await self._source(create_q)
+        # 上游所有worker退出后才通知下游结束
+        await stage_done[0]
+        await dwell_running.put(_DONE)
+        await gates[0]
+        await stage_done[1]
+        await dwell_paused.put(_DONE)
+        await gates[1]
+        await stage_done[2]
+
+    def _spawn(self, stage, inbox, outbox, action):
+        workers = [asyncio.ensure_future(self._worker(stage, inbox, outbox, action))
+                   for _ in range(self.concurrency[stage])]
+        return asyncio.gather(*workers)
+
+
+async def run_pipeline_async(args, pbar, sinks):
+    scheduler = ArrivalScheduler(args.profile) if args.profile else None
+    pool_size = sum([args.create_concurrency, args.pause_concurrency, args.resume_concurrency])
+    policies = request_policy.from_args(args, dict(ENDPOINT_TIMEOUTS, create=REQUEST_TIMEOUT))
+    async with AsyncE2BClient(pool_size=pool_size, timeouts={"create": REQUEST_TIMEOUT},
+                              split_latency=args.split_connection_latency, policies=policies) as client:
+        pipeline = Pipeline(
+            client,
+            num=args.num,
+            concurrency={
+                "create": args.create_concurrency,
+                "pause": args.pause_concurrency,
+                "resume": args.resume_concurrency,
+            },
+            dwell={"create": args.dwell_running, "pause": args.dwell_paused},
+            queue_size=args.queue_size,
+            max_dwelling=args.max_dwelling,
+            scheduler=scheduler,
+            sinks=sinks,
+            pbar=pbar
+        )
+        await pipeline.run()
+    client.print_connection_stats()
+    client.print_policy_stats()
+    if scheduler:
+        scheduler.print_lag()
+    return pipeline
+
+
+def print_report(pipeline, duration):
+    print(f"\n总耗时: {duration:.2f} 秒, 完成 {pipeline.end_to_end.count}/{pipeline.num} 个sandbox的完整生命周期")
+    for stage in STAGES:
+        hist = pipeline.latency[stage]
+        errors = len(pipeline.errors[stage])
+        total = hist.count + errors
+        if not total:
+            continue
+        stats = hist.summary()
+        wait_p99 = pipeline.queue_wait[stage].percentile(99)
+        print(f"{stage}: 成功 {hist.count}/{total}, 速率 {hist.count / duration:.2f}/秒, "
+              f"平均 {stats['avg']:.2f}ms, P50 {stats['median']:.2f}ms, P90 {stats['p90']:.2f}ms, "
+              f"P99 {stats['p99']:.2f}ms, 排队P99 {wait_p99:.2f}ms")
+    if pipeline.end_to_end.count:
+        stats = pipeline.end_to_end.summary()
+        print(f"端到端 (含停留): 平均 {stats['avg']:.2f}ms, P50 {stats['median']:.2f}ms, P99 {stats['p99']:.2f}ms")
+
+    histograms = dict(pipeline.latency)
+    histograms.update({f"{stage}_queue_wait": hist for stage, hist in pipeline.queue_wait.items()})
+    histograms["end_to_end"] = pipeline.end_to_end
+    histograms.update(pipeline.client.policy_histograms())
+    save_histograms("pipeline_results_hist.csv", histograms, append=False)
+
+    errors = [(stage, key, error) for stage in STAGES for key, error in pipeline.errors[stage]]
+    if errors:
+        with open("pipeline_errors.txt", "w") as f:
+            for stage, key, error in errors:
+                f.write(f"{stage} {key}: {error}\n")
+        print(f"错误信息已保存到 pipeline_errors.txt ({len(errors)} 个错误)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pipelined create -> pause -> resume benchmark')
+    parser.add_argument('--num', type=int, default=300,
+                      help='Number of sandboxes to push through the pipeline (default: 300)')
+    parser.add_argument('--profile', type=parse_profile, default=None,
+                      help='Arrival profile for creates (default: as fast as create concurrency allows): '
+                           'constant:RATE | ramp:START:END:SECONDS | step:RATExSECONDS,... | poisson:RATE[:BURST]')
+    parser.add_argument('--create-concurrency', type=int, default=50,
+                      help='Max concurrent create requests (default: 50)')
+    parser.add_argument('--pause-concurrency', type=int, default=50,
+                      help='Max concurrent pause requests (default: 50)')
+    parser.add_argument('--resume-concurrency', type=int, default=50,
+                      help='Max concurrent resume requests (default: 50)')
+    parser.add_argument('--dwell-running', type=float, default=5.0,
+                      help='Seconds a sandbox stays running before it is paused (default: 5)')
+    parser.add_argument('--dwell-paused', type=float, default=5.0,
+                      help='Seconds a sandbox stays paused before it is resumed (default: 5)')
+    parser.add_argument('--queue-size', type=int, default=100,
+                      help='Capacity of each stage queue; a full queue blocks the upstream stage (default: 100)')
+    parser.add_argument('--max-dwelling', type=int, default=1000,
+                      help='Max sandboxes waiting out a dwell between two stages (default: 1000)')
+    parser.add_argument('--csv', action='store_true',
+                      help='Also write create_results.csv, pause_results.csv, resume_results.csv and sandbox_ids.txt')
+    parser.add_argument('--split-connection-latency', action='store_true',
+                      help='Report latencies on reused vs newly opened connections separately')
+    request_policy.add_arguments(parser)
+    op_trace.add_arguments(parser)
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+    op_trace.from_args(args)
+
+    print(f"流水线: {args.num} 个sandbox, 并发 create={args.create_concurrency} pause={args.pause_concurrency} "
+          f"resume={args.resume_concurrency}, 停留 running={args.dwell_running}s paused={args.dwell_paused}s")
+
+    sinks = CsvSinks() if args.csv else None
+    start = time.monotonic()
+    try:
+        with cleanup.from_args(args), tqdm(total=args.num, desc="sandbox生命周期") as pbar:
+            pipeline = asyncio.run(run_pipeline_async(args, pbar, sinks))
+    finally:
+        if sinks:
+            sinks.close()
+    print_report(pipeline, time.monotonic() - start)
@@ -1,151 +1,165 @@
 from e2b_code_interpreter import Sandbox
+import argparse
+import json
 import time
 import concurrent.futures
 import os
+from tqdm import tqdm
 from dotenv import load_dotenv
+from e2b_client import TEMPLATE_ID, sdk_options
+import cleanup
+import tracing
+import concurrency_limiter
+from workload import KINDS, describe, launch_command, load_manifest, parse_summary
 
 # 加载环境变量
 load_dotenv()
 
-# 无限π计算脚本 - 会持续计算直到被终止
-pi_script = """
-import math
-from decimal import Decimal, getcontext
-import time
-import sys
-
-# 接收进程ID作为命令行参数
-process_id = int(sys.argv[1])
-
-# 使用Chudnovsky算法计算π
-def calculate_pi(digits):
-    getcontext().prec = digits + 10
-
-    C = 426880 * Decimal(10005).sqrt()
-    M = Decimal(1)
-    L = Decimal(13591409)
-    X = Decimal(1)
-    K = Decimal(6)
-    S = L
-
-    for i in range(1, digits // 14 + 10):
-        M = M * (K**3 - 16*K) // (i**3)
-        L += 545140134
-        X *= -262537412640768000
-        S += (M * L) / X
-        K += 12
-
-    pi = C / S
-    return str(pi)[:digits+1]
-
-# 持续计算π，不断增加位数
-start_digits = 1000
-max_digits = 1000000000  # 设置一个非常大的上限，实际上不会达到
-current_digits = start_digits
-
-print(f"进程 #{process_id} 开始持续计算π值...")
-while current_digits <= max_digits:
-    start_time = time.time()
-    print(f"\\n进程 #{process_id} 计算π到{current_digits}位...")
-    
-    try:
-        pi_value = calculate_pi(current_digits)
-        end_time = time.time()
-        
-        print(f"进程 #{process_id} π计算结果 (前50位): {pi_value[:50]}...")
-        print(f"进程 #{process_id} 总计算位数: {len(pi_value)-1}")
-        print(f"进程 #{process_id} 计算耗时: {end_time - start_time:.2f} 秒")
-        
-        # 每次计算完后增加位数
-        current_digits = int(current_digits * 1.5)  # 每次增加50%的位数
-        
-    except Exception as e:
-        print(f"进程 #{process_id} 计算出错: {str(e)}")
-        break
-"""
-num_boxes = 31
-# 创建和配置单个Sandbox的函数
-def create_and_run_sandbox(index):
-    try:
-        print(f"\n=== 创建 Sandbox #{index} ===")
-
-        # 创建新的sandbox实例
-        sbx = Sandbox(
-            api_key=os.getenv("E2B_API_KEY"),
-            template=os.getenv("E2B_TEMPLATE_ID"),
-            domain=os.getenv("E2B_DOMAIN"),
-            timeout=int(os.getenv("E2B_TIMEOUT", 3600)),
-            metadata={"purpose": "performance-test-gj"}
-        )
-
-        sandbox_id = sbx.sandbox_id
-        print(f"Sandbox #{index} ID: {sandbox_id}")
-
-        # 创建计算π的Python脚本
-        sbx.commands.run(f'cat > calculate_pi.py << \'EOF\'\n{pi_script}\nEOF')
-
-        # 在同一个sandbox中启动4个计算进程
-        print(f"在Sandbox #{index}中启动4个π计算进程...")
-        for i in range(1, 5):
-            sbx.commands.run(f"nice -n {i*5} nohup python3 calculate_pi.py {i} > pi_output_{i}.log 2>&1 &")
-            print(f"Sandbox #{index} - 进程 #{i} 已启动")
-
-        # 确认进程已启动
-        result = sbx.commands.run("ps aux | grep python")
-        python_processes = result.stdout.count("calculate_pi.py")
+# 设置 E2B_TRACE=press_trace.json 时记录各阶段span并导出Chrome trace
+if os.getenv("E2B_TRACE"):
+    tracing.enable(os.getenv("E2B_TRACE"))
 
-        if python_processes >= 4:
-            print(f"Sandbox #{index} (ID: {sandbox_id}) 所有4个计算进程已成功启动")
-
-            # 显示CPU负载情况
-            cpu_info = sbx.commands.run("top -bn1 | head -n 5").stdout
-            print(f"Sandbox #{index} CPU负载情况:\n{cpu_info}")
-
-            return True, index, sandbox_id
-        else:
-            print(f"Sandbox #{index} (ID: {sandbox_id}) 只有{python_processes}个计算进程启动成功")
-            return False, index, sandbox_id
+# 创建sandbox并启动负载的函数: 一次commands.run完成写入脚本、启动全部进程和健康检查
+def create_and_run_sandbox(index, manifest, command):
+    try:
+        with tracing.span("press.sandbox", index=index) as sp:
+            # 创建新的sandbox实例
+            with tracing.span("press.create"):
+                sbx = Sandbox(
+                    template=TEMPLATE_ID,
+                    timeout=int(os.getenv("E2B_TIMEOUT", 3600)),
+                    metadata=cleanup.run_metadata(),
+                    **sdk_options()
+                )
+
+            sandbox_id = sbx.sandbox_id
+            sp.set(sandbox_id=sandbox_id)
+
+            with tracing.span("press.launch"):
+                result = sbx.commands.run(command, timeout=60 + float(manifest.get("settle", 1.0)))
+            summary = parse_summary(result.stdout)
+
+            if summary is None:
+                print(f"Sandbox #{index} (ID: {sandbox_id}) 没有返回健康摘要: {(result.stderr or result.stdout)[-200:]}")
+                return False, index, sandbox_id, None
+            if summary["ok"]:
+                print(f"Sandbox #{index} (ID: {sandbox_id}) 负载已启动: 进程 {summary['running']}, "
+                      f"load {summary['loadavg'][0]:.2f}, 可用内存 {summary['mem_available_mb']}MB")
+            else:
+                print(f"Sandbox #{index} (ID: {sandbox_id}) 只有部分负载进程在运行: {summary['running']} / {summary['expected']}")
+            return summary["ok"], index, sandbox_id, summary
 
     except Exception as e:
         print(f"Sandbox #{index} 创建或配置出错: {str(e)}")
-        return False, index, "创建失败"
-
-# 主程序
-print("开始并行创建{}个Sandbox，每个Sandbox运行4个计算进程",num_boxes)
-
-# 使用线程池并行创建Sandbox
-successful_sandboxes = []
-failed_sandboxes = []
-# 设置较小的线程池大小以避免API限制
-with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-    # 提交所有任务
-    future_to_index = {executor.submit(create_and_run_sandbox, i): i for i in range(1, num_boxes)}
-
-    # 处理结果
-    for future in concurrent.futures.as_completed(future_to_index):
-        success, index, sandbox_id = future.result()
-        if success:
-            successful_sandboxes.append((index, sandbox_id))
+        return False, index, "创建失败", None
+
+def summarize(results, manifest, elapsed):
+    """汇总各sandbox的健康摘要"""
+    summaries = [summary for _, _, _, summary in results if summary]
+    expected = {kind: 0 for kind in KINDS}
+    running = {kind: 0 for kind in KINDS}
+    for summary in summaries:
+        for kind in KINDS:
+            expected[kind] += summary["expected"].get(kind, 0)
+            running[kind] += summary["running"].get(kind, 0)
+    loads = sorted(summary["loadavg"][0] for summary in summaries)
+    return {
+        "manifest": manifest,
+        "boxes": len(results),
+        "healthy": sum(1 for success, _, _, _ in results if success),
+        "unhealthy": sum(1 for success, _, _, _ in results if not success),
+        "elapsed_s": elapsed,
+        "expected_procs": expected,
+        "running_procs": running,
+        "loadavg_median": loads[len(loads) // 2] if loads else None,
+        "loadavg_max": loads[-1] if loads else None,
+        "sandboxes": [
+            {"index": index, "sandbox_id": sandbox_id, "ok": success, "summary": summary}
+            for success, index, sandbox_id, summary in sorted(results, key=lambda r: r[1])
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Start pressure sandboxes running a CPU/memory/disk workload')
+    parser.add_argument('--boxes', type=int, default=30,
+                      help='Number of pressure sandboxes to create (default: 30)')
+    parser.add_argument('--workers', type=int, default=5,
+                      help='Sandboxes created in parallel (default: 5)')
+    parser.add_argument('--manifest', default=None,
+                      help='JSON workload manifest; missing fields use the defaults (4 pi processes)')
+    parser.add_argument('--cpu', type=int, default=None, help='Override number of CPU (pi) processes')
+    parser.add_argument('--memory', type=int, default=None, help='Override number of memory-bandwidth processes')
+    parser.add_argument('--disk', type=int, default=None, help='Override number of disk-IO processes')
+    parser.add_argument('--duration', type=float, default=None,
+                      help='Stop the workload after this many seconds (default: run until the sandbox dies)')
+    parser.add_argument('--summary', default="press_summary.json",
+                      help='Where to write the JSON health summary (default: press_summary.json)')
+    # 创建+启动负载通常需要数秒，SLO默认放宽到30秒
+    concurrency_limiter.add_arguments(parser, slo_p99_ms=30000)
+    args = parser.parse_args()
+    limiter = concurrency_limiter.from_args(args, "press")
+
+    manifest = load_manifest(args.manifest, {"cpu.procs": args.cpu, "memory.procs": args.memory,
+                                             "disk.procs": args.disk, "duration": args.duration})
+    command = launch_command(manifest)
+
+    # 主程序
+    parallel = f"自适应, 初始 {limiter.limit}" if limiter else args.workers
+    print(f"开始并行创建{args.boxes}个Sandbox (并行 {parallel})，负载: {describe(manifest)}")
+
+    def run_limited(index):
+        """开启 --adaptive 时按限制器放行，并把耗时和是否健康反馈给它"""
+        limiter.acquire()
+        started = time.monotonic()
+        result = (False, index, "创建失败", None)
+        try:
+            result = create_and_run_sandbox(index, manifest, command)
+        finally:
+            limiter.release(time.monotonic() - started, result[0])
+        return result
+
+    # 使用线程池并行创建Sandbox
+    start_time = time.time()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=limiter.max_limit if limiter else args.workers) as executor:
+        # 提交所有任务
+        if limiter:
+            futures = [executor.submit(run_limited, i) for i in range(1, args.boxes + 1)]
         else:
-            failed_sandboxes.append((index, sandbox_id))
-
-# 打印统计信息
-print("\n========== 创建结果统计 ==========")
-print(f"成功创建的Sandbox数量: {len(successful_sandboxes)}")
-print(f"失败的Sandbox数量: {len(failed_sandboxes)}")
-
-print("\n成功创建的Sandbox列表:")
-for index, sandbox_id in successful_sandboxes:
-    print(f"Sandbox #{index}: {sandbox_id}")
-
-if failed_sandboxes:
-    print("\n创建失败的Sandbox列表:")
-    for index, sandbox_id in failed_sandboxes:
-        print(f"Sandbox #{index}: {sandbox_id}")
-
-# 计算总进程数
-total_processes = len(successful_sandboxes) * 4
-print(f"\n成功创建的总计算进程数: {total_processes}")
-
-print("\n所有Sandbox持续计算已启动!")
-print("注意: 每个Sandbox中运行4个进程，计算将在后台继续，每个进程的输出保存在各自的日志文件中")
\ No newline at end of file
+            futures = [executor.submit(create_and_run_sandbox, i, manifest, command) for i in range(1, args.boxes + 1)]
+
+        # 处理结果
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="启动压力sandbox"):
+            results.append(future.result())
+    elapsed = time.time() - start_time
+
+    report = summarize(results, manifest, elapsed)
+    with open(args.summary, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    # 打印统计信息
+    print("\n========== 创建结果统计 ==========")
+    print(f"总耗时: {elapsed:.1f} 秒")
+    print(f"负载健康的Sandbox数量: {report['healthy']}")
+    print(f"失败或不健康的Sandbox数量: {report['unhealthy']}")
+    print(f"负载进程 (运行/预期): " + ", ".join(
+        f"{kind} {report['running_procs'][kind]}/{report['expected_procs'][kind]}" for kind in KINDS))
+    if report["loadavg_median"] is not None:
+        print(f"1分钟load: 中位数 {report['loadavg_median']:.2f}, 最大 {report['loadavg_max']:.2f}")
+
+    failed = [(index, sandbox_id) for success, index, sandbox_id, _ in sorted(results, key=lambda r: r[1]) if not success]
+    if failed:
+        print("\n失败或不健康的Sandbox列表:")
+        for index, sandbox_id in failed:
+            print(f"Sandbox #{index}: {sandbox_id}")
+
+    if limiter:
+        limiter.print_summary()
+        limiter.close()
+
+    print(f"\n健康摘要已保存到 {args.summary}")
+    print("注意: 负载会在后台继续运行，每个进程的输出保存在 {}/<类型>_<序号>.log 中".format(manifest["workdir"]))
+
+    tracing.print_phases()
+    tracing.export()
@@ -0,0 +1,396 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import aiohttp
+import requests
+
+from histogram import LatencyHistogram
+
+SUCCESS_CODES = (200, 201, 202, 204)
+# 幂等请求遇到这些状态码时重试
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 非幂等请求(create)只在服务端肯定没有处理请求时重试，避免重复创建
+SAFE_RETRY_STATUS = (429, 503)
+
+OK, RETRY, FAIL = "ok", "retry", "fail"
+
+
+class RetryBudget:
+    """重试预算(令牌桶): 每个首次请求存入 ratio 个令牌，每次重试取走一个
+
+    稳态下重试数不超过请求数的 ratio 倍，服务端整体故障时重试不会把负载放大数倍；
+    桶满时最多可连续重试 capacity 次。
+    """
+
+    def __init__(self, ratio=0.1, capacity=10):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+
+def _parse_hedge(value):
+    """hedge 为毫秒数(数字或字符串)，或 "p95"/"P95" 这样的首次请求耗时分位数；返回 (等待秒数, 分位数)"""
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        value = value.strip()
+        if value[:1] in ("p", "P"):
+            return None, float(value[1:])
+    return float(value) / 1000, None
+
+
+class RequestPolicy:
+    """单个操作的请求策略: 超时、带抖动的指数退避重试、重试预算、幂等读请求的对冲(hedge)
+
+    timeout 为 (连接超时, 读超时) 秒；最多发送 max_attempts 次，第n次重试前等待
+    uniform(0, min(max_delay, base_delay * 2^(n-1))) 秒(full jitter)，总耗时不超过 deadline 秒。
+    idempotent=False 时只在连接失败和 SAFE_RETRY_STATUS 时重试。
+    hedge 为毫秒数或 "p95"(首次请求耗时的P95)，请求超过该时间仍未返回时再发一个相同的请求，取先返回的结果，
+    只能用于幂等的读请求。conflict_ok=True 时重试得到的409视为成功(上一次请求超时但实际已经生效)。
+
+    首次请求耗时、端到端耗时(含退避和重试)、发送次数分别统计，用于量化重试和对冲挽回了多少尾延迟。
+    """
+
+    def __init__(self, op, timeout=(3.05, 60), max_attempts=3, base_delay=0.2, max_delay=5.0, deadline=None,
+                 idempotent=True, budget=None, hedge=None, conflict_ok=False, hedge_workers=32):
+        self.op = op
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.idempotent = idempotent
+        self.budget = budget or RetryBudget()
+        self.hedge_delay, self.hedge_percentile = _parse_hedge(hedge)
+        self.conflict_ok = conflict_ok
+        self.hedge_workers = hedge_workers
+        self._executor = None
+        self._background = set()
+
+        self.lock = threading.Lock()
+        self.first_attempt = LatencyHistogram(resolution=1e-6)
+        self.end_to_end = LatencyHistogram(resolution=1e-6)
+        self.attempts = Counter()
+        self.calls = 0
+        self.first_ok = 0
+        self.final_ok = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def hedging(self):
+        return self.hedge_delay is not None or self.hedge_percentile is not None
+
+    def _hedge_after(self):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self.lock:
+            # 样本太少时分位数不可靠，先不对冲
+            if self.first_attempt.count < 20:
+                return None
+            return self.first_attempt.percentile(self.hedge_percentile)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _next_delay(self, attempt, start):
+        """允许第 attempt+1 次发送时返回退避秒数，否则返回None"""
+        if attempt >= self.max_attempts:
+            return None
+        delay = self._backoff(attempt)
+        if self.deadline is not None and time.monotonic() - start + delay >= self.deadline:
+            return None
+        if not self.budget.withdraw():
+            return None
+        return delay
+
+    def _classify_status(self, status, attempt):
+        if status in SUCCESS_CODES or (self.conflict_ok and attempt > 1 and status == 409):
+            return OK
+        return RETRY if status in (RETRY_STATUS if self.idempotent else SAFE_RETRY_STATUS) else FAIL
+
+    def classify(self, result, error, attempt):
+        """同步请求: result 为 requests.Response"""
+        if error is None:
+            return self._classify_status(result.status_code, attempt)
+        if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError)) \
+                and (self.idempotent or isinstance(error, requests.exceptions.ConnectTimeout)):
+            return RETRY
+        if isinstance(error, requests.exceptions.Timeout) and self.idempotent:
+            return RETRY
+        return FAIL
+
+    def classify_async(self, result, error, attempt):
+        """异步请求: result 为 (状态码, 响应文本, ...)"""
+        if error is None:
+            return self._classify_status(result[0], attempt)
+        if isinstance(error, aiohttp.ClientConnectorError):
+            return RETRY
+        if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError)) and self.idempotent:
+            return RETRY
+        return FAIL
+
+    def _record_first(self, elapsed, outcome):
+        with self.lock:
+            self.first_attempt.record(elapsed)
+            if outcome == OK:
+                self.first_ok += 1
+
+    def _record_call(self, elapsed, attempts, outcome, hedged, hedge_won):
+        with self.lock:
+            self.calls += 1
+            self.end_to_end.record(elapsed)
+            self.attempts[attempts] += 1
+            self.retries += attempts - 1
+            if outcome == OK:
+                self.final_ok += 1
+            if hedged:
+                self.hedged += 1
+            if hedge_won:
+                self.hedge_wins += 1
+
+    # ---- 同步 ----
+    def _attempt(self, send, attempt, first):
+        start = time.monotonic()
+        try:
+            result, error = send(self.timeout), None
+        except Exception as e:
+            result, error = None, e
+        outcome = self.classify(result, error, attempt)
+        if first:
+            self._record_first(time.monotonic() - start, outcome)
+        return result, error, outcome
+
+    def _hedged_attempt(self, send, attempt, first):
+        """发送一次请求，超过对冲时间仍未返回时再发一个，返回先得到结果的那个"""
+        hedge_after = self._hedge_after()
+        if hedge_after is None:
+            return self._attempt(send, attempt, first) + (False, False)
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.hedge_workers)
+        # 被对冲的首次请求仍然跑完，它自己的耗时计入首次请求统计
+        futures = [self._executor.submit(self._attempt, send, attempt, first)]
+        done, _ = wait(futures, timeout=hedge_after)
+        if done:
+            return futures[0].result() + (False, False)
+        futures.append(self._executor.submit(self._attempt, send, attempt, False))
+        pending = set(futures)
+        fallback = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # 同时返回时优先取成功的结果
+            for future in sorted(done, key=lambda f: f.result()[2] != OK):
+                item = future.result()
+                if item[2] == OK or not pending:
+                    return item + (True, future is futures[1])
+                fallback = fallback or item
+        return fallback + (True, False)
+
+    def call(self, send):
+        """执行 send(timeout)，按策略重试/对冲，返回 (结果, 异常, 发送次数)"""
+        self.budget.deposit()
+        start = time.monotonic()
+        attempt = 1
+        hedged = hedge_won = False
+        while True:
+            if self.hedging:
+                result, error, outcome, h, won = self._hedged_attempt(send, attempt, attempt == 1)
+                hedged, hedge_won = hedged or h, hedge_won or won
+            else:
+                result, error, outcome = self._attempt(send, attempt, attempt == 1)
+            delay = self._next_delay(attempt, start) if outcome == RETRY else None
+            if delay is None:
+                break
+            time.sleep(delay)
+            attempt += 1
+        self._record_call(time.monotonic() - start, attempt, outcome, hedged, hedge_won)
+        return result, error, attempt
+
+    # ---- asyncio ----
+    async def _attempt_async(self, send, attempt, first):
+        start = time.monotonic()
+        try:
+            result, error = await send(self.timeout), None
+        except Exception as e:
+            result, error = None, e
+        outcome = self.classify_async(result, error, attempt)
+        if first:
+            self._record_first(time.monotonic() - start, outcome)
+        return result, error, outcome
+
+    async def _hedged_attempt_async(self, send, attempt, first):
+        hedge_after = self._hedge_after()
+        primary = asyncio.ensure_future(self._attempt_async(send, attempt, first))
+        if hedge_after is None:
+            return await primary + (False, False)
+        done, _ = await asyncio.wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result() + (False, False)
+        hedge = asyncio.ensure_future(self._attempt_async(send, attempt, False))
+        pending = {primary, hedge}
+        fallback = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: t.result()[2] != OK):
+                item = task.result()
+                if item[2] == OK or not pending:
+                    # 落后的请求在后台跑完，只用于首次请求统计
+                    for other in pending:
+                        self._background.add(other)
+                        other.add_done_callback(self._background.discard)
+                    return item + (True, task is hedge)
+                fallback = fallback or item
+        return fallback + (True, False)
+
+    async def call_async(self, send):
+        """call 的asyncio版本，send(timeout) 为协程函数"""
+        self.budget.deposit()
+        start = time.monotonic()
+        attempt = 1
+        hedged = hedge_won = False
+        while True:
+            if self.hedging:
+                result, error, outcome, h, won = await self._hedged_attempt_async(send, attempt, attempt == 1)
+                hedged, hedge_won = hedged or h, hedge_won or won
+            else:
+                result, error, outcome = await self._attempt_async(send, attempt, attempt == 1)
+            delay = self._next_delay(attempt, start) if outcome == RETRY else None
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            attempt += 1
+        self._record_call(time.monotonic() - start, attempt, outcome, hedged, hedge_won)
+        return result, error, attempt
+
+    async def drain(self):
+        """等待后台还没跑完的被对冲请求"""
+        if self._background:
+            await asyncio.gather(*list(self._background), return_exceptions=True)
+
+    def histograms(self):
+        """{op:first_attempt / op:end_to_end: 直方图}，可直接传给 save_histograms"""
+        with self.lock:
+            return {f"{self.op}:first_attempt": self.first_attempt, f"{self.op}:end_to_end": self.end_to_end}
+
+    def print_summary(self):
+        with self.lock:
+            if not self.calls:
+                return
+            first = self.first_attempt.percentiles(50, 90, 99)
+            final = self.end_to_end.percentiles(50, 90, 99)
+            attempts = "  ".join(f"{n}次={count}" for n, count in sorted(self.attempts.items()))
+            print(f"[{self.op}] 请求 {self.calls}, 首次成功率 {self.first_ok / self.calls * 100:.1f}%, "
+                  f"最终成功率 {self.final_ok / self.calls * 100:.1f}%, 重试 {self.retries} 次, "
+                  f"重试预算耗尽 {self.budget.exhausted} 次")
+            print(f"[{self.op}]   首次请求 P50/P90/P99: {first[0]:.4f}/{first[1]:.4f}/{first[2]:.4f}s")
+            print(f"[{self.op}]   端到端   P50/P90/P99: {final[0]:.4f}/{final[1]:.4f}/{final[2]:.4f}s")
+            print(f"[{self.op}]   发送次数: {attempts}")
+            if self.hedging:
+                print(f"[{self.op}]   对冲 {self.hedged} 次, 对冲请求先返回 {self.hedge_wins} 次")
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+
+def print_summaries(policies):
+    """打印各操作首次请求 / 端到端耗时和发送次数"""
+    for policy in policies.values():
+        policy.print_summary()
+
+
+def merged_histograms(policies):
+    histograms = {}
+    for policy in policies.values():
+        histograms.update(policy.histograms())
+    return histograms
+
+
+def build_policies(timeouts, retries=2, base_delay=0.2, max_delay=5.0, deadline=None, budget_ratio=0.1,
+                   budget_capacity=10, hedge=None):
+    """按 {op: (连接超时, 读超时)} 为每个操作创建策略，各操作共用一个重试预算
+
+    create 不是幂等的，不对冲且只在服务端没有处理请求时重试；pause/resume 重试得到的409视为成功；
+    hedge 只作用于读请求(list，即 cleanup 的分页列表)。
+    """
+    budget = RetryBudget(ratio=budget_ratio, capacity=budget_capacity)
+    policies = {}
+    for op, timeout in timeouts.items():
+        policies[op] = RequestPolicy(
+            op,
+            timeout=timeout,
+            max_attempts=retries + 1,
+            base_delay=base_delay,
+            max_delay=max_delay,
+            deadline=deadline,
+            idempotent=op != "create",
+            budget=budget,
+            hedge=hedge if op == "list" else None,
+            conflict_ok=op in ("pause", "resume"),
+        )
+    return policies
+
+
+def parse_timeouts(text):
+    """解析 --timeout 参数，如 create=5,pause=30 (读超时，秒)"""
+    timeouts = {}
+    for item in text.split(","):
+        if item.strip():
+            op, value = item.split("=", 1)
+            timeouts[op.strip()] = float(value)
+    return timeouts
+
+
+def add_arguments(parser):
+    """给脚本加上请求策略相关的命令行参数"""
+    parser.add_argument('--timeout', type=parse_timeouts, default=None, metavar='OP=SECONDS,...',
+                      help='Read timeout per operation, e.g. create=5,pause=30,resume=30')
+    parser.add_argument('--retries', type=int, default=2,
+                      help='Max retries per request with jittered exponential backoff; create is only retried '
+                           'when the server did not process it (default: 2)')
+    parser.add_argument('--retry-base-ms', type=float, default=200,
+                      help='Base backoff before the first retry in ms, doubled per retry (default: 200)')
+    parser.add_argument('--retry-budget', type=float, default=0.1,
+                      help='Retries allowed as a fraction of requests, shared by all operations (default: 0.1)')
+    parser.add_argument('--request-deadline', type=float, default=None,
+                      help='Give up retrying once a request has taken this many seconds in total')
+    parser.add_argument('--hedge', default=None, metavar='MS|pNN',
+                      help='Send a duplicate of idempotent reads (the sandbox list pages fetched by --cleanup) still '
+                           'pending after MS ms, or after the observed first-attempt percentile, e.g. p95 '
+                           '(default: disabled)')
+
+
+def from_args(args, timeouts):
+    """按命令行参数创建 {op: RequestPolicy}，timeouts 为各操作默认的 (连接超时, 读超时)"""
+    timeouts = dict(timeouts)
+    for op, read_timeout in (getattr(args, "timeout", None) or {}).items():
+        connect_timeout = timeouts.get(op, (3.05, None))[0]
+        timeouts[op] = (connect_timeout, read_timeout)
+    return build_policies(
+        timeouts,
+        retries=args.retries,
+        base_delay=args.retry_base_ms / 1000,
+        deadline=args.request_deadline,
+        budget_ratio=args.retry_budget,
+        hedge=args.hedge,
+    )
@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+# 距上次fsync超过这么多秒或这么多条记录时再fsync一次
+FSYNC_INTERVAL = 1.0
+FSYNC_EVERY = 1000
+
+
+def _is_jsonl(path):
+    return path.endswith(".jsonl")
+
+
+def recover(path):
+    """截掉崩溃时写了一半的最后一行，返回完整记录数(CSV不含表头)"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return sum(1 for _ in read_records(path))
+
+
+class ResultWriter:
+    """逐条追加写入结果文件(.csv 或 .jsonl)，每条写完即flush，并定期fsync
+
+    进程崩溃时最多丢失最后一行；append=True 时先用 recover() 修复上次中断的文件再接着写。
+    CSV 的列由 columns 指定(缺省取第一条记录的键)，多出来的键会被忽略。
+    可以被多个线程同时调用。
+    """
+
+    def __init__(self, path, columns=None, append=False, fsync_interval=FSYNC_INTERVAL, fsync_every=FSYNC_EVERY):
+        self.path = path
+        self.columns = list(columns) if columns else None
+        self.fsync_interval = fsync_interval
+        self.fsync_every = fsync_every
+        self.count = recover(path) if append else 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "a" if exists else "w", newline="")
+        self._csv = None
+        if not _is_jsonl(path):
+            if exists:
+                with open(path, newline="") as f:
+                    header = next(csv.reader(f), None)
+                if self.columns and header != self.columns:
+                    raise ValueError(f"{path} 的表头 {header} 与 {self.columns} 不一致")
+                self.columns = header
+            if self.columns:
+                self._start_csv(write_header=not exists)
+
+    def _start_csv(self, write_header):
+        self._csv = csv.writer(self._file, lineterminator="\n")
+        if write_header:
+            self._csv.writerow(self.columns)
+
+    def write(self, record):
+        with self._lock:
+            if _is_jsonl(self.path):
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            else:
+                if self._csv is None:
+                    self.columns = list(record)
+                    self._start_csv(write_header=True)
+                self._csv.writerow([record.get(column) for column in self.columns])
+            self._file.flush()
+            self.count += 1
+            self._unsynced += 1
+            now = time.monotonic()
+            if self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+                self._last_sync = now
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _complete_lines(f):
+    for line in f:
+        if not line.endswith("\n"):
+            break
+        yield line
+
+
+def read_records(path, types=None):
+    """逐条读取结果文件，返回dict的生成器；中断的最后一行会被跳过
+
+    CSV 的值都是字符串(空值为None)，types 为 {列名: 转换函数}，如 {"pause_time_ms": float}。
+    """
+    with open(path, newline="") as f:
+        if _is_jsonl(path):
+            for line in _complete_lines(f):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+        else:
+            rows = csv.reader(_complete_lines(f))
+            header = next(rows, None)
+            for row in rows:
+                if len(row) != len(header):
+                    break
+                record = {column: value if value != "" else None for column, value in zip(header, row)}
+                for column, cast in (types or {}).items():
+                    if record.get(column) is not None:
+                        record[column] = cast(record[column])
+                yield record
+
+
+def load_dataframe(path_or_records):
+    """需要DataFrame时才导入pandas，参数可以是结果文件路径或记录列表"""
+    import pandas as pd
+    if not isinstance(path_or_records, str):
+        return pd.DataFrame(list(path_or_records))
+    if _is_jsonl(path_or_records):
+        return pd.DataFrame(list(read_records(path_or_records)))
+    # CSV交给pandas推断列类型，只去掉中断的最后一行
+    with open(path_or_records, newline="") as f:
+        return pd.read_csv(io.StringIO("".join(_complete_lines(f))))
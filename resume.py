@@ -1,51 +1,45 @@
-import requests
-import json
+import argparse
 import time
-import pandas as pd
 from tqdm import tqdm
 import os
-import statistics
-import numpy as np
 from dotenv import load_dotenv
+from e2b_client import E2BClient, ENDPOINT_TIMEOUTS, split_combined_id
+from histogram import ms_histogram, save_histograms
+from arrival import ArrivalScheduler, parse_profile
+from load_engine import run_open_loop_threads
+import concurrency_limiter
+import op_trace
+import request_policy
+from results_store import ResultWriter, read_records
+from sweep import DEFAULT_LEVELS, ROUNDS_PER_LEVEL, parse_levels, report_sweep, sweep, total_needed
 
 # 加载环境变量
 load_dotenv()
 
 # 配置参数
-API_KEY = os.getenv("E2B_API_KEY")
-BASE_URL = os.getenv("E2B_BASE_URL") + "/sandboxes"
 TIMEOUT = int(os.getenv("E2B_TIMEOUT", 300))
 PAUSE_RESULTS_FILE = "pause_results.csv"  # 从暂停结果文件中读取sandbox IDs
+RESUME_RESULTS_FILE = "resume_results.csv"
+RESUME_COLUMNS = ["combined_id", "sandbox_id", "resume_time_ms"]
 
-def resume_sandbox(combined_id):
+def resume_sandbox(client, combined_id):
     """恢复指定的sandbox并返回操作时间"""
     start_time = time.time()
 
-    url = f"{BASE_URL}/{combined_id}/resume"
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "timeout": TIMEOUT
-    }
+    # 从combined_id中提取sandbox_id (格式是sandboxID-clientID)
+    sandbox_id = split_combined_id(combined_id)
 
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = client.resume_sandbox(combined_id, TIMEOUT)
         duration_ms = (time.time() - start_time) * 1000
 
-        # 从combined_id中提取sandbox_id (格式是sandboxID-clientID)
-        sandbox_id = combined_id.split('-')[0] if '-' in combined_id else combined_id
-
-        # 修改为接受更广泛的成功状态码 (200, 201, 202, 204)
-        if response.status_code in [200, 201, 202, 204]:
+        # 接受更广泛的成功状态码 (200, 201, 202, 204)，重试得到的409说明上一次请求已经生效
+        if response.succeeded:
             return combined_id, sandbox_id, duration_ms
         else:
             print(f"恢复失败 {combined_id} (sandbox_id: {sandbox_id})，状态码: {response.status_code}, 错误: {response.text}")
             return combined_id, sandbox_id, -1
     except Exception as e:
-        sandbox_id = combined_id.split('-')[0] if '-' in combined_id else combined_id
         print(f"恢复失败 {combined_id} (sandbox_id: {sandbox_id})，错误: {str(e)}")
         return combined_id, sandbox_id, -1
 
@@ -56,18 +50,18 @@ def load_combined_ids_from_pause_results():
         return []
 
     try:
-        # 读取CSV文件
-        df = pd.read_csv(PAUSE_RESULTS_FILE)
+        # 逐行读取CSV文件(暂停中途中断时会跳过写了一半的最后一行)
+        records = list(read_records(PAUSE_RESULTS_FILE, types={'pause_time_ms': float}))
+        columns = records[0].keys() if records else []
 
         # 检查是否存在combined_id列
-        if 'combined_id' in df.columns:
+        if 'combined_id' in columns:
             # 只选择暂停成功的sandbox (pause_time_ms > 0)
-            if 'pause_time_ms' in df.columns:
-                successful_df = df[df['pause_time_ms'] > 0]
-                combined_ids = successful_df['combined_id'].tolist()
+            if 'pause_time_ms' in columns:
+                combined_ids = [r['combined_id'] for r in records if (r['pause_time_ms'] or 0) > 0]
                 print(f"从 {PAUSE_RESULTS_FILE} 加载了 {len(combined_ids)} 个成功暂停的combined ID")
             else:
-                combined_ids = df['combined_id'].tolist()
+                combined_ids = [r['combined_id'] for r in records]
                 print(f"从 {PAUSE_RESULTS_FILE} 加载了 {len(combined_ids)} 个combined ID")
             return combined_ids
         else:
@@ -77,50 +71,73 @@ def load_combined_ids_from_pause_results():
         print(f"读取CSV文件时出错: {e}")
         return []
 
-def calculate_stats(times):
-    """计算时间统计数据，包括p90和p99"""
-    valid_times = [t for t in times if t > 0]
-    if not valid_times:
-        return {"min": 0, "max": 0, "avg": 0, "median": 0, "p90": 0, "p99": 0}
-
-    return {
-        "min": min(valid_times),
-        "max": max(valid_times),
-        "avg": sum(valid_times) / len(valid_times),
-        "median": statistics.median(valid_times),
-        "p90": np.percentile(valid_times, 90),
-        "p99": np.percentile(valid_times, 99)
-    }
-
-def resume_sandboxes():
-    """恢复所有从暂停结果文件加载的sandbox"""
+def resume_sandboxes(split_latency=False, profile=None, max_in_flight=100, limiter=None, policies=None):
+    """恢复所有从暂停结果文件加载的sandbox
+
+    profile 为空时单线程逐个恢复；否则按到达模型开环发送，耗时从计划发送时间算起(含排队)。
+    limiter 为 AIMDLimiter 时开环发送的在途数按SLO自适应调整(不超过 max_in_flight)。
+    """
     combined_ids = load_combined_ids_from_pause_results()
     if not combined_ids:
         return
 
     print(f"开始恢复 {len(combined_ids)} 个sandbox...")
-    resume_results = []
-
-    # 单线程恢复sandbox（不再有时间间隔）
-    with tqdm(total=len(combined_ids), desc="恢复sandbox") as pbar:
-        for i, combined_id in enumerate(combined_ids):
-            # 恢复当前sandbox
-            combined_id, sandbox_id, resume_time = resume_sandbox(combined_id)
-            resume_results.append((combined_id, sandbox_id, resume_time))
+    # 每个结果立即落盘
+    resume_results = ResultWriter(RESUME_RESULTS_FILE, columns=RESUME_COLUMNS)
+    # 直方图单位为毫秒，精度1微秒
+    resume_times = ms_histogram()
+    client = E2BClient(pool_size=1 if profile is None else max_in_flight, split_latency=split_latency,
+                       policies=policies)
+
+    if profile is None:
+        # 单线程恢复sandbox（不再有时间间隔）
+        with tqdm(total=len(combined_ids), desc="恢复sandbox") as pbar:
+            for i, combined_id in enumerate(combined_ids):
+                # 恢复当前sandbox
+                combined_id, sandbox_id, resume_time = resume_sandbox(client, combined_id)
+                resume_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "resume_time_ms": resume_time})
+                pbar.update(1)
+
+                if resume_time > 0:
+                    resume_times.record(resume_time)
+
+                # 显示实时成功率
+                success_rate = resume_times.count / (i + 1) * 100
+                pbar.set_postfix({'success': f"{success_rate:.1f}%"})
+    else:
+        # 按到达模型开环发送
+        scheduler = ArrivalScheduler(profile)
+        print(f"开环模式: {profile.describe()}, 最大在途 {max_in_flight}")
+
+        def on_done(record):
+            combined_id, sandbox_id, resume_time = record["result"]
+            resume_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "resume_time_ms": resume_time})
+            if resume_time > 0:
+                # 用含排队延迟的耗时统计，避免 coordinated omission
+                resume_times.record(record["latency_ms"])
             pbar.update(1)
 
-            # 显示实时成功率
-            success_count = len([t for _, _, t in resume_results if t > 0])
-            success_rate = success_count / (i + 1) * 100
-            pbar.set_postfix({'success': f"{success_rate:.1f}%"})
-
-    # 提取恢复时间
-    resume_times = [time for _, _, time in resume_results if time > 0]
+        with tqdm(total=len(combined_ids), desc="恢复sandbox") as pbar:
+            run_open_loop_threads(
+                lambda index: resume_sandbox(client, combined_ids[index]),
+                total=len(combined_ids),
+                scheduler=scheduler,
+                max_in_flight=max_in_flight,
+                on_done=on_done,
+                collect=False,
+                limiter=limiter,
+                is_error=lambda result: result[2] <= 0
+            )
+        scheduler.print_lag()
+        if limiter:
+            limiter.print_summary()
+            limiter.close()
+    resume_results.close()
 
     # 计算统计数据
-    stats = calculate_stats(resume_times)
+    stats = resume_times.summary()
 
-    print(f"\n成功恢复 {len(resume_times)}/{len(combined_ids)} 个sandbox ({len(resume_times)/len(combined_ids)*100:.1f}%)")
+    print(f"\n成功恢复 {resume_times.count}/{len(combined_ids)} 个sandbox ({resume_times.count/len(combined_ids)*100:.1f}%)")
     print(f"恢复时间统计 (ms):")
     print(f"  最小: {stats['min']:.2f}")
     print(f"  最大: {stats['max']:.2f}")
@@ -128,15 +145,68 @@ def resume_sandboxes():
     print(f"  中位数: {stats['median']:.2f}")
     print(f"  90%分位 (P90): {stats['p90']:.2f}")
     print(f"  99%分位 (P99): {stats['p99']:.2f}")
+    client.print_connection_stats()
+    client.print_policy_stats()
+
+    print(f"恢复结果已保存到 {RESUME_RESULTS_FILE}")
+    save_histograms("resume_results_hist.csv", {"resume": resume_times, **client.policy_histograms()}, append=False)
+
+def resume_sweep(levels, per_level, split_latency=False, policies=None):
+    """按并发档位扫描恢复的吞吐和延迟，每档使用 per_level 个新的已暂停sandbox"""
+    combined_ids = load_combined_ids_from_pause_results()
+    if not combined_ids:
+        return
 
-    # 创建详细的结果数据
-    results = pd.DataFrame({
-        "combined_id": [cid for cid, _, _ in resume_results],
-        "sandbox_id": [sid for _, sid, _ in resume_results],
-        "resume_time_ms": [time for _, _, time in resume_results]
-    })
-    results.to_csv("resume_results.csv", index=False)
-    print("恢复结果已保存到 resume_results.csv")
+    needed = total_needed(levels, per_level)
+    if len(combined_ids) < needed:
+        print(f"警告: 扫描共需 {needed} 个sandbox，只有 {len(combined_ids)} 个，高并发档位可能被跳过")
+    combined_ids = combined_ids[:needed]
+    print(f"并发扫描: 档位 {levels}, 每档 max({per_level}, {ROUNDS_PER_LEVEL}x并发) 个sandbox, 共 {len(combined_ids)} 个")
+    client = E2BClient(pool_size=max(levels), split_latency=split_latency, policies=policies)
+    resume_results = ResultWriter(RESUME_RESULTS_FILE, columns=RESUME_COLUMNS)
+
+    def op(combined_id):
+        _, sandbox_id, resume_time = resume_sandbox(client, combined_id)
+        resume_results.write({"combined_id": combined_id, "sandbox_id": sandbox_id, "resume_time_ms": resume_time})
+        return resume_time
+
+    try:
+        rows, histograms = sweep("resume", op, combined_ids, levels, per_level)
+    finally:
+        resume_results.close()
+    report_sweep("resume", rows, histograms)
+    client.print_connection_stats()
+    client.print_policy_stats()
+    print(f"恢复结果已保存到 {RESUME_RESULTS_FILE}")
 
 if __name__ == "__main__":
-    resume_sandboxes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Resume sandboxes listed in pause_results.csv')
+    parser.add_argument('--split-connection-latency', action='store_true',
+                      help='Report latencies on reused vs newly opened connections separately')
+    parser.add_argument('--profile', type=parse_profile, default=None,
+                      help='Send resumes open-loop with this arrival profile instead of one at a time: '
+                           'constant:RATE | ramp:START:END:SECONDS | step:RATExSECONDS,... | poisson:RATE[:BURST]')
+    parser.add_argument('--max-in-flight', type=int, default=100,
+                      help='Max concurrent resume requests with --profile (default: 100)')
+    parser.add_argument('--sweep', type=parse_levels, nargs='?', const=DEFAULT_LEVELS, default=None,
+                      help='Sweep resume concurrency over these levels, e.g. 1,2,4,8 (default: 1,2,4,...,128)')
+    parser.add_argument('--per-level', type=int, default=50,
+                      help=f'Minimum fresh paused sandboxes resumed at each sweep level; each level uses at least '
+                           f'{ROUNDS_PER_LEVEL} x its concurrency (default: 50)')
+    concurrency_limiter.add_arguments(parser)
+    request_policy.add_arguments(parser)
+    op_trace.add_arguments(parser)
+    args = parser.parse_args()
+    if args.adaptive and args.profile is None:
+        parser.error("--adaptive 需要配合 --profile 使用")
+    op_trace.from_args(args)
+
+    policies = request_policy.from_args(args, ENDPOINT_TIMEOUTS)
+
+    if args.sweep:
+        resume_sweep(args.sweep, args.per_level, split_latency=args.split_connection_latency,
+                     policies=policies)
+    else:
+        resume_sandboxes(split_latency=args.split_connection_latency, profile=args.profile,
+                         max_in_flight=args.max_in_flight, limiter=concurrency_limiter.from_args(args, "resume"),
+                         policies=policies)
\ No newline at end of file
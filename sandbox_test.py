@@ -1,76 +1,85 @@
+import math
 import os
 import time
 import random
-import requests
 from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
-from queue import Queue
+from queue import Empty
+import multiprocessing
 import signal
-import sys
-from collections import defaultdict
 import argparse
 from dotenv import load_dotenv
 from e2b_code_interpreter import Sandbox
+from e2b_client import E2BClient, BASE_URL, ENDPOINT_TIMEOUTS, TEMPLATE_ID, sdk_options
+import tracing
+from histogram import LatencyHistogram, save_histograms
+from tick_scheduler import TickScheduler
+from metrics import WindowedMetrics
+from uploads import UploadCache
+from handle_cache import SandboxHandleCache
+import chunked_upload
+import cleanup
+import concurrency_limiter
+import op_trace
+import request_policy
+from fleet_registry import FleetRegistry, RUNNING, PAUSING, PAUSED, RESUMING
 
 # 加载环境变量
 load_dotenv()
 pid = os.getpid()
 
 # 从环境变量获取配置
-API_KEY = os.getenv("E2B_API_KEY")
-BASE_URL = os.getenv("E2B_BASE_URL")
-TEMPLATE_ID = os.getenv("E2B_TEMPLATE_ID")
 TIMEOUT = int(os.getenv("E2B_TIMEOUT", 240))
 
 
-# 使用线程安全的列表存储sandbox信息
-sandbox_queue = Queue()
-sandbox_lock = Lock()
+# 按状态索引的sandbox注册表(线程安全)
+fleet = FleetRegistry()
+
+# 每种操作一个常量内存的延迟直方图(单位: 秒)；exec 为上传文件并执行(含ls)的数据面耗时
+OPERATIONS = ['create', 'pause', 'resume', 'connect', 'exec']
+operation_times = {op: LatencyHistogram(resolution=1e-6) for op in OPERATIONS}
+# 写入 report_{pid}.csv 的操作，其余操作和tick写入 ops_{pid}.csv
+REPORT_OPERATIONS = ['create', 'pause', 'resume']
+
+# 多进程模式下worker通过该队列把直方图快照发给协调进程
+report_queue = None
+worker_index = 0
+# 1s/10s/60s滑动窗口指标，写入 metrics_{pid}.csv 并可通过 /metrics 抓取
+metrics = None
+# --adaptive 时创建和状态切换的在途数由AIMD限制器按SLO调整
+create_limiter = None
+transition_limiter = None
+# 大文件的分块上传器，进程内所有sandbox共享带宽上限
+uploader = None
+
+
+def print_info(histograms=None, tick_hist=None, summary=None, counts=None, handle_stats=None, phases=None):
+    """打印并写入统计报告，默认使用本进程的数据；协调进程传入合并后的数据"""
+    if histograms is None:
+        histograms = operation_times
+        tick_hist = scheduler.tick_durations
+        summary = scheduler.summary()
+        counts = fleet.counts()
+        handle_stats = handles.stats()
+        phases = tracing.phase_histograms
 
-operation_times = defaultdict(list)
-
-def calculate_percentiles(times):
-    if not times:
-        return 0, 0, 0
-
-    sorted_times = sorted(times)
-    length = len(sorted_times)
-
-    # 计算p99的索引
-    p99_idx = int(length * 0.99)
-    if p99_idx == length:
-        p99_idx = length - 1
-
-    # 计算p90的索引
-    p90_idx = int(length * 0.90)
-    if p90_idx == length:
-        p90_idx = length - 1
-
-    # 计算平均值
-    avg = sum(sorted_times) / length
-
-    return sorted_times[p99_idx], sorted_times[p90_idx], avg
-
-def signal_handler(sig, frame):
-    print_info()
-    sys.exit(0)
-
-
-def print_info():
     print(f"\n\n===  {pid} Operation Statistics ===")
-    # Open CSV file in append mode
-    with open(f'report_{pid}.csv', 'a') as csvfile:
+    # report_{pid}.csv 每个快照只有 create/pause/resume 三行(与原来的格式相同)，
+    # connect/exec/tick 写到格式相同的 ops_{pid}.csv
+    with open(f'report_{pid}.csv', 'a') as csvfile, open(f'ops_{pid}.csv', 'a') as extra:
         # Write header if file is empty
-        if csvfile.tell() == 0:
-            csvfile.write("timestamp,operation,count,p99,p90,avg\n")
+        for f in (csvfile, extra):
+            if f.tell() == 0:
+                f.write("timestamp,operation,count,p99,p90,avg\n")
 
         # Get current timestamp
         current_time = time.strftime("%Y-%m-%d %H:%M:%S")
 
-        for op in ['create', 'pause', 'resume']:
-            if operation_times[op]:
-                p99, p90, avg = calculate_percentiles(operation_times[op])
-                count = len(operation_times[op])
+        for op in OPERATIONS:
+            hist = histograms[op]
+            if hist.count:
+                p99, p90 = hist.percentiles(99, 90)
+                avg = hist.mean
+                count = hist.count
 
                 # Print to console
                 print(f"{op.capitalize()}:")
@@ -80,156 +89,255 @@ def print_info():
                 print(f"  Avg: {avg:.4f}s")
 
                 # Write to CSV
-                csvfile.write(f"{current_time},{op},{count},{p99:.4f},{p90:.4f},{avg:.4f}\n")
-
+                out = csvfile if op in REPORT_OPERATIONS else extra
+                out.write(f"{current_time},{op},{count},{p99:.4f},{p90:.4f},{avg:.4f}\n")
+
+        # tick实际耗时(最后一个切换完成的时间)和实际达到的切换速率
+        if tick_hist.count:
+            p99, p90 = tick_hist.percentiles(99, 90)
+            extra.write(f"{current_time},tick,{tick_hist.count},{p99:.4f},{p90:.4f},{tick_hist.mean:.4f}\n")
+        print("Tick:")
+        print(f"  Count: {summary['ticks']}  Overruns: {summary['overruns']}  Throttled: {summary['throttled']}")
+        print(f"  Churn: {summary['achieved_rate']:.2f}/s (target {summary['target_rate']:.2f}/s)"
+              f"  Inflight limit: {summary.get('inflight_limit', '-')}")
+        print("Fleet: " + "  ".join(f"{state}={count}" for state, count in counts.items()))
+        print("Handles: " + "  ".join(f"{key}={value}" for key, value in handle_stats.items()))
+    tracing.print_phases(phases)
+
+    # 完整的累计直方图写在report旁边(只保留最新快照)，便于事后合并或重新计算任意百分位
+    all_histograms = dict(histograms)
+    all_histograms.update({f"phase:{name}": hist for name, hist in phases.items()})
+    save_histograms(f'report_{pid}_hist.csv', all_histograms, timestamp=current_time, append=False)
     print("============================")
 
 
 def create_single_sandbox():
-    """创建单个sandbox"""
+    """创建单个sandbox并执行第一个文件，返回创建是否成功
+
+    创建和执行分别统计: 执行失败只记为exec错误(run_files中记录)，sandbox照常加入fleet，
+    之后的pause/resume失败时再按 fail_sandbox 替换。
+    """
     start_time = time.time()
-    try:
-        # 创建sandbox
-        sbx = Sandbox(template=TEMPLATE_ID, timeout=300*2)
-        sandbox_id = sbx.get_info().sandbox_id
+    sandbox_id = None
+    with tracing.span("create_sandbox") as sp:
+        try:
+            # 创建sandbox
+            with tracing.span("sdk.create"):
+                sbx = Sandbox(template=TEMPLATE_ID, timeout=300*2, metadata=cleanup.run_metadata(), **sdk_options())
+            with tracing.span("sdk.get_info"):
+                sandbox_id = sbx.get_info().sandbox_id
+        except Exception as e:
+            metrics.record_error('create')
+            op_trace.record('create', None, {"timeout": 300*2}, ts=start_time, ok=False, error=type(e).__name__)
+            print(f"Error creating sandbox: {str(e)}")
+            return False
+        sp.set(sandbox_id=sandbox_id)
+        handles.put(sandbox_id, sbx)
         duration = time.time() - start_time
-        operation_times['create'].append(duration)
+        operation_times['create'].record(duration)
+        metrics.record('create', duration)
+        op_trace.record('create', sandbox_id, {"timeout": 300*2}, ts=start_time)
         print(f"sandbox {sandbox_id} create time: {duration}s")
 
-        # 使用SDK上传python程序
-        for file_path in upload_files:
-            with open(file_path, "rb") as file:
-                file_content = file.read()
-                file_name = file_path.split('/')[-1]
-                sbx.files.write(f"/home/user/{file_name}", file_content)
-
-        # 在sandbox中执行上传的python程序
+        # 打包上传所有python程序，并在同一次调用中执行第一个
         if upload_files:
-            first_file = upload_files[0].split('/')[-1]
-            execution = sbx.commands.run(f"python /home/user/{first_file}")
-            print(f"{sandbox_id}: stdout: {execution.stdout}")
+            try:
+                run_files(sbx, sandbox_id, upload_files, upload_files[0])
+            except Exception as e:
+                print(f"sandbox {sandbox_id} code execution failed: {str(e)}")
 
-        print(f"sandbox [{sandbox_id}] code execution time: {time.time() - start_time}s")
+    print(f"sandbox [{sandbox_id}] code execution time: {time.time() - start_time}s")
+
+    fleet.add(sandbox_id, RUNNING)
+    return True
 
-        sandbox_queue.put({"id": sandbox_id, "running": True})
+
+def run_files(sbx, sandbox_id, files, file_to_run, background=False, ls=False):
+    """上传files并运行其中的file_to_run，作为一次exec操作录制"""
+    payload = {"files": list(files), "run": file_to_run, "background": background, "ls": ls}
+    start_time = time.time()
+    try:
+        if ls:
+            with tracing.span("commands.ls"):
+                execution = sbx.commands.run("ls -l /home/user")
+            print(f"{sandbox_id}: ls -l /home/user: {execution.stdout}")
+
+        command = f"python {uploads.remote_path(file_to_run)}"
+        if background:
+            uploads.run(sbx, files, command, background=True)
+            print(f"{sandbox_id}: Running {os.path.basename(file_to_run)} in background")
+        else:
+            # 正常运行文件并等待输出
+            execution = uploads.run(sbx, files, command)
+            print(f"{sandbox_id}: stdout: {execution.stdout}")
     except Exception as e:
-        print(f"Error creating sandbox: {str(e)}")
+        metrics.record_error('exec')
+        op_trace.record('exec', sandbox_id, payload, ts=start_time, ok=False, error=type(e).__name__)
+        raise
+    duration = time.time() - start_time
+    operation_times['exec'].record(duration)
+    metrics.record('exec', duration)
+    op_trace.record('exec', sandbox_id, payload, ts=start_time)
+
+
+def create_limited_sandbox():
+    """创建单个sandbox，开启 --adaptive 时先等待限制器放行"""
+    if create_limiter is None:
+        return create_single_sandbox()
+    create_limiter.acquire()
+    start_time = time.monotonic()
+    ok = False
+    try:
+        ok = create_single_sandbox()
+    finally:
+        create_limiter.release(time.monotonic() - start_time, ok)
+    return ok
 
 
 def connect_sandbox(sandbox_id):
     """连接sandbox"""
     try:
         start_time = time.time()
-        sbx = Sandbox.connect(sandbox_id=sandbox_id)
-        print(f"sandbox {sandbox_id} create time: {time.time() - start_time}s")
-
-        execution = sbx.commands.run("ls -l /home/user")
-        print(f"{sandbox_id}: ls -l /home/user: {execution.stdout}")
-
-        # 随机上传一个文件(pi.py会运行在后台)
-        file_to_run = random.choice(upload_files)
-        file_name = file_to_run.split('/')[-1]
-
-        with open(file_to_run, "rb") as file:
-            file_content = file.read()
-            sbx.files.write(f"/home/user/{file_name}", file_content)
-            if 'pi.py' in file_name:
-                # 运行pi.py在后台
-                sbx.commands.run(f"python /home/user/{file_name}", background=True)
-                print(f"{sandbox_id}: Running {file_name} in background")
-            else:
-                # 正常运行文件并等待输出
-                execution = sbx.commands.run(f"python /home/user/{file_name}")
-                print(f"{sandbox_id}: stdout: {execution.stdout}")
+        with tracing.span("connect_sandbox", sandbox_id=sandbox_id):
+            # 优先复用缓存的Sandbox对象(resume后校验一次)，未命中才重新连接
+            sbx = handles.get(sandbox_id)
+            duration = time.time() - start_time
+            operation_times['connect'].record(duration)
+            metrics.record('connect', duration)
+            print(f"sandbox {sandbox_id} create time: {duration}s")
+
+            # 随机上传一个文件(pi.py会运行在后台)，上传和执行在同一次调用中完成；选中的文件会被录制
+            file_to_run = random.choice(upload_files)
+            run_files(sbx, sandbox_id, [file_to_run], file_to_run, background='pi.py' in os.path.basename(file_to_run),
+                      ls=True)
 
         print(f"sandbox [{sandbox_id}] code execution time: {time.time() - start_time}s")
         return True
 
     except Exception as e:
+        metrics.record_error('connect')
         print(f"Error connecting sandbox: {str(e)}")
         return False
 
 def create_sandbox(max_workers=10):
     """创建多个sandbox"""
     total_time = time.time()
+    if create_limiter:
+        max_workers = create_limiter.max_limit
     with ThreadPoolExecutor(max_workers) as executor:
-        futures = [executor.submit(create_single_sandbox) for _ in range(sandbox_num)]
+        futures = [executor.submit(create_limited_sandbox) for _ in range(sandbox_num)]
         for future in futures:
             future.result()
     print(f"total time: {time.time() - total_time}s")
 
-def select_sandbox():
-    """选择sandbox进行暂停或者恢复操作"""
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        for _ in range(20):
-            try:
-                # 获取当前所有sandbox状态
-                current_sandboxes = []
-                while not sandbox_queue.empty():
-                    current_sandboxes.append(sandbox_queue.get())
-
-                if not current_sandboxes:
-                    continue
-
-                random_sandbox = random.choice(current_sandboxes)
-                if random_sandbox["running"]:
-                    future = executor.submit(pause_sandbox, random_sandbox["id"])
-                    if not future.result():
-                        # 如果暂停失败，创建新的sandbox替换
-                        executor.submit(create_single_sandbox)
-                    else:
-                        random_sandbox["running"] = False
-                        current_sandboxes[current_sandboxes.index(random_sandbox)]=random_sandbox
-                else:
-                    future = executor.submit(resume_sandbox, random_sandbox["id"])
-                    if not future.result():
-                        # 如果恢复失败，创建新的sandbox替换
-                        print(f"sandbox {random_sandbox['id']} resume failed, create new sandbox")
-                        current_sandboxes.remove(random_sandbox)
-                        executor.submit(create_single_sandbox)
-
-                    else:
-                        # 恢复后连接sandbox, 并运行对应的文件
-                        run_code = connect_sandbox(random_sandbox["id"])
-                        if run_code:
-                            random_sandbox["running"] = True
-                            current_sandboxes[current_sandboxes.index(random_sandbox)]=random_sandbox
-
-                        else:
-                            # 如果连接失败，创建新的sandbox替换
-                            print(f"sandbox {random_sandbox['id']} connect failed, create new sandbox")
-                            current_sandboxes.remove(random_sandbox)
-                            executor.submit(create_single_sandbox)
-                            continue
-
-                # 将处理后的sandbox信息放回队列
-                for sandbox in current_sandboxes:
-                    sandbox_queue.put(sandbox)
-                print_info()
+def pick_sandboxes(k):
+    """随机认领k个sandbox(认领后处于pausing/resuming状态，切换完成前不会被再次选中)"""
+    return fleet.claim(k)
 
-            except Exception as e:
-                print(f"Error in select_sandbox: {str(e)}")
+
+def kill_failed_sandbox(sandbox_id):
+    """删除失败的sandbox，避免继续占用配额"""
+    try:
+        response = client.kill_sandbox(sandbox_id)
+        if not response.succeeded and response.status_code != 404:
+            print(f"sandbox {sandbox_id} kill failed, status code: {response.status_code}")
+    except Exception as e:
+        print(f"sandbox {sandbox_id} kill failed: {str(e)}")
+
+
+def fail_sandbox(sandbox_id, from_state):
+    """sandbox失败: 移出注册表(只计入失败数)，创建新的sandbox替换并删除失败的那个
+
+    pause/resume 已按请求策略重试过。
+    """
+    handles.discard(sandbox_id)
+    replace_executor.submit(create_limited_sandbox)
+    fleet.fail(sandbox_id, from_state)
+    replace_executor.submit(kill_failed_sandbox, sandbox_id)
+    return False
+
+
+def transition_sandbox(item):
+    """对单个sandbox执行一次状态切换，成功后更新注册表状态，失败则创建新的sandbox替换"""
+    sandbox_id, state = item
+    with tracing.span("transition", sandbox_id=sandbox_id, state=state):
+        return _transition_sandbox(sandbox_id, state)
+
+
+def _transition_sandbox(sandbox_id, state):
+    if state == RUNNING:
+        if not pause_sandbox(sandbox_id):
+            # 如果暂停失败，创建新的sandbox替换
+            return fail_sandbox(sandbox_id, PAUSING)
+        fleet.transition(sandbox_id, PAUSING, PAUSED)
+    else:
+        if not resume_sandbox(sandbox_id):
+            # 如果恢复失败，创建新的sandbox替换
+            print(f"sandbox {sandbox_id} resume failed, create new sandbox")
+            return fail_sandbox(sandbox_id, RESUMING)
+
+        # 恢复后连接sandbox, 并运行对应的文件
+        if not connect_sandbox(sandbox_id):
+            # 如果连接失败，创建新的sandbox替换
+            print(f"sandbox {sandbox_id} connect failed, create new sandbox")
+            return fail_sandbox(sandbox_id, RESUMING)
+        fleet.transition(sandbox_id, RESUMING, RUNNING)
+    return True
+
+
+def write_tick(stats):
+    """把每个tick的调度结果写入 ticks_{pid}.csv"""
+    with open(f'ticks_{pid}.csv', 'a') as csvfile:
+        if csvfile.tell() == 0:
+            csvfile.write(",".join(stats.keys()) + "\n")
+        csvfile.write(",".join(str(v) for v in stats.values()) + "\n")
+
+
+def select_sandbox():
+    """执行一个tick: 并发切换一部分sandbox的状态"""
+    try:
+        stats = scheduler.run_tick()
+        # 附带各状态的sandbox数量
+        stats.update(fleet.counts())
+        write_tick(stats)
+        report()
+    except Exception as e:
+        print(f"Error in select_sandbox: {str(e)}")
+
+
+def report():
+    """单进程模式直接输出报告，多进程模式把累计快照发给协调进程"""
+    if report_queue is None:
+        print_info()
+        return
+    report_queue.put({
+        "worker": worker_index,
+        "histograms": {op: hist.encode() for op, hist in operation_times.items()},
+        "tick": scheduler.tick_durations.encode(),
+        "summary": scheduler.summary(),
+        "counts": fleet.counts(),
+        "handles": handles.stats(),
+        "phases": {name: hist.encode() for name, hist in list(tracing.phase_histograms.items())},
+        "closed": metrics.take_closed(),
+    })
 
 
 def pause_sandbox(combined_id):
     """使用RESTAPI暂停Sandbox"""
-    url = f"{BASE_URL}/sandboxes/{combined_id}/pause"
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
-
     start_time = time.time()
     try:
-        response = requests.post(url, headers=headers)
-        response.raise_for_status()
+        response = client.pause_sandbox(combined_id)
+        if not response.succeeded:
+            response.raise_for_status()
         duration = time.time() - start_time
-        operation_times['pause'].append(duration)
+        operation_times['pause'].record(duration)
+        metrics.record('pause', duration)
         print(f"暂停成功! sandboxID: {combined_id}, 耗时: {duration:.4f} 秒")
 
 
         return True
     except Exception as e:
+        metrics.record_error('pause')
         print(f"暂停 Sandbox {combined_id} 失败: {str(e)}, 耗时: {time.time() - start_time:.4f} 秒")
         return False
 
@@ -237,30 +345,201 @@ def pause_sandbox(combined_id):
 
 def resume_sandbox(combined_id):
     """使用RESTAPI恢复Sandbox"""
-    url = f"{BASE_URL}/sandboxes/{combined_id}/resume"
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "timeout": TIMEOUT
-    }
-
     start_time = time.time()
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
+        response = client.resume_sandbox(combined_id, TIMEOUT)
+        if not response.succeeded:
+            response.raise_for_status()
         duration = time.time() - start_time
-        operation_times['resume'].append(duration)
+        operation_times['resume'].record(duration)
+        metrics.record('resume', duration)
         print(f"恢复成功! sandboxID: {combined_id}, 耗时: {duration:.4f} 秒")
 
 
         return True
     except Exception as e:
+        metrics.record_error('resume')
         print(f"恢复 Sandbox {combined_id} 失败: {str(e)}, 耗时: {time.time() - start_time:.4f} 秒")
         return False
 
 
+
+
+def split_evenly(total, parts):
+    """把total尽量平均地分成parts份"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def run_worker(args, sandboxes, workers, max_inflight, queue=None, index=0):
+    """运行一个压测进程: 创建sandbox后按tick持续切换状态，直到收到SIGINT"""
+    global pid, sandbox_num, upload_files, uploads, handles, client, replace_executor, scheduler, report_queue, worker_index, metrics
+    global create_limiter, transition_limiter, uploader
+    # start.sh 用 nohup ... & 启动时SIGINT被继承为忽略，Python不会安装默认处理，需要显式恢复
+    # 否则 kill -INT 无法触发最终报告
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # fork出来的子进程需要使用自己的pid命名输出文件
+    pid = os.getpid()
+    sandbox_num = sandboxes
+    upload_files = args.files
+    # 启动时读入所有待上传文件，之后只在mtime变化时重新读取；大于 --chunk-size 的文件映射后分块上传
+    # 多进程模式下带宽上限由各worker平分
+    uploader = chunked_upload.from_args(args, share=1 if queue is None else args.procs)
+    uploads = UploadCache(upload_files, uploader=uploader)
+    handles = SandboxHandleCache(
+        connect=lambda sandbox_id: Sandbox.connect(sandbox_id=sandbox_id, **sdk_options()),
+        max_size=args.handle_cache_size,
+        idle_ttl=args.handle_idle_ttl
+    )
+    report_queue = queue
+    worker_index = index
+
+    if args.trace:
+        # 多进程模式下每个worker写自己的trace文件
+        root, ext = os.path.splitext(args.trace)
+        tracing.reset()
+        tracing.enable(args.trace if queue is None else f"{root}_{pid}{ext or '.json'}")
+    if args.record:
+        # 同样每个worker录制到自己的文件，回放时一起传给 trace_replay.py
+        root, ext = os.path.splitext(args.record)
+        op_trace.enable(args.record if queue is None else f"{root}_{pid}{ext or '.jsonl'}")
+
+    # 多进程模式下窗口分片发给协调进程，由协调进程写CSV和提供 /metrics
+    if queue is None:
+        metrics = WindowedMetrics(OPERATIONS, path=f'metrics_{pid}.csv').start()
+        if args.metrics_port:
+            metrics.serve(args.metrics_port)
+    else:
+        metrics = WindowedMetrics(OPERATIONS, export=True).start()
+
+    # 多进程模式下每个worker各自调整，并发轨迹写入 concurrency_{create,transition}_{pid}.csv
+    create_limiter = concurrency_limiter.from_args(args, "create")
+    transition_limiter = concurrency_limiter.from_args(args, "transition")
+    if transition_limiter:
+        max_inflight = transition_limiter.max_limit
+
+    # 连接池同时服务创建线程和状态切换线程
+    # pause/resume 失败时先按策略重试，重试用尽才替换sandbox
+    client = E2BClient(pool_size=workers + max_inflight, split_latency=args.split_connection_latency,
+                       policies=request_policy.from_args(args, ENDPOINT_TIMEOUTS))
+    replace_executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+    scheduler = TickScheduler(
+        fleet_size=fleet.active_count,
+        pick=pick_sandboxes,
+        transition=transition_sandbox,
+        fraction=args.churn,
+        interval=args.tick,
+        max_inflight=max_inflight,
+        limiter=transition_limiter
+    )
+
+    print(f"[{pid}] worker_num: {workers} sandbox_num: {sandboxes} max_inflight: {max_inflight}")
+    try:
+        create_sandbox(max_workers=workers)
+        while True:
+            select_sandbox()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 输出最终报告期间忽略重复的ctrl+c
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        report()
+        client.print_connection_stats()
+        client.print_policy_stats()
+        uploader.print_stats()
+        uploader.close()
+        save_histograms(f'policy_{pid}_hist.csv', client.policy_histograms(), append=False)
+        for limiter in (create_limiter, transition_limiter):
+            if limiter:
+                limiter.print_summary()
+                limiter.close()
+        tracing.export()
+        op_trace.close()
+        scheduler.shutdown()
+        replace_executor.shutdown(wait=False)
+        metrics.stop()
+
+
+def merge_snapshots(snapshots):
+    """把各worker最新的累计快照合并成整个fleet的统计数据"""
+    histograms = {op: LatencyHistogram(resolution=1e-6) for op in OPERATIONS}
+    tick_hist = LatencyHistogram(resolution=1e-6)
+    summary = {}
+    counts = {}
+    handle_stats = {}
+    phases = {}
+    for snapshot in snapshots.values():
+        for op, encoded in snapshot["histograms"].items():
+            histograms[op].merge(LatencyHistogram.decode(encoded))
+        tick_hist.merge(LatencyHistogram.decode(snapshot["tick"]))
+        # 计数和速率在worker之间直接相加
+        for key, value in snapshot["summary"].items():
+            summary[key] = summary.get(key, 0) + value
+        for state, count in snapshot["counts"].items():
+            counts[state] = counts.get(state, 0) + count
+        for key, value in snapshot["handles"].items():
+            handle_stats[key] = handle_stats.get(key, 0) + value
+        for name, encoded in snapshot["phases"].items():
+            phases.setdefault(name, LatencyHistogram(resolution=1e-6)).merge(LatencyHistogram.decode(encoded))
+    return histograms, tick_hist, summary, counts, handle_stats, phases
+
+
+def run_coordinator(args):
+    """启动多个worker进程，每个tick合并一次它们的直方图并输出整个fleet的报告"""
+    # 同 run_worker: 后台启动时SIGINT默认被忽略
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    sandboxes = split_evenly(args.sandboxes, args.procs)
+    workers = split_evenly(max(args.workers, args.procs), args.procs)
+    inflight = split_evenly(max(args.max_inflight, args.procs), args.procs)
+
+    procs = [
+        ctx.Process(target=run_worker, args=(args, sandboxes[i], workers[i], inflight[i], queue, i))
+        for i in range(args.procs)
+    ]
+    for proc in procs:
+        proc.start()
+
+    # worker每个tick才发来一次封存的分片，窗口聚合推迟到这些秒的数据都到齐之后
+    windowed = WindowedMetrics(OPERATIONS, path=f'metrics_{pid}.csv', lag=math.ceil(args.tick) + 1).start()
+    if args.metrics_port:
+        windowed.serve(args.metrics_port)
+    snapshots = {}
+
+    def drain(timeout):
+        try:
+            snapshot = queue.get(timeout=timeout)
+            snapshots[snapshot["worker"]] = snapshot
+            windowed.absorb(snapshot["closed"])
+        except Empty:
+            pass
+
+    next_report = time.monotonic() + args.tick
+    try:
+        while any(proc.is_alive() for proc in procs):
+            drain(max(0, next_report - time.monotonic()))
+            if time.monotonic() >= next_report:
+                if snapshots:
+                    print_info(*merge_snapshots(snapshots))
+                next_report += args.tick
+    except KeyboardInterrupt:
+        # 忽略重复的ctrl+c; kill -INT只发给协调进程时，转发给仍在运行的worker
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for proc in procs:
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGINT)
+
+    # 收集各worker退出前发出的最终快照
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while any(proc.is_alive() for proc in procs) or not queue.empty():
+        drain(0.5)
+    for proc in procs:
+        proc.join()
+    if snapshots:
+        print_info(*merge_snapshots(snapshots))
+    windowed.stop()
+
+
 if __name__ == "__main__":
     # 设置参数解析器
     parser = argparse.ArgumentParser(description='Sandbox management script')
@@ -270,21 +549,46 @@ if __name__ == "__main__":
                       help='Number of sandboxes to create (default: 20)')
     parser.add_argument('--files', nargs='+', default=["./hello.py", "./pi.py"],
                       help='List of files to upload (default: ./hello.py ./pi.py)')
+    parser.add_argument('--split-connection-latency', action='store_true',
+                      help='Report latencies on reused vs newly opened connections separately')
+    parser.add_argument('--churn', type=float, default=0.2,
+                      help='Fraction of the fleet that changes state every tick (default: 0.2)')
+    parser.add_argument('--tick', type=float, default=1.0,
+                      help='Tick interval in seconds (default: 1.0)')
+    parser.add_argument('--max-inflight', type=int, default=50,
+                      help='Max concurrent pause/resume transitions (default: 50)')
+    parser.add_argument('--procs', type=int, default=1,
+                      help='Number of worker processes; sandboxes, workers and max-inflight are split '
+                           'between them and a coordinator merges their reports (default: 1)')
+    parser.add_argument('--handle-cache-size', type=int, default=1000,
+                      help='Max connected Sandbox handles kept per process, 0 disables caching (default: 1000)')
+    parser.add_argument('--handle-idle-ttl', type=float, default=300,
+                      help='Seconds an unused Sandbox handle is kept before eviction (default: 300)')
+    parser.add_argument('--trace', default=os.getenv("E2B_TRACE"),
+                      help='Record per-phase spans and write a Chrome trace JSON to this path '
+                           '(with --procs, one file per worker; default: $E2B_TRACE, disabled)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                      help='Serve windowed metrics in Prometheus format on this port (default: 0, disabled)')
+    # --adaptive 时忽略 --workers/--max-inflight 的固定值，创建和状态切换分别自适应
+    concurrency_limiter.add_arguments(parser)
+    # 每个pause/resume请求的超时、重试和对冲，首次请求/端到端耗时写入 policy_{pid}_hist.csv
+    request_policy.add_arguments(parser)
+    # 录制每个create/pause/resume/exec，之后可用 trace_replay.py 按同样的顺序回放
+    op_trace.add_arguments(parser)
+    # 大文件用mmap分块并行上传，所有sandbox共享带宽上限，上传后用sha256校验
+    chunked_upload.add_arguments(parser)
+    # 退出时(含ctrl+c)删除本次运行创建的sandbox，多进程模式下由协调进程统一清理
+    cleanup.add_arguments(parser)
 
     # 解析参数
     args = parser.parse_args()
 
-    # 更新变量
-    worker_num = args.workers
-    sandbox_num = args.sandboxes
-    upload_files = args.files
-
     print(f"API_URL: {BASE_URL} {TEMPLATE_ID} " )
-    print(f"worker_num: {worker_num} sandbox_num: {sandbox_num} upload_files: {upload_files} " )
-    # 注册信号处理ctrl+c
-    signal.signal(signal.SIGINT, signal_handler)
-
-    create_sandbox(max_workers=worker_num)
-    while True:
-        select_sandbox()
-        time.sleep(1)
\ No newline at end of file
+    print(f"worker_num: {args.workers} sandbox_num: {args.sandboxes} upload_files: {args.files} " )
+    print(f"churn: {args.churn} tick: {args.tick}s max_inflight: {args.max_inflight} procs: {args.procs}")
+
+    with cleanup.from_args(args):
+        if args.procs > 1:
+            run_coordinator(args)
+        else:
+            run_worker(args, args.sandboxes, args.workers, args.max_inflight)
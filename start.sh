@@ -1,2 +1,2 @@
 source set_env.sh
-nohup python sandbox_test.py --sandboxes $1 > output.log 2>&1 &
\ No newline at end of file
+nohup python sandbox_test.py --sandboxes $1 --procs ${2:-1} > output.log 2>&1 &
\ No newline at end of file
@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from histogram import ms_histogram, save_histograms
+from results_store import load_dataframe
+
+# 默认并发档位
+DEFAULT_LEVELS = [1, 2, 4, 8, 16, 32, 64, 128]
+# 并发翻倍时吞吐增幅低于该比例即认为不再随并发扩展
+KNEE_GAIN = 0.1
+# 每档至少让每个并发槽执行这么多次，否则高并发档位的在途数达不到档位值，结果主要是启动和收尾阶段
+ROUNDS_PER_LEVEL = 4
+
+
+def parse_levels(text):
+    """解析 --sweep 参数，如 1,2,4,8"""
+    levels = sorted({int(x) for x in text.split(",") if x.strip()})
+    if not levels or levels[0] < 1:
+        raise ValueError("并发档位必须为正整数")
+    return levels
+
+
+def level_size(concurrency, per_level):
+    """并发 concurrency 的档位使用的sandbox数(请求数)"""
+    return max(per_level, ROUNDS_PER_LEVEL * concurrency)
+
+
+def total_needed(levels, per_level):
+    """扫描所有档位共需的sandbox数"""
+    return sum(level_size(concurrency, per_level) for concurrency in levels)
+
+
+def run_level(op, ids, concurrency, desc):
+    """以固定并发(闭环)对 ids 逐个执行 op(id)，op 返回耗时ms，失败返回-1
+
+    返回 (成功耗时直方图, 错误数, 墙钟耗时秒)
+    """
+    hist = ms_histogram()
+    errors = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        with tqdm(total=len(ids), desc=desc, leave=False) as pbar:
+            for duration_ms in executor.map(op, ids):
+                if duration_ms > 0:
+                    hist.record(duration_ms)
+                else:
+                    errors += 1
+                pbar.update(1)
+    return hist, errors, time.monotonic() - start
+
+
+def find_knee(rows, gain=KNEE_GAIN):
+    """返回吞吐停止扩展处的并发档位
+
+    从低到高比较相邻档位，吞吐增幅低于 gain * (并发倍数 - 1) 时，认为上一档就是拐点；
+    一直在扩展则返回最后一档(说明还没测到拐点)。
+    """
+    for prev, cur in zip(rows, rows[1:]):
+        if prev["ops_per_s"] <= 0:
+            continue
+        ratio = cur["concurrency"] / prev["concurrency"]
+        if cur["ops_per_s"] / prev["ops_per_s"] - 1 < gain * (ratio - 1):
+            return prev["concurrency"]
+    return rows[-1]["concurrency"] if rows else None
+
+
+def sweep(operation, op, ids, levels, per_level):
+    """按并发档位依次执行，每档使用 level_size() 个新的sandbox
+
+    返回 (每档统计行, {档位名: 直方图})；每个操作的结果由 op 自己落盘
+    """
+    rows = []
+    histograms = {}
+    offset = 0
+    for concurrency in levels:
+        size = level_size(concurrency, per_level)
+        batch = ids[offset:offset + size]
+        if len(batch) < concurrency:
+            print(f"sandbox不足(剩余 {len(batch)} 个)，跳过并发 {concurrency} 及之后的档位")
+            break
+        if len(batch) < size:
+            print(f"sandbox不足，并发 {concurrency} 只有 {len(batch)}/{size} 个，结果中启动和收尾阶段占比偏大")
+        offset += len(batch)
+
+        hist, errors, elapsed = run_level(op, batch, concurrency, f"{operation} 并发{concurrency}")
+        histograms[f"{operation}@{concurrency}"] = hist
+
+        p50, p90, p99 = hist.percentiles(50, 90, 99) if hist.count else (0, 0, 0)
+        row = {
+            "concurrency": concurrency,
+            "count": len(batch),
+            "ok": hist.count,
+            "ops_per_s": hist.count / elapsed if elapsed > 0 else 0,
+            "error_rate": errors / len(batch),
+            "p50_ms": p50,
+            "p90_ms": p90,
+            "p99_ms": p99,
+            "max_ms": hist.max if hist.count else 0,
+        }
+        rows.append(row)
+        print(f"并发 {concurrency:>4}: {row['ops_per_s']:8.2f} ops/s, P50 {p50:.2f}ms, P90 {p90:.2f}ms, "
+              f"P99 {p99:.2f}ms, 错误率 {row['error_rate'] * 100:.1f}%")
+    return rows, histograms
+
+
+def report_sweep(operation, rows, histograms):
+    """打印吞吐-延迟表和拐点，并保存 {operation}_sweep.csv / {operation}_sweep_hist.csv"""
+    if not rows:
+        return None
+    knee = find_knee(rows)
+    best = max(rows, key=lambda row: row["ops_per_s"])
+
+    table = load_dataframe(rows)
+    print(f"\n{operation} 并发扫描结果:")
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+    if knee == rows[-1]["concurrency"] and len(rows) > 1:
+        print(f"吞吐在测试范围内一直随并发增长，拐点 >= {knee}")
+    else:
+        print(f"拐点: 并发 {knee} (之后吞吐不再明显增长)")
+    print(f"最高吞吐: 并发 {best['concurrency']}, {best['ops_per_s']:.2f} ops/s")
+
+    table["knee"] = table["concurrency"] == knee
+    table.to_csv(f"{operation}_sweep.csv", index=False)
+    save_histograms(f"{operation}_sweep_hist.csv", histograms, append=False)
+    print(f"扫描结果已保存到 {operation}_sweep.csv / {operation}_sweep_hist.csv")
+    return knee
@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from histogram import LatencyHistogram
+
+
+class TickScheduler:
+    """按固定节拍挑选一部分sandbox并发执行状态切换
+
+    每个tick挑选 fraction * 当前fleet大小 个sandbox，并发提交 transition(item)，
+    在途切换数不超过 max_inflight(超出的部分记为 throttled，本tick不再调度)。
+    tick到期时仍未完成的切换记为超时(overrun)，不会阻塞下一个tick的启动。
+    limiter 为 concurrency_limiter.AIMDController 时，在途上限改由它按SLO自适应调整。
+    """
+
+    def __init__(self, fleet_size, pick, transition, fraction=0.2, interval=1.0, max_inflight=50, limiter=None):
+        self.fleet_size = fleet_size
+        self.pick = pick
+        self.transition = transition
+        self.fraction = fraction
+        self.interval = interval
+        self.max_inflight = max_inflight
+        self.limiter = limiter
+
+        self.executor = ThreadPoolExecutor(max_workers=limiter.max_limit if limiter else max_inflight)
+        self.lock = threading.Lock()
+        self.inflight = 0
+
+        # 累计统计
+        self.started = None
+        self.ticks = 0
+        self.overruns = 0
+        self.planned = 0
+        self.throttled = 0
+        self.completed = 0
+        self.failed = 0
+        self.tick_durations = LatencyHistogram(resolution=1e-6)
+
+    def _run(self, item, tick_state):
+        started = time.monotonic()
+        try:
+            ok = self.transition(item)
+        except Exception as e:
+            print(f"Error in transition: {str(e)}")
+            ok = False
+        if self.limiter:
+            self.limiter.record(time.monotonic() - started, ok)
+
+        with self.lock:
+            self.inflight -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            tick_state["remaining"] -= 1
+            last = tick_state["remaining"] == 0
+        if last:
+            # tick内最后一个切换完成的时间即该tick的实际耗时
+            self.tick_durations.record(time.monotonic() - tick_state["start"])
+        return ok
+
+    def run_tick(self):
+        """执行一个tick，返回该tick的统计数据"""
+        start = time.monotonic()
+        if self.started is None:
+            self.started = start
+        deadline = start + self.interval
+
+        fleet = self.fleet_size()
+        planned = min(fleet, math.ceil(fleet * self.fraction)) if fleet else 0
+
+        limit = self.limiter.limit if self.limiter else self.max_inflight
+        with self.lock:
+            available = max(0, limit - self.inflight)
+        items = self.pick(min(planned, available))
+        tick_state = {"start": start, "remaining": len(items)}
+        with self.lock:
+            self.inflight += len(items)
+            inflight = self.inflight
+        if self.limiter:
+            self.limiter.observe(inflight)
+
+        futures = [self.executor.submit(self._run, item, tick_state) for item in items]
+        done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+
+        stats = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "fleet": fleet,
+            "planned": planned,
+            "submitted": len(items),
+            "throttled": planned - len(items),
+            "completed_in_tick": sum(1 for f in done if f.result()),
+            "failed_in_tick": sum(1 for f in done if not f.result()),
+            "pending": len(not_done),
+            "overrun": bool(not_done),
+            "inflight": self.inflight,
+            "limit": limit,
+        }
+
+        with self.lock:
+            self.ticks += 1
+            self.planned += planned
+            self.throttled += stats["throttled"]
+            if not_done:
+                self.overruns += 1
+
+        # 等到下一个tick边界
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return stats
+
+    def summary(self):
+        """累计的tick统计和实际达到的切换速率"""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        with self.lock:
+            return {
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+                "planned": self.planned,
+                "throttled": self.throttled,
+                "completed": self.completed,
+                "failed": self.failed,
+                "achieved_rate": self.completed / elapsed if elapsed > 0 else 0,
+                "target_rate": self.planned / elapsed if elapsed > 0 else 0,
+                "inflight_limit": self.limiter.limit if self.limiter else self.max_inflight,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,335 @@
+import argparse
+import copy
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import cleanup
+import op_trace
+import request_policy
+from e2b_client import E2BClient, ENDPOINT_TIMEOUTS, TEMPLATE_ID, sdk_options
+from histogram import ms_histogram, save_histograms
+from results_store import ResultWriter, read_records
+
+# 加载环境变量
+load_dotenv()
+
+# 回放 op_trace.py 录制的生命周期操作: 按原来的时间间隔(或N倍速、尽快)重新发出同样的操作，
+# 不同sandbox的操作并行，同一个sandbox的操作严格按录制顺序执行。
+
+RESULT_COLUMNS = ["index", "offset_s", "op", "sandbox", "recorded_ok", "ok", "status", "latency_ms",
+                  "service_time_ms", "send_lag_ms", "error"]
+REPLAY_PURPOSE = f"{cleanup.DEFAULT_PREFIX}-replay"
+
+
+def load_trace(paths):
+    """读取一个或多个录制文件，按发出时间排序；多个文件(如 --procs 的各worker)的逻辑ID加上文件序号区分"""
+    events = []
+    for file_index, path in enumerate(paths):
+        for entry in read_records(path):
+            if entry.get("op") not in op_trace.OPS or not entry.get("sandbox"):
+                continue
+            if len(paths) > 1:
+                entry["sandbox"] = f"{file_index}/{entry['sandbox']}"
+            events.append(entry)
+    events.sort(key=lambda e: e["ts"])
+    return events
+
+
+def parse_speed(value):
+    """回放速度: 1 / 1x 按原速，4 / 4x 四倍速，max 尽快发出(返回0)"""
+    text = value.strip().lower()
+    if text in ("max", "0", "asap"):
+        return 0.0
+    speed = float(text.rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError(f"回放速度必须大于0或为max: {value}")
+    return speed
+
+
+class Replayer:
+    """把录制的操作重新发到目标环境
+
+    speed > 0 时第 i 个操作计划在 (ts_i - ts_0) / speed 秒后发出，speed=0 时尽快发出；
+    同一个sandbox的上一个操作没完成时，下一个操作排队等待，等待时间计入 send_lag_ms。
+    录制开始前就已存在的sandbox(第一个操作不是create)在计时开始前先创建好并切换到对应状态。
+    """
+
+    def __init__(self, events, client, speed=1.0, max_workers=100, template=None, results=None):
+        self.events = events
+        self.client = client
+        self.speed = speed
+        self.template = template or TEMPLATE_ID
+        self.results = results
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.pending = 0
+        self.queues = defaultdict(deque)
+        self.busy = set()
+        # 逻辑ID -> 回放中创建的combined_id
+        self.ids = {}
+        self.handles = {}
+        self.uploads = None
+
+        self.service = defaultdict(ms_histogram)
+        self.latency = defaultdict(ms_histogram)
+        self.counts = defaultdict(lambda: {"ok": 0, "failed": 0, "skipped": 0})
+        self.send_lag = ms_histogram()
+
+    def _create(self, payload=None):
+        payload = dict(payload or {"timeout": 300})
+        payload["templateID"] = self.template
+        payload["metadata"] = cleanup.run_metadata(REPLAY_PURPOSE)
+        response = self.client.create_sandbox(payload)
+        if not response.succeeded:
+            raise RuntimeError(f"创建失败，状态码: {response.status_code}")
+        data = response.json()
+        return response, f"{data['sandboxID']}-{data['clientID']}"
+
+    def _exec(self, combined_id, payload):
+        """重新执行录制的代码执行: 连接sandbox、可选的ls、上传文件并运行"""
+        from e2b_code_interpreter import Sandbox
+        from uploads import UploadCache
+        with self.lock:
+            if self.uploads is None:
+                self.uploads = UploadCache()
+            sbx = self.handles.get(combined_id)
+        if sbx is None:
+            sbx = Sandbox.connect(sandbox_id=combined_id, **sdk_options())
+            with self.lock:
+                self.handles[combined_id] = sbx
+        if payload.get("ls"):
+            sbx.commands.run("ls -l /home/user")
+        files = payload.get("files") or []
+        if files:
+            command = f"python {self.uploads.remote_path(payload['run'])}"
+            self.uploads.run(sbx, files, command, background=bool(payload.get("background")))
+
+    def execute(self, event):
+        """执行一个操作，返回 (是否成功, 状态码)；没有对应sandbox时返回 (None, None) 表示跳过"""
+        op = event["op"]
+        logical = event["sandbox"]
+        payload = event.get("payload") or {}
+        if op == "create":
+            response, combined_id = self._create(payload)
+            with self.lock:
+                self.ids[logical] = combined_id
+            return True, response.status_code
+
+        with self.lock:
+            combined_id = self.ids.get(logical)
+        if combined_id is None:
+            return None, None
+        if op == "pause":
+            response = self.client.pause_sandbox(combined_id)
+        elif op == "resume":
+            response = self.client.resume_sandbox(combined_id, payload.get("timeout", 300))
+            # resume后旧连接不再可用
+            with self.lock:
+                self.handles.pop(combined_id, None)
+        elif op == "kill":
+            response = self.client.kill_sandbox(combined_id)
+            with self.lock:
+                self.ids.pop(logical, None)
+                self.handles.pop(combined_id, None)
+        else:
+            started = time.time()
+            try:
+                self._exec(combined_id, payload)
+            except Exception as e:
+                op_trace.record("exec", combined_id, payload, ts=started, ok=False, error=type(e).__name__)
+                raise
+            op_trace.record("exec", combined_id, payload, ts=started)
+            return True, None
+        return response.succeeded, response.status_code
+
+    def _run(self, index, event, intended):
+        actual = time.monotonic()
+        error = None
+        try:
+            ok, status = self.execute(event)
+        except Exception as e:
+            ok, status, error = False, None, str(e)[:200]
+        finished = time.monotonic()
+
+        op = event["op"]
+        with self.lock:
+            if ok is None:
+                self.counts[op]["skipped"] += 1
+            elif ok:
+                self.counts[op]["ok"] += 1
+                self.service[op].record((finished - actual) * 1000)
+                self.latency[op].record((finished - intended) * 1000)
+            else:
+                self.counts[op]["failed"] += 1
+            self.send_lag.record(max(0.0, actual - intended) * 1000)
+
+        if self.results:
+            self.results.write({
+                "index": index,
+                "offset_s": round(intended - self.started, 3),
+                "op": op,
+                "sandbox": event["sandbox"],
+                "recorded_ok": event.get("ok"),
+                "ok": ok,
+                "status": status,
+                "latency_ms": (finished - intended) * 1000,
+                "service_time_ms": (finished - actual) * 1000,
+                "send_lag_ms": (actual - intended) * 1000,
+                "error": error,
+            })
+
+        # 同一个sandbox的下一个操作在当前操作完成后才提交
+        with self.lock:
+            queue = self.queues[event["sandbox"]]
+            if queue:
+                self.executor.submit(self._run, *queue.popleft())
+            else:
+                self.busy.discard(event["sandbox"])
+                del self.queues[event["sandbox"]]
+            self.pending -= 1
+            if self.pending == 0:
+                self.done.notify_all()
+
+    def prepare(self):
+        """为录制开始前就存在的sandbox创建替身，第一个操作是resume时先暂停；不计入回放统计"""
+        first = {}
+        for event in self.events:
+            first.setdefault(event["sandbox"], event["op"])
+        needed = [logical for logical, op in first.items() if op != "create"]
+        if not needed:
+            return 0
+
+        def setup(logical):
+            _, combined_id = self._create()
+            if first[logical] == "resume":
+                response = self.client.pause_sandbox(combined_id)
+                if not response.succeeded:
+                    raise RuntimeError(f"暂停失败，状态码: {response.status_code}")
+            with self.lock:
+                self.ids[logical] = combined_id
+
+        failed = 0
+        for future in [self.executor.submit(setup, logical) for logical in needed]:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"准备sandbox失败: {e}")
+        print(f"已为录制前就存在的 {len(needed) - failed}/{len(needed)} 个sandbox创建替身")
+        return len(needed)
+
+    def run(self):
+        """按录制的节奏发出全部操作并等待完成，返回回放耗时(秒)"""
+        if not self.events:
+            return 0.0
+        t0 = self.events[0]["ts"]
+        self.started = time.monotonic()
+        for index, event in enumerate(self.events):
+            if self.speed > 0:
+                intended = self.started + (event["ts"] - t0) / self.speed
+                delay = intended - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                intended = time.monotonic()
+            with self.lock:
+                self.pending += 1
+                if event["sandbox"] in self.busy:
+                    self.queues[event["sandbox"]].append((index, event, intended))
+                    continue
+                self.busy.add(event["sandbox"])
+            self.executor.submit(self._run, index, event, intended)
+
+        with self.done:
+            while self.pending:
+                self.done.wait()
+        return time.monotonic() - self.started
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def recorded_stats(events):
+    """录制时各操作的成功数和耗时(ms)"""
+    stats = defaultdict(lambda: {"ok": 0, "failed": 0, "hist": ms_histogram()})
+    for event in events:
+        entry = stats[event["op"]]
+        if event.get("ok"):
+            entry["ok"] += 1
+            entry["hist"].record(event.get("latency_ms") or 0)
+        else:
+            entry["failed"] += 1
+    return stats
+
+
+def print_comparison(events, replayer, elapsed):
+    """对比录制时和回放时各操作的成功数和耗时"""
+    recorded = recorded_stats(events)
+    span = events[-1]["ts"] - events[0]["ts"] if events else 0
+    speed = f"{replayer.speed:g}x" if replayer.speed else "尽快"
+    print(f"\n=== 回放 {len(events)} 个操作 ({speed}): 录制时长 {span:.1f}s, 回放耗时 {elapsed:.1f}s ===")
+    print(f"{'操作':<8}{'录制 成功/失败':>16}{'回放 成功/失败/跳过':>22}{'录制 P50/P99 ms':>22}{'回放 P50/P99 ms':>22}")
+    for op in op_trace.OPS:
+        if op not in recorded:
+            continue
+        rec = recorded[op]
+        counts = replayer.counts[op]
+        rec_p = rec["hist"].percentiles(50, 99) if rec["hist"].count else (0, 0)
+        hist = replayer.service[op]
+        rep_p = hist.percentiles(50, 99) if hist.count else (0, 0)
+        print(f"{op:<8}{rec['ok']:>10}/{rec['failed']:<5}{counts['ok']:>12}/{counts['failed']}/{counts['skipped']:<5}"
+              f"{rec_p[0]:>13.1f}/{rec_p[1]:<8.1f}{rep_p[0]:>13.1f}/{rep_p[1]:<8.1f}")
+    if replayer.send_lag.count:
+        p50, p99 = replayer.send_lag.percentiles(50, 99)
+        print(f"发送滞后 (ms, 含等待同一sandbox的上一个操作): P50 {p50:.1f}, P99 {p99:.1f}, 最大 {replayer.send_lag.max:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a recorded trace of sandbox lifecycle operations')
+    parser.add_argument('traces', nargs='+', help='Trace files written with --record (one per worker process)')
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                      help='Replay speed: 1 (recorded pace), N or Nx (N times faster), max (as fast as possible)')
+    parser.add_argument('--max-workers', type=int, default=100,
+                      help='Max operations in flight across all sandboxes (default: 100)')
+    parser.add_argument('--template', default=None,
+                      help='Template for created sandboxes (default: $E2B_TEMPLATE_ID)')
+    parser.add_argument('--results', default="replay_results.csv",
+                      help='Per-operation replay results (default: replay_results.csv)')
+    parser.add_argument('--hist', default="replay_hist.csv",
+                      help='Replay latency histograms for compare_runs.py (default: replay_hist.csv)')
+    # 回放本身也可以录制，用来和原始录制逐条对比
+    op_trace.add_arguments(parser)
+    request_policy.add_arguments(parser)
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+
+    events = load_trace(args.traces)
+    sandboxes = len({event["sandbox"] for event in events})
+    print(f"读取 {len(events)} 个操作, {sandboxes} 个sandbox")
+    op_trace.from_args(args)
+
+    policies = request_policy.from_args(args, ENDPOINT_TIMEOUTS)
+    client = E2BClient(pool_size=args.max_workers, policies=policies)
+    with cleanup.from_args(args), ResultWriter(args.results, RESULT_COLUMNS) as results:
+        replayer = Replayer(copy.deepcopy(events), client, speed=args.speed, max_workers=args.max_workers,
+                            template=args.template, results=results)
+        try:
+            replayer.prepare()
+            elapsed = replayer.run()
+            print_comparison(events, replayer, elapsed)
+        finally:
+            replayer.close()
+            client.print_policy_stats()
+            client.close()
+
+    histograms = {op: hist for op, hist in replayer.service.items()}
+    histograms.update({f"{op}:latency": hist for op, hist in replayer.latency.items()})
+    histograms["send_lag"] = replayer.send_lag
+    save_histograms(args.hist, histograms, append=False)
+    print(f"回放结果已保存到 {args.results}，直方图保存到 {args.hist}")
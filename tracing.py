@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+
+from histogram import LatencyHistogram
+
+# 轻量级的分阶段span追踪
+#
+#   with tracing.span("create", sandbox_id=...) as sp:
+#       with tracing.span("files.write"):
+#           ...
+#
+# 未启用时 span() 直接返回一个共享的空对象，热路径上只有一次全局变量判断。
+# 启用后记录纳秒级单调时钟、线程ID、sandbox ID和父子关系，可导出为
+# Chrome trace / Perfetto 能直接打开的JSON，并按阶段名统计延迟直方图(秒)。
+
+_enabled = False
+_path = None
+_max_events = 1_000_000
+_events = []
+_dropped = 0
+_lock = threading.Lock()
+_local = threading.local()
+_epoch_ns = time.monotonic_ns()
+
+phase_histograms = {}
+
+
+class _NoopSpan:
+    sandbox_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "sandbox_id", "args", "start", "parent")
+
+    def __init__(self, name, sandbox_id, args):
+        self.name = name
+        self.sandbox_id = sandbox_id
+        self.args = args
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        # 子span默认继承父span的sandbox ID
+        if self.sandbox_id is None and self.parent is not None:
+            self.sandbox_id = self.parent.sandbox_id
+        stack.append(self)
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.monotonic_ns()
+        _local.stack.pop()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        record(self.name, self.start, end, sandbox_id=self.sandbox_id,
+               parent=self.parent.name if self.parent else None, **self.args)
+        return False
+
+    def set(self, **args):
+        """补充span属性，如创建完成后才知道的sandbox_id"""
+        if "sandbox_id" in args:
+            self.sandbox_id = args.pop("sandbox_id")
+        self.args.update(args)
+
+
+def span(name, sandbox_id=None, **args):
+    if not _enabled:
+        return _NOOP
+    return Span(name, sandbox_id, args)
+
+
+def record(name, start_ns, end_ns, sandbox_id=None, parent=None, **args):
+    """记录一段已经结束的span，供不能用上下文管理器的场景(如asyncio)直接调用"""
+    if not _enabled:
+        return
+    global _dropped
+    hist = phase_histograms.get(name)
+    if hist is None:
+        with _lock:
+            hist = phase_histograms.setdefault(name, LatencyHistogram(resolution=1e-6))
+    hist.record((end_ns - start_ns) / 1e9)
+
+    if len(_events) >= _max_events:
+        _dropped += 1
+        return
+    if sandbox_id is not None:
+        args["sandbox_id"] = sandbox_id
+    if parent is not None:
+        args["parent"] = parent
+    # list.append在GIL下是原子的，热路径不加锁
+    _events.append((name, start_ns, end_ns, threading.get_ident(), args))
+
+
+def enable(path=None, max_events=1_000_000):
+    """开启追踪，path不为空时 export() 默认写入该文件"""
+    global _enabled, _path, _max_events
+    _path = path
+    _max_events = max_events
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """清空已记录的事件和直方图(fork出的子进程需要调用)"""
+    global _events, _dropped
+    _events = []
+    _dropped = 0
+    phase_histograms.clear()
+
+
+def export(path=None):
+    """导出为Chrome trace JSON(时间单位微秒)，返回写入的事件数"""
+    path = path or _path
+    if not path:
+        return 0
+    pid = os.getpid()
+    events = list(_events)
+    trace = {
+        "traceEvents": [
+            {
+                "name": name,
+                "cat": "sandbox",
+                "ph": "X",
+                "ts": (start - _epoch_ns) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, start, end, tid, args in events
+        ],
+        "displayTimeUnit": "ms",
+        "otherData": {"dropped_events": _dropped},
+    }
+    with open(path, "w") as f:
+        json.dump(trace, f)
+    print(f"trace: {len(events)} spans -> {path}" + (f" (丢弃 {_dropped} 个)" if _dropped else ""))
+    return len(events)
+
+
+def print_phases(histograms=None):
+    """按阶段打印耗时统计"""
+    histograms = phase_histograms if histograms is None else histograms
+    if not histograms:
+        return
+    print("=== 各阶段耗时 ===")
+    for name, hist in sorted(histograms.items()):
+        p50, p90, p99 = hist.percentiles(50, 90, 99)
+        print(f"  {name}: count={hist.count} p50={p50:.4f}s p90={p90:.4f}s p99={p99:.4f}s avg={hist.mean:.4f}s")
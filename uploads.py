@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import io
+import os
+import tarfile
+import threading
+
+import tracing
+
+# bash -c 的单个参数最大128KB(MAX_ARG_STRLEN)，内联的base64留出余量
+INLINE_LIMIT = 96 * 1024
+
+
+class UploadCache:
+    """缓存待上传文件的内容，并把多个文件打包成一次传输
+
+    文件只在首次使用或mtime变化时从磁盘读取。bundle较小时以base64内联在命令里，
+    解包和执行在同一次 commands.run 中完成；超过 inline_limit 时先用一次
+    files.write 上传tar包，再在执行命令前解包。
+    传入 uploader (如 chunked_upload.ChunkedUploader) 时，大于 uploader.chunk_size 的文件
+    不读入内存也不打包，而是由 uploader 分块上传并校验，其余文件仍走tar包。
+    """
+
+    def __init__(self, paths=(), remote_dir="/home/user", inline_limit=INLINE_LIMIT, uploader=None):
+        self.remote_dir = remote_dir
+        self.inline_limit = inline_limit
+        self.uploader = uploader
+        self._lock = threading.Lock()
+        self._files = {}
+        self._bundles = {}
+        self.disk_reads = 0
+        for path in paths:
+            if not self.is_large(path):
+                self.read(path)
+
+    def _stat(self, path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def is_large(self, path):
+        """是否交给 uploader 分块上传"""
+        return self.uploader is not None and os.path.getsize(path) > self.uploader.chunk_size
+
+    def read(self, path):
+        """返回文件内容，mtime或大小变化时重新读取"""
+        version = self._stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == version:
+                return cached[1]
+        with open(path, "rb") as file:
+            data = file.read()
+        with self._lock:
+            self._files[path] = (version, data)
+            self.disk_reads += 1
+        return data
+
+    def bundle(self, paths):
+        """返回 (tar.gz内容, base64内联文本或None, sha256前缀)"""
+        key = tuple((path, self._stat(path)) for path in paths)
+        with self._lock:
+            cached = self._bundles.get(key)
+        if cached:
+            return cached
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            for path in paths:
+                data = self.read(path)
+                info = tarfile.TarInfo(name=os.path.basename(path))
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+        raw = buffer.getvalue()
+        encoded = base64.b64encode(raw).decode()
+        bundle = (raw, encoded if len(encoded) <= self.inline_limit else None,
+                  hashlib.sha256(raw).hexdigest()[:12])
+
+        with self._lock:
+            # 只保留每组文件的最新版本
+            for old in [k for k in self._bundles if [p for p, _ in k] == list(paths)]:
+                del self._bundles[old]
+            self._bundles[key] = bundle
+        return bundle
+
+    def install_command(self, sbx, paths):
+        """返回在sandbox中解包这些文件的shell命令，必要时先上传tar包"""
+        with tracing.span("upload.bundle"):
+            raw, encoded, digest = self.bundle(paths)
+        if encoded is not None:
+            return f"echo '{encoded}' | base64 -d | tar -xzf - -C {self.remote_dir}"
+        remote_bundle = f"/tmp/bundle_{digest}.tar.gz"
+        with tracing.span("files.write", size=len(raw)):
+            sbx.files.write(remote_bundle, raw)
+        return f"tar -xzf {remote_bundle} -C {self.remote_dir}"
+
+    def run(self, sbx, paths, command, **kwargs):
+        """上传paths并执行command，小文件只需一次往返"""
+        large = [path for path in paths if self.is_large(path)]
+        if large:
+            with tracing.span("upload.chunked", files=len(large)):
+                self.uploader.upload(sbx, large, self.remote_dir)
+            paths = [path for path in paths if path not in large]
+            if not paths:
+                with tracing.span("commands.run", background=kwargs.get("background", False)):
+                    return sbx.commands.run(command, **kwargs)
+        install = self.install_command(sbx, paths)
+        with tracing.span("commands.run", background=kwargs.get("background", False)):
+            return sbx.commands.run(f"{install} && {command}", **kwargs)
+
+    def remote_path(self, path):
+        return f"{self.remote_dir}/{os.path.basename(path)}"
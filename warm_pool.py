@@ -0,0 +1,359 @@
+import argparse
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+import cleanup
+import op_trace
+import request_policy
+from arrival import ArrivalScheduler, parse_profile
+from e2b_client import E2BClient, ENDPOINT_TIMEOUTS, TEMPLATE_ID
+from fleet_registry import PAUSED, RUNNING
+from histogram import ms_histogram, save_histograms
+from load_engine import run_open_loop_threads
+from results_store import ResultWriter
+
+# 加载环境变量
+load_dotenv()
+
+TIMEOUT = int(os.getenv("E2B_TIMEOUT", 600))
+RESULTS_FILE = "warm_pool_results.csv"
+RESULT_COLUMNS = ["mode", "index", "combined_id", "hit", "latency_ms", "service_time_ms", "send_lag_ms", "error"]
+
+
+def create_sandbox(client, purpose):
+    """用REST API创建一个sandbox，返回combined_id，失败抛出异常"""
+    payload = {
+        "templateID": TEMPLATE_ID,
+        "timeout": TIMEOUT,
+        "autoPause": True,
+        "metadata": cleanup.run_metadata(purpose)
+    }
+    response = client.create_sandbox(payload)
+    if not response.succeeded:
+        raise RuntimeError(f"创建失败，状态码: {response.status_code}, 错误: {response.text[:100]}")
+    data = response.json()
+    return f"{data['sandboxID']}-{data['clientID']}"
+
+
+def pause_sandbox(client, combined_id):
+    response = client.pause_sandbox(combined_id)
+    if not response.succeeded:
+        raise RuntimeError(f"暂停失败，状态码: {response.status_code}, 错误: {response.text[:100]}")
+
+
+def resume_sandbox(client, combined_id):
+    response = client.resume_sandbox(combined_id, TIMEOUT)
+    if not response.succeeded:
+        raise RuntimeError(f"恢复失败，状态码: {response.status_code}, 错误: {response.text[:100]}")
+
+
+def kill_sandbox(client, combined_id):
+    try:
+        client.kill_sandbox(combined_id)
+    except Exception as e:
+        print(f"删除 {combined_id} 失败: {e}")
+
+
+class WarmPool:
+    """预热sandbox池: 后台保持 size 个已创建好的sandbox，acquire 时直接取用
+
+    mode=paused 时补充的sandbox创建后立即暂停(不占运行配额)，acquire 需要一次resume；
+    mode=running 时直接交出。池中sandbox创建超过 max_age 秒后被淘汰(kill)并补充新的，避免撞上服务端TTL。
+    池为空时 acquire 退化为冷创建，记为未命中。
+    补充延迟(refill lag)为一个sandbox被取走到补上的sandbox可用之间的时间：安排补充时，
+    由取走(命中)触发的补充带上取走时间，只统计这些补充；淘汰过期sandbox或初始填充触发的补充不计入。
+    """
+
+    def __init__(self, client, size=10, mode=PAUSED, max_age=300, refill_workers=4, purpose=None):
+        self.client = client
+        self.size = size
+        self.mode = mode
+        self.max_age = max_age
+        # 在 cleanup.DEFAULT_PREFIX 下，崩溃后遗留的池中sandbox可以用 python cleanup.py 清理
+        self.purpose = purpose or f"{cleanup.DEFAULT_PREFIX}-warm-pool-{os.getpid()}"
+
+        self._cond = threading.Condition()
+        # (combined_id, 创建时间)，先进先出，最老的sandbox先被取走
+        self._ready = deque()
+        self._pending = 0
+        # 尚未安排补充的取走时间(只有命中才会从池中取走)
+        self._demands = deque()
+        self._retry_at = 0
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=refill_workers)
+        self._thread = threading.Thread(target=self._maintain, daemon=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.retired = 0
+        self.refill_failures = 0
+        self.refill_times = ms_histogram()
+        self.refill_lag = ms_histogram()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _maintain(self):
+        """后台线程: 淘汰过期的sandbox，把池补到 size 个"""
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                expired = []
+                while self._ready and now - self._ready[0][1] > self.max_age:
+                    expired.append(self._ready.popleft()[0])
+                deficit = 0
+                demands = []
+                if now >= self._retry_at:
+                    deficit = max(0, self.size - len(self._ready) - self._pending)
+                    self._pending += deficit
+                    # 先补被取走的，这些补充计入补充延迟
+                    while self._demands and len(demands) < deficit:
+                        demands.append(self._demands.popleft())
+                self.retired += len(expired)
+
+            for combined_id in expired:
+                self._executor.submit(kill_sandbox, self.client, combined_id)
+            for i in range(deficit):
+                self._executor.submit(self._refill, demands[i] if i < len(demands) else None)
+
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(timeout=1.0)
+
+    def _refill(self, demand=None):
+        """创建(并暂停)一个sandbox放入池中，demand 为触发这次补充的取走时间"""
+        start = time.monotonic()
+        combined_id = None
+        try:
+            combined_id = create_sandbox(self.client, self.purpose)
+            if self.mode == PAUSED:
+                pause_sandbox(self.client, combined_id)
+        except Exception as e:
+            print(f"补充sandbox失败: {e}")
+            if combined_id:
+                kill_sandbox(self.client, combined_id)
+            with self._cond:
+                self._pending -= 1
+                self.refill_failures += 1
+                # 取走的sandbox仍未补上，由下一次补充继续计时
+                if demand is not None:
+                    self._demands.appendleft(demand)
+                # 连续失败时不要立即重试，等1秒后由后台线程再补
+                self._retry_at = time.monotonic() + 1.0
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            self._pending -= 1
+            self.refill_times.record((now - start) * 1000)
+            stopped = self._stopped
+            if not stopped:
+                self._ready.append((combined_id, start))
+                if demand is not None:
+                    self.refill_lag.record((now - demand) * 1000)
+                self._cond.notify_all()
+        if stopped:
+            kill_sandbox(self.client, combined_id)
+
+    def wait_ready(self, timeout=None):
+        """等待池被填满，返回是否在超时前填满"""
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while len(self._ready) < self.size:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def acquire(self):
+        """取一个可用的sandbox，返回 (combined_id, 是否命中池)，失败抛出异常"""
+        with self._cond:
+            entry = self._ready.popleft() if self._ready else None
+            if entry:
+                self._demands.append(time.monotonic())
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._cond.notify_all()
+
+        if entry is None:
+            return create_sandbox(self.client, self.purpose), False
+        combined_id = entry[0]
+        if self.mode == PAUSED:
+            try:
+                resume_sandbox(self.client, combined_id)
+            except Exception:
+                kill_sandbox(self.client, combined_id)
+                raise
+        return combined_id, True
+
+    def release(self, combined_id):
+        """用完的sandbox不放回池中，后台删除"""
+        self._executor.submit(kill_sandbox, self.client, combined_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "ready": len(self._ready),
+                "pending": self._pending,
+                "hits": self.hits,
+                "misses": self.misses,
+                "retired": self.retired,
+                "refill_failures": self.refill_failures,
+            }
+
+    def close(self):
+        """停止补充并删除池中剩余的sandbox"""
+        with self._cond:
+            self._stopped = True
+            remaining = [combined_id for combined_id, _ in self._ready]
+            self._ready.clear()
+            self._cond.notify_all()
+        self._thread.join()
+        for combined_id in remaining:
+            self._executor.submit(kill_sandbox, self.client, combined_id)
+        self._executor.shutdown(wait=True)
+
+
+def benchmark(name, acquire, release, total, profile, max_in_flight, results):
+    """按到达模型开环发出 total 个acquire请求，返回 (延迟直方图, 命中延迟, 未命中延迟, 错误数)
+
+    延迟从计划发送时间算起(含排队)，拿到的sandbox立即交给 release。
+    """
+    latencies = ms_histogram()
+    by_hit = {True: ms_histogram(), False: ms_histogram()}
+    errors = [0]
+    scheduler = ArrivalScheduler(profile)
+
+    def on_done(record):
+        outcome = record["result"]
+        row = {"mode": name, "index": record["index"], "latency_ms": record["latency_ms"],
+               "service_time_ms": record["service_time_ms"], "send_lag_ms": record["send_lag_ms"]}
+        if isinstance(outcome, Exception):
+            errors[0] += 1
+            row["error"] = str(outcome)
+        else:
+            combined_id, hit = outcome
+            latencies.record(record["latency_ms"])
+            by_hit[hit].record(record["latency_ms"])
+            row.update(combined_id=combined_id, hit=hit)
+            release(combined_id)
+        results.write(row)
+        pbar.update(1)
+
+    with tqdm(total=total, desc=f"acquire ({name})") as pbar:
+        run_open_loop_threads(
+            lambda index: acquire(),
+            total=total,
+            scheduler=scheduler,
+            max_in_flight=max_in_flight,
+            on_done=on_done,
+            collect=False
+        )
+    scheduler.print_lag()
+    return latencies, by_hit[True], by_hit[False], errors[0]
+
+
+def print_row(title, hist):
+    if hist.count:
+        p50, p90, p99 = hist.percentiles(50, 90, 99)
+        print(f"  {title:<14} count={hist.count:<6} P50 {p50:9.2f}ms  P90 {p90:9.2f}ms  P99 {p99:9.2f}ms  "
+              f"max {hist.max:9.2f}ms")
+
+
+def run(args):
+    client = E2BClient(pool_size=args.max_in_flight + args.refill_workers,
+                       policies=request_policy.from_args(args, ENDPOINT_TIMEOUTS))
+    results = ResultWriter(RESULTS_FILE, columns=RESULT_COLUMNS)
+    histograms = {}
+    try:
+        pool = WarmPool(client, size=args.size, mode=args.mode, max_age=args.max_age,
+                        refill_workers=args.refill_workers).start()
+        print(f"预热池: {args.size} 个 {args.mode} sandbox, 最长保留 {args.max_age}s, 补充并发 {args.refill_workers}")
+        fill_start = time.monotonic()
+        if not pool.wait_ready(timeout=args.fill_timeout):
+            print(f"警告: {args.fill_timeout}s 内没有填满预热池 ({pool.stats()})")
+        print(f"预热完成, 耗时 {time.monotonic() - fill_start:.2f}s")
+
+        try:
+            latencies, hits, misses, errors = benchmark(
+                "pool", pool.acquire, pool.release, args.requests, args.profile, args.max_in_flight, results)
+        finally:
+            stats = pool.stats()
+            pool.close()
+        histograms.update({"acquire:pool": latencies, "acquire:pool_hit": hits, "acquire:pool_miss": misses,
+                           "refill": pool.refill_times, "refill_lag": pool.refill_lag})
+
+        cold = None
+        if not args.no_baseline:
+            purpose = f"{cleanup.DEFAULT_PREFIX}-warm-pool-cold-{os.getpid()}"
+            cold, _, _, cold_errors = benchmark(
+                "cold", lambda: (create_sandbox(client, purpose), False),
+                lambda combined_id: kill_sandbox(client, combined_id),
+                args.requests, args.profile, args.max_in_flight, results)
+            histograms["acquire:cold"] = cold
+    finally:
+        results.close()
+
+    served = stats["hits"] + stats["misses"]
+    print(f"\n预热池 ({args.mode}, size={args.size}): 命中率 {stats['hits'] / served * 100 if served else 0:.1f}% "
+          f"({stats['hits']}/{served}), 错误 {errors}, 淘汰 {stats['retired']}, 补充失败 {stats['refill_failures']}")
+    print_row("pool", latencies)
+    print_row("pool 命中", hits)
+    print_row("pool 未命中", misses)
+    print_row("补充耗时", pool.refill_times)
+    print_row("补充延迟", pool.refill_lag)
+    if cold is not None:
+        print(f"冷创建基线: 错误 {cold_errors}")
+        print_row("cold", cold)
+        if latencies.count and cold.count:
+            for p in (50, 99):
+                print(f"  P{p}: 预热池 {latencies.percentile(p):.2f}ms vs 冷创建 {cold.percentile(p):.2f}ms "
+                      f"({cold.percentile(p) / max(latencies.percentile(p), 1e-3):.1f}x)")
+    client.print_policy_stats()
+
+    histograms.update(client.policy_histograms())
+    save_histograms("warm_pool_hist.csv", histograms, append=False)
+    print(f"结果已保存到 {RESULTS_FILE} / warm_pool_hist.csv")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Warm sandbox pool with an acquire-latency benchmark '
+                                                 'against cold creation')
+    parser.add_argument('--size', type=int, default=10,
+                      help='Warm sandboxes kept ready in the pool (default: 10)')
+    parser.add_argument('--mode', choices=[PAUSED, RUNNING], default=PAUSED,
+                      help='Keep pooled sandboxes paused (acquire = resume) or running (default: paused)')
+    parser.add_argument('--max-age', type=float, default=300,
+                      help='Retire pooled sandboxes this many seconds after creation (default: 300)')
+    parser.add_argument('--refill-workers', type=int, default=4,
+                      help='Concurrent background refills (default: 4)')
+    parser.add_argument('--fill-timeout', type=float, default=300,
+                      help='Max seconds to wait for the initial fill (default: 300)')
+    parser.add_argument('--requests', type=int, default=100,
+                      help='Acquire requests to issue in each benchmark (default: 100)')
+    parser.add_argument('--profile', type=parse_profile, default="constant:1",
+                      help='Arrival profile of acquire requests (default: constant:1): constant:RATE | '
+                           'ramp:START:END:SECONDS | step:RATExSECONDS,... | poisson:RATE[:BURST]')
+    parser.add_argument('--max-in-flight', type=int, default=20,
+                      help='Max concurrent acquire requests (default: 20)')
+    parser.add_argument('--no-baseline', action='store_true',
+                      help='Skip the cold-create baseline run')
+    request_policy.add_arguments(parser)
+    op_trace.add_arguments(parser)
+    cleanup.add_arguments(parser)
+    args = parser.parse_args()
+    op_trace.from_args(args)
+    with cleanup.from_args(args):
+        run(args)
@@ -0,0 +1,207 @@
+import base64
+import copy
+import json
+import os
+import shlex
+
+# 默认负载: 与原来的press脚本相同，4个π计算进程，nice值依次为5/10/15/20
+DEFAULT_MANIFEST = {
+    # 持续计算π的CPU进程: 每次迭代校准为约 cpu_seconds 秒CPU，digits 不为0时改为固定位数
+    "cpu": {"procs": 4, "nice_step": 5, "cpu_seconds": 1.0, "digits": 0, "max_digits": 1000000},
+    # 反复在两块内存之间拷贝，占用内存带宽
+    "memory": {"procs": 0, "mb": 256},
+    # 循环写入/fsync/读回/删除文件，占用磁盘IO
+    "disk": {"procs": 0, "mb": 256, "block_kb": 1024, "fsync": True},
+    # 负载持续秒数，0表示一直运行直到sandbox被销毁
+    "duration": 0,
+    # 启动后等待多久再检查进程和负载
+    "settle": 1.0,
+    "workdir": "/home/user/press",
+}
+
+KINDS = ("cpu", "memory", "disk")
+SUMMARY_MARKER = "WORKLOAD_SUMMARY "
+SCRIPT_NAME = "press_workload.py"
+# CPU负载直接使用仓库里的 pi.py，与启动脚本一起写入workdir
+PI_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pi.py")
+
+# 在sandbox里执行的启动脚本: 不带参数(只传manifest)时启动所有负载进程并输出健康摘要，
+# 以 worker KIND INDEX 参数启动时作为单个负载进程运行
+LAUNCHER = r'''
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+MANIFEST_FILE = "manifest.json"
+
+
+def cpu_worker(index, cfg, running):
+    import pi
+    pi.burn(digits=int(cfg.get("digits") or 0), cpu_seconds=float(cfg.get("cpu_seconds", 1.0)),
+            max_digits=int(cfg.get("max_digits", pi.MAX_DIGITS)), running=running, label=f"cpu #{index}")
+
+
+def memory_worker(index, cfg, running):
+    size = int(cfg["mb"]) * 1024 * 1024
+    src = bytearray(os.urandom(1024 * 1024)) * int(cfg["mb"])
+    dst = bytearray(size)
+    while running():
+        start = time.time()
+        for _ in range(10):
+            dst[:] = src
+        print(f"memory #{index} {10 * size / (time.time() - start) / 1e6:.0f} MB/s", flush=True)
+
+
+def disk_worker(index, cfg, running):
+    block = os.urandom(int(cfg["block_kb"]) * 1024)
+    blocks = max(1, int(cfg["mb"]) * 1024 // int(cfg["block_kb"]))
+    path = f"disk_{index}.dat"
+    while running():
+        start = time.time()
+        with open(path, "wb") as f:
+            for _ in range(blocks):
+                f.write(block)
+            if cfg.get("fsync", True):
+                f.flush()
+                os.fsync(f.fileno())
+        with open(path, "rb") as f:
+            while f.read(len(block)):
+                pass
+        os.remove(path)
+        print(f"disk #{index} {2 * blocks * len(block) / (time.time() - start) / 1e6:.0f} MB/s", flush=True)
+
+
+WORKERS = {"cpu": cpu_worker, "memory": memory_worker, "disk": disk_worker}
+
+
+def run_worker(kind, index, nice):
+    with open(MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    if nice:
+        os.nice(nice)
+    duration = float(manifest.get("duration", 0))
+    deadline = time.time() + duration if duration > 0 else None
+    WORKERS[kind](index, manifest[kind], lambda: deadline is None or time.time() < deadline)
+
+
+def read_meminfo():
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0]) // 1024
+    return info
+
+
+def launch(manifest):
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f)
+
+    procs = []
+    for kind in ("cpu", "memory", "disk"):
+        cfg = manifest.get(kind) or {}
+        for index in range(1, int(cfg.get("procs", 0)) + 1):
+            nice = int(cfg.get("nice_step", 0)) * index
+            log = open(f"{kind}_{index}.log", "w")
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", kind, str(index), str(nice)],
+                                    stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                    start_new_session=True)
+            procs.append((kind, proc))
+
+    with open("pids", "w") as f:
+        f.write("".join(f"{kind} {proc.pid}\n" for kind, proc in procs))
+
+    time.sleep(float(manifest.get("settle", 1.0)))
+
+    expected = {kind: int((manifest.get(kind) or {}).get("procs", 0)) for kind in ("cpu", "memory", "disk")}
+    running = dict.fromkeys(expected, 0)
+    exited = []
+    for kind, proc in procs:
+        if proc.poll() is None:
+            running[kind] += 1
+        else:
+            exited.append({"kind": kind, "pid": proc.pid, "code": proc.returncode})
+
+    meminfo = read_meminfo()
+    with open("/proc/loadavg") as f:
+        loadavg = [float(x) for x in f.read().split()[:3]]
+    summary = {
+        "ok": running == expected,
+        "expected": expected,
+        "running": running,
+        "exited": exited,
+        "pids": [proc.pid for _, proc in procs],
+        "cpus": os.cpu_count(),
+        "loadavg": loadavg,
+        "mem_total_mb": meminfo.get("MemTotal"),
+        "mem_available_mb": meminfo.get("MemAvailable"),
+        "disk_free_mb": shutil.disk_usage(".").free // (1024 * 1024),
+    }
+    print("WORKLOAD_SUMMARY " + json.dumps(summary), flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        run_worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        launch(json.loads(sys.argv[1]))
+'''
+
+
+def load_manifest(path=None, overrides=None):
+    """读取manifest(JSON文件)并与默认值合并，overrides 为 {"cpu.procs": 8} 形式的覆盖项"""
+    manifest = copy.deepcopy(DEFAULT_MANIFEST)
+    if path:
+        with open(path) as f:
+            loaded = json.load(f)
+        for key, value in loaded.items():
+            if isinstance(value, dict) and isinstance(manifest.get(key), dict):
+                manifest[key].update(value)
+            else:
+                manifest[key] = value
+    for key, value in (overrides or {}).items():
+        if value is None:
+            continue
+        section, _, field = key.partition(".")
+        if field:
+            manifest[section][field] = value
+        else:
+            manifest[section] = value
+    return manifest
+
+
+def launch_command(manifest):
+    """生成一条shell命令: 写入启动脚本和 pi.py、启动全部负载进程并输出健康摘要"""
+    workdir = manifest["workdir"]
+    encoded = base64.b64encode(LAUNCHER.encode()).decode()
+    with open(PI_SOURCE_PATH, "rb") as f:
+        pi_encoded = base64.b64encode(f.read()).decode()
+    return (f"mkdir -p {shlex.quote(workdir)} && cd {shlex.quote(workdir)} && "
+            f"echo '{pi_encoded}' | base64 -d > pi.py && "
+            f"echo '{encoded}' | base64 -d > {SCRIPT_NAME} && "
+            f"python3 {SCRIPT_NAME} {shlex.quote(json.dumps(manifest, separators=(',', ':')))}")
+
+
+def parse_summary(stdout):
+    """从命令输出中取出健康摘要，没有找到时返回None"""
+    for line in reversed((stdout or "").splitlines()):
+        if line.startswith(SUMMARY_MARKER):
+            return json.loads(line[len(SUMMARY_MARKER):])
+    return None
+
+
+def describe(manifest):
+    parts = []
+    for kind in KINDS:
+        cfg = manifest[kind]
+        if cfg.get("procs"):
+            if kind == "cpu":
+                extra = f" {cfg['digits']}位" if cfg.get("digits") else f" {cfg.get('cpu_seconds', 1.0)}CPU秒/次"
+            else:
+                extra = f" {cfg['mb']}MB" if "mb" in cfg else ""
+            parts.append(f"{kind} x{cfg['procs']}{extra}")
+    duration = manifest.get("duration") or 0
+    return ", ".join(parts or ["无负载"]) + (f", 持续 {duration} 秒" if duration else ", 持续运行")